@@ -9,3 +9,9 @@ load_dotenv(dotenv_path)
 
 DWH_SCRIPT = os.environ.get("DWH_SCRIPT")
 QUERY_SCRIPT_HOME = os.environ.get("QUERY_SCRIPT_HOME")
+# Default: <AIRFLOW_HOME>/artifacts (AIRFLOW_HOME defaults to ~/airflow as in Airflow itself)
+ARTIFACT_HOME = os.environ.get(
+    "ARTIFACT_HOME", join(os.environ.get("AIRFLOW_HOME", os.path.expanduser("~/airflow")), "artifacts")
+)
+YAHOOFINANCIALS_CACHE_HOME = os.environ.get("YAHOOFINANCIALS_CACHE_HOME")
+MARKET_CALENDAR_HOME = os.environ.get("MARKET_CALENDAR_HOME")
@@ -0,0 +1,98 @@
+"""
+Artifact store of the load DAGs: the data passed between tasks is written to Parquet (or JSON) files under
+ARTIFACT_HOME/<dag_id>/<run_id>/ and only the file path is passed by XCom, so the rows are not
+serialized into the Airflow metadata DB. ARTIFACT_HOME must be shared by the workers running the tasks.
+Without ARTIFACT_HOME, <AIRFLOW_HOME>/artifacts is used.
+"""
+
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+
+import re
+import json
+import time
+import shutil
+import pyarrow as pa
+import pyarrow.parquet as pq
+import airflow_env_variables
+
+
+def _get_run_dir(dag_id, run_id):
+    # run_id contains ":" and "+" (e.g. scheduled__2023-01-01T01:00:00+00:00)
+    return os.path.join(airflow_env_variables.ARTIFACT_HOME, dag_id, re.sub(r"[^0-9A-Za-z_.-]", "_", run_id))
+
+
+def save_rows(ti, name, rows, columns):
+    """
+    Write <rows> ([[value, ...], ...] in the order of <columns>) to a Parquet file and return its path.
+    """
+    run_dir = _get_run_dir(ti.dag_id, ti.run_id)
+    os.makedirs(run_dir, exist_ok=True)
+    path = os.path.join(run_dir, f"{name}.parquet")
+
+    values = list(zip(*rows)) if len(rows) > 0 else [[] for _ in columns]
+    table = pa.table({column: list(value) for column, value in zip(columns, values)})
+    # Write to a temporary file first, so a retried task never reads a partially written file.
+    pq.write_table(table, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def load_rows(path):
+    """
+    Read the rows written by save_rows: [[value, ...], ...]
+    """
+    table = pq.read_table(path)
+    columns = [column.to_pylist() for column in table.columns]
+    return [list(row) for row in zip(*columns)]
+
+
+def save_candle_data(ti, name, candle_data):
+    """
+    Write the raw candles of the Poloniex REST API ({asset: [candle, ...]}) with the asset as the first column.
+    """
+    rows = [[asset] + list(candle) for asset, candles in candle_data.items() if candles for candle in candles]
+    num_fields = len(rows[0]) - 1 if len(rows) > 0 else 0
+    return save_rows(ti, name, rows, ["asset"] + [f"f{i}" for i in range(num_fields)])
+
+
+def load_candle_data(path):
+    candle_data = {}
+    for row in load_rows(path):
+        candle_data.setdefault(row[0], []).append(row[1:])
+    return candle_data
+
+
+def save_json(ti, name, data):
+    """
+    Write a JSON document (e.g. the raw response of Yahoo Financials) to a file and return its path.
+    """
+    run_dir = _get_run_dir(ti.dag_id, ti.run_id)
+    os.makedirs(run_dir, exist_ok=True)
+    path = os.path.join(run_dir, f"{name}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def load_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def remove_artifacts(ti, keep_days=7):
+    """
+    Remove the artifacts of this run and of the runs older than <keep_days> days (e.g. failed runs).
+    """
+    shutil.rmtree(_get_run_dir(ti.dag_id, ti.run_id), ignore_errors=True)
+
+    dag_dir = os.path.join(airflow_env_variables.ARTIFACT_HOME, ti.dag_id)
+    if not os.path.isdir(dag_dir):
+        return
+    ts_expire = time.time() - 60 * 60 * 24 * keep_days
+    for run_dir in os.listdir(dag_dir):
+        run_dir = os.path.join(dag_dir, run_dir)
+        if os.path.getmtime(run_dir) < ts_expire:
+            shutil.rmtree(run_dir, ignore_errors=True)
@@ -0,0 +1,123 @@
+"""
+Resumable backfill of Poloniex candles.
+The range is split into windows of <window_size> seconds aligned to the unix epoch, so every run splits it
+in the same way. Each completed window of an asset is saved in <keyspace>.backfill_progress after its
+candles are inserted, and a run only fetches the windows not completed yet (e.g. after a failure,
+or the whole range for a new asset).
+Assets run in parallel and share one rate-limited fetcher. Each asset holds the candles of at most
+<chunk_size> windows at once.
+"""
+
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+
+import airflow_env_variables
+
+sys.path.append(airflow_env_variables.DWH_SCRIPT)
+import logging
+import traceback
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from cassandra_operations import cassandra_operator
+from poloniex_apis import rest_api
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_TABLE = "backfill_progress"
+
+
+class CandleBackfill:
+    def __init__(
+        self,
+        job_id: str,
+        keyspace: str,
+        interval: str,
+        insert_func,
+        window_size: int = 60 * 500,
+        chunk_size: int = 20,
+        max_assets: int = 4,
+        fetcher: rest_api.CandleFetcher = None,
+    ):
+        self.job_id = job_id
+        self.interval = interval
+        self.insert_func = insert_func
+        self.window_size = window_size
+        self.chunk_size = chunk_size
+        self.max_assets = max_assets
+        self.fetcher = fetcher if fetcher is not None else rest_api.CandleFetcher()
+        self.cass_ope = cassandra_operator.Operator(keyspace)
+
+    def get_windows(self, from_time: int, to_time: int) -> list:
+        """
+        Return [[start, end], ...] of the windows covering <from_time> to <to_time>.
+        """
+        first_start = int(from_time) - int(from_time) % self.window_size
+        return [[start, start + self.window_size] for start in range(first_start, int(to_time), self.window_size)]
+
+    def get_completed_windows(self, asset: str) -> set:
+        query = f"""
+        select window_start from {PROGRESS_TABLE} where job_id = '{self.job_id}' and id = '{asset}'
+        """
+        return set(int(row[0]) for row in self.cass_ope.run_query(query))
+
+    def _save_progress(self, asset: str, windows: list, num_records: dict):
+        query = f"""
+        INSERT INTO {PROGRESS_TABLE} (job_id,id,window_start,window_end,num_records,ts_complete_utc)\
+            VALUES (%s,%s,%s,%s,%s,%s)
+        """
+        ts_complete_utc = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        batch_data = [
+            [self.job_id, asset, start, end, num_records.get(start, 0), ts_complete_utc] for start, end in windows
+        ]
+        self.cass_ope.insert_batch_data(query, batch_data)
+
+    def run_asset(self, asset: str, from_time: int, to_time: int) -> int:
+        """
+        Fetch, insert and save the progress of the windows of <asset> not completed yet, <chunk_size> windows
+        at a time. Return the number of candles loaded.
+        """
+        completed = self.get_completed_windows(asset)
+        windows = [window for window in self.get_windows(from_time, to_time) if window[0] not in completed]
+        logger.info("{}: {} windows to load ({} completed before)".format(asset, len(windows), len(completed)))
+
+        num_loaded = 0
+        for i in range(0, len(windows), self.chunk_size):
+            chunk = windows[i : i + self.chunk_size]
+            requests = [[asset, start, end] for start, end in chunk]
+            candle_data = self.fetcher.fetch(requests, self.interval)
+            if len(candle_data.get(asset, [])) > 0:
+                self.insert_func(candle_data)
+
+            # startTime (milliseconds) of each candle: index 12
+            num_records = {}
+            for d in candle_data.get(asset, []):
+                start = int(d[12]) // 1000
+                start -= start % self.window_size
+                num_records[start] = num_records.get(start, 0) + 1
+            # The window of <to_time> is not complete yet and is loaded again next time.
+            self._save_progress(asset, [window for window in chunk if window[1] <= to_time], num_records)
+
+            num_loaded += len(candle_data.get(asset, []))
+            num_done = min(i + self.chunk_size, len(windows))
+            logger.info("{}: {}/{} windows loaded ({} candles)".format(asset, num_done, len(windows), num_loaded))
+        return num_loaded
+
+    def run(self, assets: list, from_time: int, to_time: int) -> dict:
+        """
+        Run the assets in parallel and return the assets failed: {asset: error}.
+        An asset failing does not stop the others, and the next run resumes it.
+        """
+        failed = {}
+
+        def _run_asset(asset):
+            try:
+                self.run_asset(asset, from_time, to_time)
+            except Exception as error:
+                logger.error("{}: Backfill failed ({})".format(asset, error))
+                logger.error(traceback.format_exc())
+                failed[asset] = str(error)
+
+        with ThreadPoolExecutor(max_workers=self.max_assets) as executor:
+            list(executor.map(_run_asset, assets))
+        return failed
@@ -5,10 +5,15 @@ sys.path.append(os.path.join(os.path.dirname(__file__)))
 import airflow_env_variables
 
 sys.path.append(airflow_env_variables.DWH_SCRIPT)
+from collections import deque
 from cassandra_operations import cassandra_operator
 
 
 def insert_data(keyspace, candle_data, query):
+    # Nothing to insert (e.g. the fetch was skipped on a market holiday)
+    if len(candle_data) == 0:
+        return
+
     cass_ope = cassandra_operator.Operator(keyspace)
 
     batch_size = 100
@@ -21,6 +26,38 @@ def insert_data(keyspace, candle_data, query):
     cass_ope.insert_batch_data(query, candle_data[curr_index:])
 
 
+def insert_stream(keyspace, rows, query, partition_key_indexes, batch_size=100, concurrency=16):
+    """
+    Write the rows of an iterable (e.g. a generator) while it is consumed and return the number of rows.
+    Every <batch_size> rows are submitted asynchronously with at most <concurrency> requests in flight,
+    so only a few batches are held in memory at once.
+    """
+    cass_ope = cassandra_operator.Operator(keyspace)
+    writer = cassandra_operator.BulkWriter(
+        cass_ope, query, partition_key_indexes, concurrency=concurrency, max_batch_size=batch_size
+    )
+
+    futures = deque()
+    buffer = []
+    num_rows = 0
+    for row in rows:
+        buffer.append(row)
+        if len(buffer) < batch_size:
+            continue
+        futures.extend(writer.write_async(buffer))
+        num_rows += len(buffer)
+        buffer = []
+        # The oldest requests are done in most cases. result() raises the error of a failed request.
+        while len(futures) > concurrency * 2:
+            futures.popleft().result()
+
+    futures.extend(writer.write_async(buffer))
+    num_rows += len(buffer)
+    for future in futures:
+        future.result()
+    return num_rows
+
+
 def check_latest_dt(keyspace, query):
     cass_ope = cassandra_operator.Operator(keyspace)
     res = cass_ope.run_query(query)
@@ -28,6 +65,13 @@ def check_latest_dt(keyspace, query):
     return res
 
 
+def select_data(keyspace, query):
+    cass_ope = cassandra_operator.Operator(keyspace)
+    res = cass_ope.run_query(query)
+
+    return list(res)
+
+
 def create_table(keyspace, query):
     cass_ope = cassandra_operator.Operator(keyspace)
     cass_ope.run_query(query)
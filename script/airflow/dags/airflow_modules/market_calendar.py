@@ -0,0 +1,171 @@
+"""
+Trading days of each market, precomputed from pandas_market_calendars.
+The index of a day covers the years from <YEAR_MARGIN> years before to <YEAR_MARGIN> years after the day.
+It is built once, kept in this process and saved to <MARKET_CALENDAR_HOME>/<market>_<start year>_<end year>.json,
+so the lookups do not create a calendar and a schedule each time.
+"""
+
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+
+import json
+import time
+import logging
+from datetime import date, datetime
+import airflow_env_variables
+
+logger = logging.getLogger(__name__)
+
+YEAR_MARGIN = 1
+# Holidays can be added on short notice (e.g. a national day of mourning), so the saved index is rebuilt weekly.
+CALENDAR_TTL = 60 * 60 * 24 * 7
+
+_indexes = {}
+
+
+def _to_date(day):
+    if isinstance(day, datetime):
+        return day.date()
+    if isinstance(day, date):
+        return day
+    return datetime.strptime(str(day)[:10], "%Y-%m-%d").date()
+
+
+def _to_dt(ordinal):
+    return None if ordinal is None else date.fromordinal(ordinal).strftime("%Y-%m-%d")
+
+
+class TradingDayIndex:
+    """
+    Trading days of <market> from <start_year> to <end_year>.
+    The previous and the next trading days of every day of the range are precomputed,
+    so is_open/next_open/prev_open are one list access.
+    """
+
+    def __init__(self, market, start_year, end_year, trading_days):
+        self.market = market
+        self.start_year = start_year
+        self.end_year = end_year
+        self.first_ordinal = date(start_year, 1, 1).toordinal()
+        num_days = date(end_year, 12, 31).toordinal() - self.first_ordinal + 1
+
+        self.opens = [False] * num_days
+        for day in trading_days:
+            self.opens[_to_date(day).toordinal() - self.first_ordinal] = True
+
+        # next_opens[i] / prev_opens[i]: ordinal of the first trading day after / before the day i (None: out of range)
+        self.next_opens = [None] * num_days
+        self.prev_opens = [None] * num_days
+        next_ordinal = None
+        for i in reversed(range(num_days)):
+            self.next_opens[i] = next_ordinal
+            if self.opens[i]:
+                next_ordinal = self.first_ordinal + i
+        prev_ordinal = None
+        for i in range(num_days):
+            self.prev_opens[i] = prev_ordinal
+            if self.opens[i]:
+                prev_ordinal = self.first_ordinal + i
+
+    def _get_position(self, day):
+        position = _to_date(day).toordinal() - self.first_ordinal
+        if position < 0 or position >= len(self.opens):
+            raise ValueError(
+                "{} is out of the index of {} ({}-{})".format(day, self.market, self.start_year, self.end_year)
+            )
+        return position
+
+    def is_open(self, day):
+        return self.opens[self._get_position(day)]
+
+    def next_open(self, day):
+        return _to_dt(self.next_opens[self._get_position(day)])
+
+    def prev_open(self, day):
+        return _to_dt(self.prev_opens[self._get_position(day)])
+
+    def get_trading_days(self):
+        return [_to_dt(self.first_ordinal + i) for i, is_open in enumerate(self.opens) if is_open]
+
+
+def _get_index_path(market, start_year, end_year):
+    return os.path.join(airflow_env_variables.MARKET_CALENDAR_HOME, f"{market}_{start_year}_{end_year}.json")
+
+
+def _read_index(market, start_year, end_year):
+    path = _get_index_path(market, start_year, end_year)
+    if not os.path.exists(path) or time.time() - os.path.getmtime(path) > CALENDAR_TTL:
+        return None
+    with open(path, "r") as f:
+        return TradingDayIndex(market, start_year, end_year, json.load(f)["trading_days"])
+
+
+def _write_index(index):
+    path = _get_index_path(index.market, index.start_year, index.end_year)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = {
+        "market": index.market,
+        "start_year": index.start_year,
+        "end_year": index.end_year,
+        "trading_days": index.get_trading_days(),
+    }
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+def build_index(market, start_year, end_year):
+    import pandas_market_calendars as mcal
+
+    logger.info("Build the trading days of {} from {} to {}".format(market, start_year, end_year))
+    calendar = mcal.get_calendar(market)
+    schedule = calendar.schedule(start_date=f"{start_year}-01-01", end_date=f"{end_year}-12-31")
+    return TradingDayIndex(market, start_year, end_year, schedule.index)
+
+
+def get_index(market, day):
+    """
+    Return the trading day index of <market> covering <day>: memoized, then the saved file, then built.
+    """
+    year = _to_date(day).year
+    key = (market, year - YEAR_MARGIN, year + YEAR_MARGIN)
+    if key in _indexes:
+        return _indexes[key]
+
+    use_file = airflow_env_variables.MARKET_CALENDAR_HOME is not None
+    index = _read_index(*key) if use_file else None
+    if index is None:
+        index = build_index(*key)
+        if use_file:
+            _write_index(index)
+    _indexes[key] = index
+    return index
+
+
+def is_market_open(day, market):
+    return get_index(market, day).is_open(day)
+
+
+def next_open(day, market):
+    """
+    Return the first trading day after <day> ("%Y-%m-%d").
+    """
+    return get_index(market, day).next_open(day)
+
+
+def prev_open(day, market):
+    """
+    Return the last trading day before <day> ("%Y-%m-%d").
+    """
+    return get_index(market, day).prev_open(day)
+
+
+def has_trading_day(from_day, to_day, market):
+    """
+    Return True if <market> opens on any day from <from_day> to <to_day> (both inclusive).
+    """
+    if is_market_open(from_day, market):
+        return True
+    day = next_open(from_day, market)
+    return day is not None and _to_date(day) <= _to_date(to_day)
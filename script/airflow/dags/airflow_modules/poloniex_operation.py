@@ -3,12 +3,43 @@ import sys, os
 sys.path.append(os.path.join(os.path.dirname(__file__)))
 
 import airflow_env_variables
+import utils
+import cassandra_operation
 
 sys.path.append(airflow_env_variables.DWH_SCRIPT)
 from poloniex_apis import rest_api
 
 
 def get_candle_data(asset, interval, start, end):
-    polo_operator = rest_api.PoloniexOperator()
-    raw_candle_data = polo_operator.get_candles(asset, interval, start, end)
+    # The keep-alive session of the worker process is reused across calls.
+    polo_client = rest_api.get_session_client()
+    raw_candle_data = polo_client.get_candles(asset, interval, start, end)
     return raw_candle_data
+
+
+def get_session_stats():
+    return rest_api.get_session_client().get_stats()
+
+
+def get_candle_data_parallel(requests, interval, rate_limit=10, max_workers=8, max_retry_count=5):
+    """
+    Get the candles of [[asset, from, to], ...] concurrently under the rate limit of Poloniex.
+    """
+    fetcher = rest_api.CandleFetcher(rate_limit=rate_limit, max_workers=max_workers, max_retry_count=max_retry_count)
+    return fetcher.fetch(requests, interval)
+
+
+def load_candle_data_to_cassandra(requests, interval, keyspace, query, rate_limit=10, max_workers=8):
+    """
+    Stream the candles of [[asset, from, to], ...] into Cassandra (fetch -> transform -> write).
+    Each window is transformed and written while the next windows are fetched, so only a few windows
+    are held in memory. Return the number of rows written.
+    """
+    fetcher = rest_api.CandleFetcher(rate_limit=rate_limit, max_workers=max_workers)
+
+    def _iter_rows():
+        for asset, candles in fetcher.iter_fetch(requests, interval):
+            yield from utils.iter_candle_rows_from_poloniex(asset, candles)
+
+    # Partition key: (id, dt_create_utc)
+    return cassandra_operation.insert_stream(keyspace, _iter_rows(), query, partition_key_indexes=[0, 15])
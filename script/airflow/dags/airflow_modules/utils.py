@@ -3,14 +3,20 @@ import sys, os
 sys.path.append(os.path.join(os.path.dirname(__file__)))
 
 from datetime import datetime, date
-import pandas_market_calendars as mcal
+from itertools import repeat
+import numpy as np
+import pandas as pd
 import pytz
 import airflow_env_variables
+import market_calendar
 import traceback
+import logging
 
 sys.path.append(airflow_env_variables.DWH_SCRIPT)
 from common.utils import send_line_message
 
+logger = logging.getLogger(__name__)
+
 
 def send_notification(dag_id, tags, type, optional_message=None):
     jst = pytz.timezone("Asia/Tokyo")
@@ -21,6 +27,43 @@ def send_notification(dag_id, tags, type, optional_message=None):
     send_line_message(message)
 
 
+# Columns of the rows of process_candle_data_from_poloniex and process_yahoofinancials_data
+CANDLE_COLUMNS = [
+    "id",
+    "low",
+    "high",
+    "open",
+    "close",
+    "amount",
+    "quantity",
+    "buyTakerAmount",
+    "buyTakerQuantity",
+    "tradeCount",
+    "ts",
+    "weightedAverage",
+    "interval",
+    "startTime",
+    "closeTime",
+    "dt_create_utc",
+    "ts_create_utc",
+    "ts_insert_utc",
+]
+YAHOOFINANCIALS_COLUMNS = [
+    "id",
+    "low",
+    "high",
+    "open",
+    "close",
+    "volume",
+    "adjclose",
+    "currency",
+    "unixtime_create",
+    "dt_create_utc",
+    "tz_gmtoffset",
+    "ts_insert_utc",
+]
+
+
 def _unix_time_millisecond_to_second(unix_time):
     return int((unix_time) / 1000.0)
 
@@ -36,83 +79,154 @@ def get_dt_from_unix_time(dt_unix_time):
     return dt
 
 
+# Max number of candles converted at once (one page of the REST API)
+CANDLE_PAGE_SIZE = 500
+
+
+def _format_timestamps(unix_time_ms):
+    """
+    Format unix times (milliseconds) like str(datetime): "YYYY-MM-DD HH:MM:SS[.ffffff]"
+    """
+    ts = np.datetime_as_string(unix_time_ms.astype("datetime64[ms]").astype("datetime64[us]"), unit="us")
+    ts = np.char.replace(ts, "T", " ")
+    whole_seconds = unix_time_ms % 1000 == 0
+    ts[whole_seconds] = np.char.rstrip(np.char.rstrip(ts[whole_seconds], "0"), ".")
+    return ts
+
+
+def process_candle_page_from_poloniex(asset_name, asset_data, ts_insert_utc=None):
+    """
+    Convert the candles of an asset column by column with NumPy and return the rows
+    (same values as process_candle_data_from_poloniex).
+    """
+    if len(asset_data) == 0:
+        return []
+    if ts_insert_utc is None:
+        ts_insert_utc = _get_ts_now("UTC")
+
+    try:
+        columns = list(zip(*asset_data))
+        # low, high, open, close, amount, quantity, buyTakerAmount, buyTakerQuantity, weightedAverage
+        values = np.array([columns[i] for i in [0, 1, 2, 3, 4, 5, 6, 7, 10]], dtype=np.float64)
+        trade_count = np.array(columns[8], dtype=np.int64)
+        # ts, startTime, closeTime
+        unix_time_ms = np.array([columns[9], columns[12], columns[13]], dtype=np.int64)
+    except Exception as error:
+        # Raised to the task (or to the thread of insert_stream), so it fails with the cause.
+        logger.error("Error: {}".format(error))
+        logger.error(traceback.format_exc())
+        logger.error("asset_data ==>> \n{}".format(asset_data))
+        raise
+
+    unix_time = unix_time_ms // 1000
+    dt_create_utc = np.datetime_as_string(unix_time_ms[2].astype("datetime64[ms]").astype("datetime64[D]"))
+    ts_create_utc = _format_timestamps(unix_time_ms[2])
+
+    low, high, open_price, close_price, amount, quantity, buy_taker_amount, buy_taker_quantity, weighted_average = (
+        values.tolist()
+    )
+    ts, start_time, close_time = unix_time.tolist()
+    rows = zip(
+        repeat(asset_name),  # id
+        low,
+        high,
+        open_price,
+        close_price,
+        amount,
+        quantity,
+        buy_taker_amount,
+        buy_taker_quantity,
+        trade_count.tolist(),
+        ts,
+        weighted_average,
+        columns[11],  # interval
+        start_time,
+        close_time,
+        dt_create_utc.tolist(),
+        ts_create_utc.tolist(),
+        repeat(ts_insert_utc),
+    )
+    return list(map(list, rows))
+
+
+def iter_candle_rows_from_poloniex(asset_name, asset_data, ts_insert_utc=None):
+    """
+    Yield the rows of an asset page by page, so the rows can be written while they are created.
+    """
+    for i in range(0, len(asset_data), CANDLE_PAGE_SIZE):
+        yield from process_candle_page_from_poloniex(asset_name, asset_data[i : i + CANDLE_PAGE_SIZE], ts_insert_utc)
+
+
 def process_candle_data_from_poloniex(data):
-    timezone = "UTC"
+    # ts_insert_utc is the same for all the rows of a batch.
+    ts_insert_utc = _get_ts_now("UTC")
     batch_data = []
     for asset_name, asset_data in data.items():
-        for d in asset_data:
-            ts_create_utc = datetime.utcfromtimestamp(int(d[13]) / 1000.0)
-            dt_create_utc = date(ts_create_utc.year, ts_create_utc.month, ts_create_utc.day).strftime("%Y-%m-%d")
-            try:
-                batch_data.append(
-                    [
-                        asset_name,  # id
-                        float(d[0]),  # low
-                        float(d[1]),  # high
-                        float(d[2]),  # open
-                        float(d[3]),  # close
-                        float(d[4]),  # amount
-                        float(d[5]),  # quantity
-                        float(d[6]),  # buyTakerAmount
-                        float(d[7]),  # buyTakerQuantity
-                        int(d[8]),  # tradeCount
-                        _unix_time_millisecond_to_second(d[9]),  # ts
-                        float(d[10]),  # weightedAverage
-                        d[11],  # interval
-                        _unix_time_millisecond_to_second(d[12]),  # startTime
-                        _unix_time_millisecond_to_second(d[13]),  # closeTime
-                        dt_create_utc,  # dt_create_utc
-                        str(ts_create_utc),  # ts_create_utc
-                        _get_ts_now(timezone),  # ts_insert_utc
-                    ]
-                )
-            except Exception as error:
-                print("Error:".format(error))
-                print(traceback.format_exc())
-                print("asset_data ==>> \n", asset_data)
-                sys.exit(1)
+        batch_data.extend(iter_candle_rows_from_poloniex(asset_name, asset_data, ts_insert_utc))
     return batch_data
 
 
+# Fields of each price of the yahoofinancials historical price data
+YAHOOFINANCIALS_PRICE_FIELDS = ["date", "formatted_date", "low", "high", "open", "close", "volume", "adjclose"]
+
+
+def process_yahoofinancials_frame(data, ts_insert_utc=None):
+    """
+    Convert the prices of each symbol with one DataFrame per symbol and return one typed DataFrame
+    (columns: YAHOOFINANCIALS_COLUMNS). Prices with a null value are dropped.
+    """
+    if ts_insert_utc is None:
+        ts_insert_utc = _get_ts_now("UTC")
+
+    frames = []
+    for symbol_name, symbol_data in data.items():
+        prices = symbol_data["prices"]
+        prices = pd.DataFrame({field: [p.get(field) for p in prices] for field in YAHOOFINANCIALS_PRICE_FIELDS})
+        valid = prices.notna().all(axis=1)
+        if not valid.all():
+            print("WARN: {} prices of {} contain None data".format(int((~valid).sum()), symbol_name))
+        prices = prices[valid]
+        frames.append(
+            pd.DataFrame(
+                {
+                    "id": symbol_name,
+                    "low": prices["low"].astype(np.float64),
+                    "high": prices["high"].astype(np.float64),
+                    "open": prices["open"].astype(np.float64),
+                    "close": prices["close"].astype(np.float64),
+                    "volume": prices["volume"].astype(np.float64),
+                    "adjclose": prices["adjclose"].astype(np.float64),
+                    "currency": symbol_data["currency"],
+                    "unixtime_create": prices["date"].astype(np.int64),
+                    "dt_create_utc": prices["formatted_date"].astype(str),
+                    "tz_gmtoffset": int(symbol_data["timeZone"]["gmtOffset"]),
+                    "ts_insert_utc": ts_insert_utc,
+                },
+                columns=YAHOOFINANCIALS_COLUMNS,
+            )
+        )
+
+    if len(frames) == 0:
+        return pd.DataFrame(columns=YAHOOFINANCIALS_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def frame_to_rows(frame, columns):
+    """
+    Return the rows of a DataFrame as lists of Python values in the order of <columns>.
+    """
+    return list(map(list, zip(*(frame[column].tolist() for column in columns))))
+
+
 def process_yahoofinancials_data(data):
-    timezone = "UTC"
-    batch_data = []
-    for symbol_name, data in data.items():
-        currency = data["currency"]
-        prices = data["prices"]
-        tz_gmtoffset = data["timeZone"]["gmtOffset"]
-        for p in prices:
-            try:
-                if None not in list(p.values()):
-                    batch_data.append(
-                        [
-                            symbol_name,  # id
-                            float(p["low"]),  # low
-                            float(p["high"]),  # high
-                            float(p["open"]),  # open
-                            float(p["close"]),  # close
-                            float(p["volume"]),  # volume
-                            float(p["adjclose"]),  # adjclose
-                            currency,  # currency
-                            int(p["date"]),  # dt_unix
-                            p["formatted_date"],  # dt
-                            int(tz_gmtoffset),  # tz_gmtoffset
-                            _get_ts_now(timezone),  # ts_insert_utc
-                        ]
-                    )
-                else:
-                    print("WARN: None data is containing: ", p)
-            except Exception as error:
-                print("Error:".format(error))
-                print(traceback.format_exc())
-                print("data ==>> \n", p)
-                sys.exit(1)
-    return batch_data
+    try:
+        frame = process_yahoofinancials_frame(data)
+    except Exception as error:
+        logger.error("Error: {}".format(error))
+        logger.error(traceback.format_exc())
+        raise
+    return frame_to_rows(frame, YAHOOFINANCIALS_COLUMNS)
 
 
 def is_market_open(date, market):
-    calendar = mcal.get_calendar(market)
-    if len(calendar.schedule(start_date=date, end_date=date).index) > 0:
-        return True
-    else:
-        return False
+    return market_calendar.is_market_open(date, market)
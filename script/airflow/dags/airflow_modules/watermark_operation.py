@@ -0,0 +1,83 @@
+"""
+High-watermarks of the daily loads, kept in the <keyspace>.load_watermark table.
+The watermark of (table_name, id) is the unix time (seconds) before which the data of the id
+is fully loaded into Cassandra and Hive, so the next load starts from it.
+"""
+
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+
+import airflow_env_variables
+
+sys.path.append(airflow_env_variables.DWH_SCRIPT)
+from datetime import datetime, timezone
+from cassandra_operations import cassandra_operator
+
+WATERMARK_TABLE = "load_watermark"
+SECONDS_OF_ONE_DAY = 60 * 60 * 24
+
+
+def get_watermarks(keyspace, table_name):
+    cass_ope = cassandra_operator.Operator(keyspace)
+    query = f"""
+    select id, watermark from {WATERMARK_TABLE} where table_name = '{table_name}'
+    """
+    return {row[0]: int(row[1]) for row in cass_ope.run_query(query)}
+
+
+def update_watermarks(keyspace, table_name, watermarks):
+    """
+    Save the watermark of each id. A watermark never moves backwards.
+    """
+    if len(watermarks) == 0:
+        return
+    curr_watermarks = get_watermarks(keyspace, table_name)
+    ts_update_utc = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    batch_data = [
+        [table_name, id, max(int(watermark), curr_watermarks.get(id, 0)), ts_update_utc]
+        for id, watermark in watermarks.items()
+    ]
+
+    query = f"""
+    INSERT INTO {WATERMARK_TABLE} (table_name,id,watermark,ts_update_utc) VALUES (%s,%s,%s,%s)
+    """
+    cass_ope = cassandra_operator.Operator(keyspace)
+    cass_ope.insert_batch_data(query, batch_data)
+
+
+def get_load_range(keyspace, table_name, ids, to_time, load_from_days, lookback_days=0):
+    """
+    Return the range to load:
+        from_times:       {id: unix time to load from}, the watermark minus <lookback_days> days (unsettled data),
+                          or <load_from_days> days before <to_time> for an id without watermark
+        to_time:          <to_time>
+        days_delete_from: days from the earliest from_time to today (UTC), the ${N} range of the Hive reload
+    """
+    watermarks = get_watermarks(keyspace, table_name)
+    from_times = {}
+    for id in ids:
+        if id in watermarks:
+            from_times[id] = min(watermarks[id] - SECONDS_OF_ONE_DAY * lookback_days, int(to_time))
+        else:
+            from_times[id] = int(to_time) - SECONDS_OF_ONE_DAY * load_from_days
+
+    from_date = datetime.utcfromtimestamp(min(from_times.values())).date()
+    days_delete_from = max((datetime.now(timezone.utc).date() - from_date).days, 0)
+    return {"from_times": from_times, "to_time": int(to_time), "days_delete_from": days_delete_from}
+
+
+def get_settled_watermarks(batch_data, id_index, dt_index, to_time):
+    """
+    Return {id: watermark} of daily rows: the start of the day after the latest day of each id.
+    Rows of the day of <to_time> or later are not settled yet and are loaded again next time.
+    """
+    settled_until = datetime.utcfromtimestamp(int(to_time)).date()
+    watermarks = {}
+    for row in batch_data:
+        dt = datetime.strptime(str(row[dt_index]), "%Y-%m-%d").date()
+        if dt >= settled_until:
+            continue
+        watermark = int(datetime(dt.year, dt.month, dt.day, tzinfo=timezone.utc).timestamp()) + SECONDS_OF_ONE_DAY
+        watermarks[row[id_index]] = max(watermarks.get(row[id_index], 0), watermark)
+    return watermarks
@@ -2,10 +2,106 @@ import sys, os
 
 sys.path.append(os.path.join(os.path.dirname(__file__)))
 
+import re
+import json
+import time
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from yahoofinancials import YahooFinancials
+import airflow_env_variables
+
+sys.path.append(airflow_env_variables.DWH_SCRIPT)
+from common.rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Prices of the days older than this are settled and their cache is kept for <CACHE_TTL_SETTLED> seconds.
+SETTLED_DAYS = 3
+CACHE_TTL_SETTLED = 60 * 60 * 24 * 30
+# The cache of a range including recent days is only reused by the retries of the same run.
+CACHE_TTL_UNSETTLED = 60 * 60
 
 
 def get_data_from_yahoofinancials(symbols, interval, start, end):
     yahoo_financials = YahooFinancials(symbols)
     data = yahoo_financials.get_historical_price_data(start_date=start, end_date=end, time_interval=interval)
     return data
+
+
+def _get_cache_path(symbol, interval, start, end):
+    # Without YAHOOFINANCIALS_CACHE_HOME, the responses are not cached.
+    if airflow_env_variables.YAHOOFINANCIALS_CACHE_HOME is None:
+        return None
+    # Symbols contain "^" and "=" (e.g. ^NDX, JPY=X), so the hash keeps the file names unique.
+    name = re.sub(r"[^0-9A-Za-z]", "_", symbol)
+    key = hashlib.sha1(f"{symbol}|{interval}|{start}|{end}".encode()).hexdigest()[:8]
+    return os.path.join(airflow_env_variables.YAHOOFINANCIALS_CACHE_HOME, f"{name}_{interval}_{start}_{end}_{key}.json")
+
+
+def _get_cache_ttl(end):
+    settled_until = datetime.utcnow().date() - timedelta(days=SETTLED_DAYS)
+    if datetime.strptime(end, "%Y-%m-%d").date() <= settled_until:
+        return CACHE_TTL_SETTLED
+    return CACHE_TTL_UNSETTLED
+
+
+def _read_cache(path, ttl):
+    if not os.path.exists(path):
+        return None
+    if time.time() - os.path.getmtime(path) > ttl:
+        os.remove(path)
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_cache(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+class YahooFinancialsFetcher:
+    """
+    Fetch the historical prices of each symbol concurrently, at most <rate_limit> requests per second.
+    The raw response of each (symbol, interval, start, end) is cached on disk under YAHOOFINANCIALS_CACHE_HOME
+    (not cached if it is not set), so the retries and the reruns do not download the same prices again.
+    """
+
+    def __init__(self, rate_limit=2, max_workers=4):
+        self.bucket = TokenBucket(rate_limit)
+        self.max_workers = max_workers
+
+    def fetch_symbol(self, symbol, interval, start, end):
+        path = _get_cache_path(symbol, interval, start, end)
+        data = _read_cache(path, _get_cache_ttl(end)) if path is not None else None
+        if data is not None:
+            logger.info("{}: Load from {} to {} (cache)".format(symbol, start, end))
+            return data
+
+        self.bucket.acquire()
+        logger.info("{}: Load from {} to {}".format(symbol, start, end))
+        data = get_data_from_yahoofinancials(symbol, interval, start, end)
+        # Error responses (without prices) are not cached.
+        if path is not None and isinstance(data.get(symbol), dict) and "prices" in data[symbol]:
+            _write_cache(path, data)
+        return data
+
+    def fetch(self, symbols, interval, start, end):
+        """
+        Return the historical price data of <symbols> in the same format as get_data_from_yahoofinancials.
+        """
+        res = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.fetch_symbol, symbol, interval, start, end) for symbol in symbols]
+            for future in futures:
+                res.update(future.result())
+        return res
+
+
+def get_data_parallel(symbols, interval, start, end, rate_limit=2, max_workers=4):
+    fetcher = YahooFinancialsFetcher(rate_limit=rate_limit, max_workers=max_workers)
+    return fetcher.fetch(symbols, interval, start, end)
@@ -10,6 +10,20 @@ logger = logging.getLogger(__name__)
 dag_id = "D_Load_crypto_candles_day"
 tags = ["daily", "load", "crypto"]
 
+ASSETS = [
+    "ADA_USDT",
+    "BCH_USDT",
+    "BNB_USDT",
+    "BTC_USDT",
+    "DOGE_USDT",
+    "ETH_USDT",
+    "LTC_USDT",
+    "MKR_USDT",
+    "SHIB_USDT",
+    "TRX_USDT",
+    "XRP_USDT",
+]
+
 
 def _task_failure_alert(context):
     from airflow_modules.utils import send_notification
@@ -23,53 +37,47 @@ def _send_warning_notification(optional_message=None):
     send_notification(dag_id, tags, "WARNING", optional_message)
 
 
-def _get_candle_data(load_from_days):
+def _get_load_range(load_from_days):
+    import time
+    from airflow_modules import watermark_operation
+
+    return watermark_operation.get_load_range("crypto", "candles_day", ASSETS, time.time(), load_from_days)
+
+
+def _get_candle_data(ti):
     import time
-    from airflow_modules import poloniex_operation
-
-    assets = [
-        "ADA_USDT",
-        "BCH_USDT",
-        "BNB_USDT",
-        "BTC_USDT",
-        "DOGE_USDT",
-        "ETH_USDT",
-        "LTC_USDT",
-        "MKR_USDT",
-        "SHIB_USDT",
-        "TRX_USDT",
-        "XRP_USDT",
-    ]
+    from airflow_modules import poloniex_operation, artifact_operation
+
     interval = "DAY_1"
+    load_range = ti.xcom_pull(task_ids="get_load_range")
 
     candle_data = {}
-    days = load_from_days  # how many days ago you want to get
-    period = 60 * 24 * days  # minute
-    end = time.time()
-    start = end - 60 * period
-    for asset in assets:
+    end = load_range["to_time"]
+    for asset in ASSETS:
+        # Only the days after the watermark of the asset
+        start = load_range["from_times"][asset]
         logger.info("{}: Load from {} to {}".format(asset, start, end))
         candle_data[asset] = poloniex_operation.get_candle_data(asset, interval, start, end)
         time.sleep(1)
 
-    return candle_data
+    return artifact_operation.save_candle_data(ti, "candle_data", candle_data)
 
 
 def _process_candle_data(ti):
-    from airflow_modules import utils
+    from airflow_modules import utils, artifact_operation
 
-    candle_data = ti.xcom_pull(task_ids="get_candle_day")
+    candle_data = artifact_operation.load_candle_data(ti.xcom_pull(task_ids="get_candle_day"))
     batch_data = utils.process_candle_data_from_poloniex(candle_data)
 
-    return batch_data
+    return artifact_operation.save_rows(ti, "batch_data", batch_data, utils.CANDLE_COLUMNS)
 
 
 def _insert_data_to_cassandra(ti):
-    from airflow_modules import cassandra_operation
+    from airflow_modules import cassandra_operation, artifact_operation
 
     keyspace = "crypto"
     table_name = "candles_day"
-    batch_data = ti.xcom_pull(task_ids="process_candle_data_for_ingestion")
+    batch_data = artifact_operation.load_rows(ti.xcom_pull(task_ids="process_candle_data_for_ingestion"))
 
     query = f"""
     INSERT INTO {table_name} (id,low,high,open,close,amount,quantity,buyTakerAmount,\
@@ -109,9 +117,28 @@ def _check_latest_dt():
         _send_warning_notification(warning_message)
 
 
-def _delete_past_data_from_hive(query_file, days_delete_from):
+def _update_watermark(ti):
+    from airflow_modules import watermark_operation, artifact_operation
+
+    load_range = ti.xcom_pull(task_ids="get_load_range")
+    batch_data = artifact_operation.load_rows(ti.xcom_pull(task_ids="process_candle_data_for_ingestion"))
+    # id: 0, dt_create_utc: 15
+    watermarks = watermark_operation.get_settled_watermarks(batch_data, 0, 15, load_range["to_time"])
+    logger.info("Watermarks: {}".format(watermarks))
+    watermark_operation.update_watermarks("crypto", "candles_day", watermarks)
+
+
+def _remove_artifacts(ti):
+    from airflow_modules import artifact_operation
+
+    artifact_operation.remove_artifacts(ti)
+
+
+def _delete_past_data_from_hive(query_file, ti):
     from airflow_modules import trino_operation
 
+    days_delete_from = ti.xcom_pull(task_ids="get_load_range")["days_delete_from"]
+
     with open(query_file, "r") as f:
         query_script = f.read()
 
@@ -128,9 +155,11 @@ def _delete_past_data_from_hive(query_file, days_delete_from):
         trino_operation.run(query)
 
 
-def _hive_deletion_check(query_file, days_delete_from):
+def _hive_deletion_check(query_file, ti):
     from airflow_modules import trino_operation
 
+    days_delete_from = ti.xcom_pull(task_ids="get_load_range")["days_delete_from"]
+
     with open(query_file, "r") as f:
         query = f.read()
 
@@ -147,9 +176,11 @@ def _hive_deletion_check(query_file, days_delete_from):
         raise AirflowFailException(error_msg)
 
 
-def _load_from_cassandra_to_hive(query_file, days_delete_from):
+def _load_from_cassandra_to_hive(query_file, ti):
     from airflow_modules import trino_operation
 
+    days_delete_from = ti.xcom_pull(task_ids="get_load_range")["days_delete_from"]
+
     with open(query_file, "r") as f:
         query = f.read()
 
@@ -175,13 +206,19 @@ with DAG(
 ) as dag:
     dag_start = DummyOperator(task_id="dag_start")
 
-    days_delete_from = 7
+    load_from_days = 7  # Used until the first watermark is saved.
+
+    get_load_range = PythonOperator(
+        task_id="get_load_range",
+        python_callable=_get_load_range,
+        op_kwargs={"load_from_days": load_from_days},
+        do_xcom_push=True,
+    )
 
     get_candle_data = PythonOperator(
         task_id="get_candle_day",
         python_callable=_get_candle_data,
         pool="poloniex_pool",
-        op_kwargs={"load_from_days": days_delete_from},
         do_xcom_push=True,
     )
 
@@ -207,7 +244,6 @@ with DAG(
         python_callable=_delete_past_data_from_hive,
         op_kwargs={
             "query_file": f"{query_dir}/D_Load_crypto_candles_day_001.sql",
-            "days_delete_from": days_delete_from,
         },
     )
 
@@ -216,7 +252,6 @@ with DAG(
         python_callable=_hive_deletion_check,
         op_kwargs={
             "query_file": f"{query_dir}/D_Load_crypto_candles_day_002.sql",
-            "days_delete_from": days_delete_from,
         },
     )
 
@@ -225,14 +260,24 @@ with DAG(
         python_callable=_load_from_cassandra_to_hive,
         op_kwargs={
             "query_file": f"{query_dir}/D_Load_crypto_candles_day_003.sql",
-            "days_delete_from": days_delete_from,
         },
     )
 
+    update_watermark = PythonOperator(
+        task_id="update_watermark",
+        python_callable=_update_watermark,
+    )
+
+    remove_artifacts = PythonOperator(
+        task_id="remove_artifacts",
+        python_callable=_remove_artifacts,
+    )
+
     dag_end = DummyOperator(task_id="dag_end")
 
     (
         dag_start
+        >> get_load_range
         >> get_candle_data
         >> process_candle_data
         >> insert_data_to_cassandra
@@ -240,5 +285,7 @@ with DAG(
         >> delete_past_data_from_hive
         >> hive_deletion_check
         >> load_from_cassandra_to_hive
+        >> update_watermark
+        >> remove_artifacts
         >> dag_end
     )
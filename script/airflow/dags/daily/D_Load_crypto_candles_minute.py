@@ -11,6 +11,20 @@ logger = logging.getLogger(__name__)
 dag_id = "D_Load_crypto_candles_minute"
 tags = ["daily", "load", "crypto"]
 
+ASSETS = [
+    "ADA_USDT",
+    "BCH_USDT",
+    "BNB_USDT",
+    "BTC_USDT",
+    "DOGE_USDT",
+    "ETH_USDT",
+    "LTC_USDT",
+    "MKR_USDT",
+    "SHIB_USDT",
+    "TRX_USDT",
+    "XRP_USDT",
+]
+
 
 def _task_failure_alert(context):
     from airflow_modules.utils import send_notification
@@ -24,88 +38,106 @@ def _send_warning_notification(optional_message=None):
     send_notification(dag_id, tags, "WARNING", optional_message)
 
 
-def _get_candle_data(load_from_days):
+def _get_missing_ranges(start_times, from_time, to_time):
+    """
+    Return [[from, to], ...] of the minutes from <from_time> to <to_time> not in <start_times> (unix time in seconds).
+    """
+    ranges = []
+    for start_time in range(from_time, to_time, 60):
+        if start_time in start_times:
+            continue
+        if len(ranges) > 0 and ranges[-1][1] == start_time:
+            ranges[-1][1] = start_time + 60
+        else:
+            ranges.append([start_time, start_time + 60])
+    return ranges
+
+
+def _get_load_range(load_from_days):
     import time
-    from airflow_modules import poloniex_operation
+    from airflow_modules import watermark_operation
 
-    assets = [
-        "ADA_USDT",
-        "BCH_USDT",
-        "BNB_USDT",
-        "BTC_USDT",
-        "DOGE_USDT",
-        "ETH_USDT",
-        "LTC_USDT",
-        "MKR_USDT",
-        "SHIB_USDT",
-        "TRX_USDT",
-        "XRP_USDT",
-    ]
+    # Only complete minutes (the current minute is still being aggregated by the consumer)
+    to_time = int(time.time()) // 60 * 60 - 60
+    return watermark_operation.get_load_range("crypto", "candles_minute", ASSETS, to_time, load_from_days)
 
-    interval = "MINUTE_1"
 
-    target_days = load_from_days  # data of how many days ago you want to get.
-    seconds_of_one_day = 60 * 60 * 24  # seconds of one day
-    period = seconds_of_one_day * target_days
-    to_time = time.time()  # from this time to get the past data
-    from_time = to_time - period  # to this time to get the past data
+def _find_candle_gaps(gap_fill_only, ti):
+    """
+    Minute candles are built from the trade stream by trade_candles_minute_consumer,
+    so only the minutes missing in Cassandra after the watermark are loaded from the REST API.
+    The minutes recorded by the consumer as possibly incomplete (late trades dropped, restarts)
+    are loaded again as well.
+    """
+    from airflow_modules import cassandra_operation
+
+    keyspace = "crypto"
+    table_name = "candles_minute"
+    reload_table_name = "candles_minute_reload"
+
+    load_range = ti.xcom_pull(task_ids="get_load_range")
+    from_times = load_range["from_times"]
+    to_time = load_range["to_time"]
+
+    if not gap_fill_only:
+        return {asset: [[from_times[asset], to_time]] for asset in ASSETS}
+
+    gaps = {}
+    for asset in ASSETS:
+        from_time = from_times[asset]
+        to_date = datetime.utcfromtimestamp(to_time).date()
+        days = (to_date - datetime.utcfromtimestamp(from_time).date()).days
+        start_times = set()
+        reload_start_times = set()
+        for N in range(0, days + 1):
+            dt = (to_date - timedelta(days=N)).strftime("%Y-%m-%d")
+            query = f"""
+            select startTime from {table_name} where id = '{asset}' and dt_create_utc = '{dt}'
+            """
+            start_times.update(int(row[0]) for row in cassandra_operation.select_data(keyspace, query))
+            query = f"""
+            select startTime from {reload_table_name} where id = '{asset}' and dt_create_utc = '{dt}'
+            """
+            reload_start_times.update(int(row[0]) for row in cassandra_operation.select_data(keyspace, query))
+
+        # Incomplete minutes are handled as missing, so the REST candles overwrite them (same primary key).
+        ranges = _get_missing_ranges(start_times - reload_start_times, from_time, to_time)
+        num_missing = sum((r[1] - r[0]) // 60 for r in ranges)
+        logger.info(
+            "{}: {} minutes missing or incomplete in {} ranges ({} incomplete)".format(
+                asset, num_missing, len(ranges), len(start_times & reload_start_times)
+            )
+        )
+        if len(ranges) > 0:
+            gaps[asset] = ranges
+    return gaps
+
+
+def _load_candle_data(ti):
+    from airflow_modules import poloniex_operation
+
+    interval = "MINUTE_1"
+    gaps = ti.xcom_pull(task_ids="find_candle_gaps")
 
     # Each GET request, only 500 records we can get.
     # This means data for 500 minutes per one request.
     # 1 day = 1440 minutes
-    candle_data = {}
     window_size = 60 * 500  # Get data of <window_size> minutes for each time.
-    curr_from_time = from_time
-    curr_to_time = curr_from_time + window_size
-    while True:
-        for asset in assets:
-            max_retry_cnt = 5
-            curr_retry_cnt = 0
-            while curr_retry_cnt <= max_retry_cnt:
-                try:
-                    logger.info("{}: Load from {} to {}".format(asset, curr_from_time, curr_to_time))
-                    data = poloniex_operation.get_candle_data(asset, interval, curr_from_time, curr_to_time)
-                    if data != None:
-                        if asset in candle_data:
-                            candle_data[asset].extend(data)
-                        else:
-                            candle_data[asset] = data
-                    time.sleep(1)
-                    break
-                except Exception as error:
-                    logger.error("Error: {}".format(error))
-                    logger.error(traceback.format_exc())
-                    curr_retry_cnt += 1
-                    time.sleep(600)
-
-                if curr_retry_cnt > max_retry_cnt:
-                    raise AirflowFailException("Poloniex API is dead now.")
-
-        curr_from_time = curr_to_time
-        curr_to_time = curr_from_time + window_size
-
-        if curr_from_time > to_time:
-            break
-
-    return candle_data
-
-
-def _process_candle_data(ti):
-    from airflow_modules import utils
-
-    candle_data = ti.xcom_pull(task_ids="get_candle_minute_for_1day")
-    batch_data = utils.process_candle_data_from_poloniex(candle_data)
-
-    return batch_data
-
-
-def _insert_data_to_cassandra(ti):
-    from airflow_modules import cassandra_operation
+    requests = []
+    for asset, ranges in gaps.items():
+        # Close gaps (e.g. minutes without trades) are loaded by one request.
+        curr_request = None
+        for from_time, to_time in ranges:
+            for curr_from_time in range(from_time, to_time, window_size):
+                curr_to_time = min(curr_from_time + window_size, to_time)
+                if curr_request is not None and curr_to_time - curr_request[1] <= window_size:
+                    curr_request[2] = curr_to_time
+                else:
+                    curr_request = [asset, curr_from_time, curr_to_time]
+                    requests.append(curr_request)
 
     keyspace = "crypto"
     table_name = "candles_minute"
-    batch_data = ti.xcom_pull(task_ids="process_candle_data_for_ingestion")
-
     query = f"""
     INSERT INTO {table_name} (id,low,high,open,close,amount,quantity,buyTakerAmount,\
         buyTakerQuantity,tradeCount,ts,weightedAverage,interval,startTime,closeTime,dt_create_utc,ts_create_utc,ts_insert_utc)\
@@ -115,7 +147,16 @@ def _insert_data_to_cassandra(ti):
     logger.info("RUN QUERY")
     logger.info(query)
 
-    cassandra_operation.insert_data(keyspace, batch_data, query)
+    # Requests run concurrently under the rate limit and each failed request is retried with a backoff.
+    # The candles of each window are written while the next windows are fetched.
+    try:
+        num_rows = poloniex_operation.load_candle_data_to_cassandra(requests, interval, keyspace, query)
+    except Exception as error:
+        logger.error("Error: {}".format(error))
+        logger.error(traceback.format_exc())
+        raise AirflowFailException("Could not load candles from Poloniex API to Cassandra: {}".format(error))
+
+    logger.info("{} candles inserted ({} requests)".format(num_rows, len(requests)))
 
 
 def _check_latest_dt():
@@ -145,9 +186,21 @@ def _check_latest_dt():
         _send_warning_notification(warning_message)
 
 
-def _delete_past_data_from_hive(query_file, days_delete_from):
+def _update_watermark(ti):
+    from airflow_modules import watermark_operation
+
+    # The minutes up to to_time are checked and the missing ones are loaded (the REST API has no candle
+    # for a minute without trades), so they are not checked again.
+    load_range = ti.xcom_pull(task_ids="get_load_range")
+    watermarks = {asset: load_range["to_time"] for asset in ASSETS}
+    watermark_operation.update_watermarks("crypto", "candles_minute", watermarks)
+
+
+def _delete_past_data_from_hive(query_file, ti):
     from airflow_modules import trino_operation
 
+    days_delete_from = ti.xcom_pull(task_ids="get_load_range")["days_delete_from"]
+
     with open(query_file, "r") as f:
         query_script = f.read()
 
@@ -164,9 +217,11 @@ def _delete_past_data_from_hive(query_file, days_delete_from):
         trino_operation.run(query)
 
 
-def _hive_deletion_check(query_file, days_delete_from):
+def _hive_deletion_check(query_file, ti):
     from airflow_modules import trino_operation
 
+    days_delete_from = ti.xcom_pull(task_ids="get_load_range")["days_delete_from"]
+
     with open(query_file, "r") as f:
         query = f.read()
 
@@ -183,9 +238,11 @@ def _hive_deletion_check(query_file, days_delete_from):
         raise AirflowFailException(error_msg)
 
 
-def _load_from_cassandra_to_hive(query_file, days_delete_from):
+def _load_from_cassandra_to_hive(query_file, ti):
     from airflow_modules import trino_operation
 
+    days_delete_from = ti.xcom_pull(task_ids="get_load_range")["days_delete_from"]
+
     with open(query_file, "r") as f:
         query = f.read()
 
@@ -211,25 +268,27 @@ with DAG(
 ) as dag:
     dag_start = DummyOperator(task_id="dag_start")
     
-    days_delete_from = 7
+    load_from_days = 7  # Used until the first watermark is saved.
 
-    get_candle_data = PythonOperator(
-        task_id="get_candle_minute_for_1day",
-        python_callable=_get_candle_data,
-        op_kwargs={"load_from_days": days_delete_from},
-        pool="poloniex_pool",
+    get_load_range = PythonOperator(
+        task_id="get_load_range",
+        python_callable=_get_load_range,
+        op_kwargs={"load_from_days": load_from_days},
         do_xcom_push=True,
     )
 
-    process_candle_data = PythonOperator(
-        task_id="process_candle_data_for_ingestion",
-        python_callable=_process_candle_data,
+    find_candle_gaps = PythonOperator(
+        task_id="find_candle_gaps",
+        python_callable=_find_candle_gaps,
+        # gap_fill_only=False: load all the candles after the watermark from the REST API
+        op_kwargs={"gap_fill_only": True},
         do_xcom_push=True,
     )
 
-    insert_data_to_cassandra = PythonOperator(
-        task_id="insert_candle_data_to_cassandra",
-        python_callable=_insert_data_to_cassandra,
+    load_candle_data = PythonOperator(
+        task_id="load_candle_minute_to_cassandra",
+        python_callable=_load_candle_data,
+        pool="poloniex_pool",
     )
 
     check_latest_dt = PythonOperator(task_id="check_latest_dt_existence", python_callable=_check_latest_dt)
@@ -243,7 +302,6 @@ with DAG(
         python_callable=_delete_past_data_from_hive,
         op_kwargs={
             "query_file": f"{query_dir}/D_Load_crypto_candles_minute_001.sql",
-            "days_delete_from": days_delete_from,
         },
     )
 
@@ -252,7 +310,6 @@ with DAG(
         python_callable=_hive_deletion_check,
         op_kwargs={
             "query_file": f"{query_dir}/D_Load_crypto_candles_minute_002.sql",
-            "days_delete_from": days_delete_from,
         },
     )
 
@@ -261,20 +318,25 @@ with DAG(
         python_callable=_load_from_cassandra_to_hive,
         op_kwargs={
             "query_file": f"{query_dir}/D_Load_crypto_candles_minute_003.sql",
-            "days_delete_from": days_delete_from,
         },
     )
 
+    update_watermark = PythonOperator(
+        task_id="update_watermark",
+        python_callable=_update_watermark,
+    )
+
     dag_end = DummyOperator(task_id="dag_end")
 
     (
         dag_start
-        >> get_candle_data
-        >> process_candle_data
-        >> insert_data_to_cassandra
+        >> get_load_range
+        >> find_candle_gaps
+        >> load_candle_data
         >> check_latest_dt
         >> delete_past_data_from_hive
         >> hive_deletion_check
         >> load_from_cassandra_to_hive
+        >> update_watermark
         >> dag_end
     )
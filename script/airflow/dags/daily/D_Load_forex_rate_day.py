@@ -11,6 +11,11 @@ logger = logging.getLogger(__name__)
 dag_id = "D_Load_forex_rate_day"
 tags = ["daily", "load", "forex_rate"]
 
+CURRENCIES = ["EURUSD=X", "GBPUSD=X", "JPY=X"]
+
+# The last loaded day is loaded again, because prices can be revised after the market close.
+LOOKBACK_DAYS = 1
+
 
 def _task_failure_alert(context):
     from airflow_modules.utils import send_notification
@@ -24,47 +29,53 @@ def _send_warning_notification(optional_message=None):
     send_notification(dag_id, tags, "WARNING", optional_message)
 
 
-def _get_forex_rate(load_from_days):
-    from airflow_modules import yahoofinancials_operation, utils
+def _get_load_range(load_from_days):
     import time
+    from airflow_modules import watermark_operation
 
-    currencies = ["EURUSD=X", "GBPUSD=X", "JPY=X"]
-    interval = "daily"
+    return watermark_operation.get_load_range(
+        "forex", "forex_rate_day", CURRENCIES, time.time(), load_from_days, lookback_days=LOOKBACK_DAYS
+    )
 
-    # how many days ago you want to get.
-    target_days = load_from_days
 
-    # seconds of one day
-    seconds_of_one_day = 60 * 60 * 24
-    period = seconds_of_one_day * target_days
+def _get_forex_rate(ti):
+    from airflow_modules import yahoofinancials_operation, market_calendar, utils
 
-    # to this time to get the past data
-    to_ts = time.time()
+    interval = "daily"
+    load_range = ti.xcom_pull(task_ids="get_load_range")
 
-    # from this time to get the past data
-    from_ts = to_ts - period
+    # from the earliest watermark of the symbols to this time
+    from_ts = min(load_range["from_times"].values())
+    to_ts = load_range["to_time"]
 
     from_date = utils.get_dt_from_unix_time(from_ts)
     to_date = utils.get_dt_from_unix_time(to_ts)
 
     logger.info("Load from {} to {}".format(from_date, to_date))
 
-    return yahoofinancials_operation.get_data_from_yahoofinancials(currencies, interval, from_date, to_date)
+    # Only the days from the watermark are new. Skip the fetch if the market is closed on all of them (e.g. weekends).
+    new_from_date = utils.get_dt_from_unix_time(from_ts + 60 * 60 * 24 * LOOKBACK_DAYS)
+    if not market_calendar.has_trading_day(new_from_date, to_date, "NYSE"):
+        logger.info("Skip: NYSE is closed from {} to {}".format(new_from_date, to_date))
+        return {}
+
+    return yahoofinancials_operation.get_data_parallel(CURRENCIES, interval, from_date, to_date)
 
 
 def _process_forex_rate(ti):
-    from airflow_modules import utils
+    from airflow_modules import utils, artifact_operation
 
     forex_rate = ti.xcom_pull(task_ids="get_forex_rate")
-    return utils.process_yahoofinancials_data(forex_rate)
+    batch_data = utils.process_yahoofinancials_data(forex_rate)
+    return artifact_operation.save_rows(ti, "batch_data", batch_data, utils.YAHOOFINANCIALS_COLUMNS)
 
 
 def _insert_data_to_cassandra(ti):
-    from airflow_modules import cassandra_operation
+    from airflow_modules import cassandra_operation, artifact_operation
 
     keyspace = "forex"
     table_name = "forex_rate_day"
-    batch_data = ti.xcom_pull(task_ids="process_forex_rate_for_ingestion")
+    batch_data = artifact_operation.load_rows(ti.xcom_pull(task_ids="process_forex_rate_for_ingestion"))
 
     query = f"""
     INSERT INTO {table_name} (id,low,high,open,close,volume,adjclose,currency,unixtime_create,dt_create_utc,tz_gmtoffset,ts_insert_utc)\
@@ -104,9 +115,28 @@ def _check_latest_dt():
         _send_warning_notification(warning_message)
 
 
-def _delete_past_data_from_hive(query_file, days_delete_from):
+def _update_watermark(ti):
+    from airflow_modules import watermark_operation, artifact_operation
+
+    load_range = ti.xcom_pull(task_ids="get_load_range")
+    batch_data = artifact_operation.load_rows(ti.xcom_pull(task_ids="process_forex_rate_for_ingestion"))
+    # id: 0, dt_create_utc: 9
+    watermarks = watermark_operation.get_settled_watermarks(batch_data, 0, 9, load_range["to_time"])
+    logger.info("Watermarks: {}".format(watermarks))
+    watermark_operation.update_watermarks("forex", "forex_rate_day", watermarks)
+
+
+def _remove_artifacts(ti):
+    from airflow_modules import artifact_operation
+
+    artifact_operation.remove_artifacts(ti)
+
+
+def _delete_past_data_from_hive(query_file, ti):
     from airflow_modules import trino_operation
 
+    days_delete_from = ti.xcom_pull(task_ids="get_load_range")["days_delete_from"]
+
     with open(query_file, "r") as f:
         query_script = f.read()
 
@@ -123,9 +153,11 @@ def _delete_past_data_from_hive(query_file, days_delete_from):
         trino_operation.run(query)
 
 
-def _hive_deletion_check(query_file, days_delete_from):
+def _hive_deletion_check(query_file, ti):
     from airflow_modules import trino_operation
 
+    days_delete_from = ti.xcom_pull(task_ids="get_load_range")["days_delete_from"]
+
     with open(query_file, "r") as f:
         query = f.read()
 
@@ -142,9 +174,11 @@ def _hive_deletion_check(query_file, days_delete_from):
         raise AirflowFailException(error_msg)
 
 
-def _load_from_cassandra_to_hive(query_file, days_delete_from):
+def _load_from_cassandra_to_hive(query_file, ti):
     from airflow_modules import trino_operation
 
+    days_delete_from = ti.xcom_pull(task_ids="get_load_range")["days_delete_from"]
+
     with open(query_file, "r") as f:
         query = f.read()
 
@@ -170,13 +204,19 @@ with DAG(
 ) as dag:
     dag_start = DummyOperator(task_id="dag_start")
 
-    days_delete_from = 7
+    load_from_days = 7  # Used until the first watermark is saved.
+
+    get_load_range = PythonOperator(
+        task_id="get_load_range",
+        python_callable=_get_load_range,
+        op_kwargs={"load_from_days": load_from_days},
+        do_xcom_push=True,
+    )
 
     get_forex_rate = PythonOperator(
         task_id="get_forex_rate",
         python_callable=_get_forex_rate,
         pool="yfinance_pool",
-        op_kwargs={"load_from_days": days_delete_from},
         do_xcom_push=True,
     )
 
@@ -202,7 +242,6 @@ with DAG(
         python_callable=_delete_past_data_from_hive,
         op_kwargs={
             "query_file": f"{query_dir}/D_Load_forex_rate_day_001.sql",
-            "days_delete_from": days_delete_from,
         },
     )
 
@@ -211,7 +250,6 @@ with DAG(
         python_callable=_hive_deletion_check,
         op_kwargs={
             "query_file": f"{query_dir}/D_Load_forex_rate_day_002.sql",
-            "days_delete_from": days_delete_from,
         },
     )
 
@@ -220,14 +258,24 @@ with DAG(
         python_callable=_load_from_cassandra_to_hive,
         op_kwargs={
             "query_file": f"{query_dir}/D_Load_forex_rate_day_003.sql",
-            "days_delete_from": days_delete_from,
         },
     )
 
+    update_watermark = PythonOperator(
+        task_id="update_watermark",
+        python_callable=_update_watermark,
+    )
+
+    remove_artifacts = PythonOperator(
+        task_id="remove_artifacts",
+        python_callable=_remove_artifacts,
+    )
+
     dag_end = DummyOperator(task_id="dag_end")
 
     (
         dag_start
+        >> get_load_range
         >> get_forex_rate
         >> process_forex_rate
         >> insert_data_to_cassandra
@@ -235,5 +283,7 @@ with DAG(
         >> delete_past_data_from_hive
         >> hive_deletion_check
         >> load_from_cassandra_to_hive
+        >> update_watermark
+        >> remove_artifacts
         >> dag_end
     )
@@ -10,6 +10,38 @@ logger = logging.getLogger(__name__)
 dag_id = "D_Load_stock_index_value_day"
 tags = ["daily", "load", "stock_index"]
 
+TICKERS = [
+    "^NDX",  # NASDAQ 100
+    "^DJI",  # Dow Jones Industrial Average
+    "^DJT",  # Dow Jones Transportation Averag
+    "^DJU",  # Dow Jones Utility Average
+    "^BANK",  # NASDAQ Bank
+    "^IXCO",  # NASDAQ Computer
+    "^NBI",  # NASDAQ Biotechnology
+    "^NDXT",  # NASDAQ 100 Technology Sector
+    "^INDS",  # NASDAQ Industrial
+    "^INSR",  # NASDAQ Insurance
+    "^OFIN",  # NASDAQ Other Finance
+    "^IXTC",  # NASDAQ Telecommunications
+    "^TRAN",  # NASDAQ Transportation
+    "^NYY",  # NYSE TMT INDEX
+    "^NYI",  # NYSE INTL 100 INDEX
+    "^NY",  # NYSE U.S. 100 Index
+    "^NYL",  # NYSE WORLD LEADERS INDEX
+    "^XMI",  # NYSE ARCA MAJOR MARKET INDEX
+    "^OEX",  # S&P 100 INDEX
+    "^GSPC",  # S&P 500
+    "^HSI",  # HANG SENG INDEX
+    "^FCHI",  # CAC 40
+    "^BVSP",  # IBOVESPA
+    "^N225",  # Nikkei 225
+    "^RUA",  # Russell 3000
+    "^XAX",  # NYSE AMEX COMPOSITE INDEX
+]
+
+# The last loaded day is loaded again, because prices can be revised after the market close.
+LOOKBACK_DAYS = 1
+
 
 def _task_failure_alert(context):
     from airflow_modules.utils import send_notification
@@ -23,75 +55,53 @@ def _send_warning_notification(optional_message=None):
     send_notification(dag_id, tags, "WARNING", optional_message)
 
 
-def _get_stock_index_value(load_from_days):
-    from airflow_modules import yahoofinancials_operation, utils
+def _get_load_range(load_from_days):
     import time
+    from airflow_modules import watermark_operation
 
-    tickers = [
-        "^NDX",  # NASDAQ 100
-        "^DJI",  # Dow Jones Industrial Average
-        "^DJT",  # Dow Jones Transportation Averag
-        "^DJU",  # Dow Jones Utility Average
-        "^BANK",  # NASDAQ Bank
-        "^IXCO",  # NASDAQ Computer
-        "^NBI",  # NASDAQ Biotechnology
-        "^NDXT",  # NASDAQ 100 Technology Sector
-        "^INDS",  # NASDAQ Industrial
-        "^INSR",  # NASDAQ Insurance
-        "^OFIN",  # NASDAQ Other Finance
-        "^IXTC",  # NASDAQ Telecommunications
-        "^TRAN",  # NASDAQ Transportation
-        "^NYY",  # NYSE TMT INDEX
-        "^NYI",  # NYSE INTL 100 INDEX
-        "^NY",  # NYSE U.S. 100 Index
-        "^NYL",  # NYSE WORLD LEADERS INDEX
-        "^XMI",  # NYSE ARCA MAJOR MARKET INDEX
-        "^OEX",  # S&P 100 INDEX
-        "^GSPC",  # S&P 500
-        "^HSI",  # HANG SENG INDEX
-        "^FCHI",  # CAC 40
-        "^BVSP",  # IBOVESPA
-        "^N225",  # Nikkei 225
-        "^RUA",  # Russell 3000
-        "^XAX",  # NYSE AMEX COMPOSITE INDEX
-    ]
-
-    interval = "daily"
+    return watermark_operation.get_load_range(
+        "stock", "stock_index_day", TICKERS, time.time(), load_from_days, lookback_days=LOOKBACK_DAYS
+    )
 
-    # how many days ago you want to get.
-    target_days = load_from_days
 
-    # seconds of one day
-    seconds_of_one_day = 60 * 60 * 24
-    period = seconds_of_one_day * target_days
+def _get_stock_index_value(ti):
+    from airflow_modules import yahoofinancials_operation, market_calendar, utils
 
-    # to this time to get the past data
-    to_ts = time.time()
+    interval = "daily"
+    load_range = ti.xcom_pull(task_ids="get_load_range")
 
-    # from this time to get the past data
-    from_ts = to_ts - period
+    # from the earliest watermark of the symbols to this time
+    from_ts = min(load_range["from_times"].values())
+    to_ts = load_range["to_time"]
 
     from_date = utils.get_dt_from_unix_time(from_ts)
     to_date = utils.get_dt_from_unix_time(to_ts)
 
     logger.info("Load from {} to {}".format(from_date, to_date))
 
-    return yahoofinancials_operation.get_data_from_yahoofinancials(tickers, interval, from_date, to_date)
+    # Only the days from the watermark are new. Skip the fetch if the market is closed on all of them (e.g. weekends).
+    new_from_date = utils.get_dt_from_unix_time(from_ts + 60 * 60 * 24 * LOOKBACK_DAYS)
+    if not market_calendar.has_trading_day(new_from_date, to_date, "NYSE"):
+        logger.info("Skip: NYSE is closed from {} to {}".format(new_from_date, to_date))
+        return {}
+
+    return yahoofinancials_operation.get_data_parallel(TICKERS, interval, from_date, to_date)
 
 
 def _process_stock_index_value(ti):
-    from airflow_modules import utils
+    from airflow_modules import utils, artifact_operation
 
     stock_index_value = ti.xcom_pull(task_ids="get_stock_index_value")
-    return utils.process_yahoofinancials_data(stock_index_value)
+    batch_data = utils.process_yahoofinancials_data(stock_index_value)
+    return artifact_operation.save_rows(ti, "batch_data", batch_data, utils.YAHOOFINANCIALS_COLUMNS)
 
 
 def _insert_data_to_cassandra(ti):
-    from airflow_modules import cassandra_operation
+    from airflow_modules import cassandra_operation, artifact_operation
 
     keyspace = "stock"
     table_name = "stock_index_day"
-    batch_data = ti.xcom_pull(task_ids="process_stock_index_value_for_ingestion")
+    batch_data = artifact_operation.load_rows(ti.xcom_pull(task_ids="process_stock_index_value_for_ingestion"))
 
     query = f"""
     INSERT INTO {table_name} (id,low,high,open,close,volume,adjclose,currency,unixtime_create,dt_create_utc,tz_gmtoffset,ts_insert_utc)\
@@ -132,9 +142,28 @@ def _check_latest_dt():
         _send_warning_notification(warning_message)
 
 
-def _delete_past_data_from_hive(query_file, days_delete_from):
+def _update_watermark(ti):
+    from airflow_modules import watermark_operation, artifact_operation
+
+    load_range = ti.xcom_pull(task_ids="get_load_range")
+    batch_data = artifact_operation.load_rows(ti.xcom_pull(task_ids="process_stock_index_value_for_ingestion"))
+    # id: 0, dt_create_utc: 9
+    watermarks = watermark_operation.get_settled_watermarks(batch_data, 0, 9, load_range["to_time"])
+    logger.info("Watermarks: {}".format(watermarks))
+    watermark_operation.update_watermarks("stock", "stock_index_day", watermarks)
+
+
+def _remove_artifacts(ti):
+    from airflow_modules import artifact_operation
+
+    artifact_operation.remove_artifacts(ti)
+
+
+def _delete_past_data_from_hive(query_file, ti):
     from airflow_modules import trino_operation
 
+    days_delete_from = ti.xcom_pull(task_ids="get_load_range")["days_delete_from"]
+
     with open(query_file, "r") as f:
         query_script = f.read()
 
@@ -151,9 +180,11 @@ def _delete_past_data_from_hive(query_file, days_delete_from):
         trino_operation.run(query)
 
 
-def _hive_deletion_check(query_file, days_delete_from):
+def _hive_deletion_check(query_file, ti):
     from airflow_modules import trino_operation
 
+    days_delete_from = ti.xcom_pull(task_ids="get_load_range")["days_delete_from"]
+
     with open(query_file, "r") as f:
         query = f.read()
 
@@ -170,9 +201,11 @@ def _hive_deletion_check(query_file, days_delete_from):
         raise AirflowFailException(error_msg)
 
 
-def _load_from_cassandra_to_hive(query_file, days_delete_from):
+def _load_from_cassandra_to_hive(query_file, ti):
     from airflow_modules import trino_operation
 
+    days_delete_from = ti.xcom_pull(task_ids="get_load_range")["days_delete_from"]
+
     with open(query_file, "r") as f:
         query = f.read()
 
@@ -198,13 +231,19 @@ with DAG(
 ) as dag:
     dag_start = DummyOperator(task_id="dag_start")
     
-    days_delete_from = 7
+    load_from_days = 7  # Used until the first watermark is saved.
+
+    get_load_range = PythonOperator(
+        task_id="get_load_range",
+        python_callable=_get_load_range,
+        op_kwargs={"load_from_days": load_from_days},
+        do_xcom_push=True,
+    )
 
     get_stock_index_value = PythonOperator(
         task_id="get_stock_index_value",
         python_callable=_get_stock_index_value,
         pool="yfinance_pool",
-        op_kwargs={"load_from_days": days_delete_from},
         do_xcom_push=True,
     )
 
@@ -230,7 +269,6 @@ with DAG(
         python_callable=_delete_past_data_from_hive,
         op_kwargs={
             "query_file": f"{query_dir}/D_Load_stock_index_value_day_001.sql",
-            "days_delete_from": days_delete_from,
         },
     )
 
@@ -239,7 +277,6 @@ with DAG(
         python_callable=_hive_deletion_check,
         op_kwargs={
             "query_file": f"{query_dir}/D_Load_stock_index_value_day_002.sql",
-            "days_delete_from": days_delete_from,
         },
     )
 
@@ -248,14 +285,24 @@ with DAG(
         python_callable=_load_from_cassandra_to_hive,
         op_kwargs={
             "query_file": f"{query_dir}/D_Load_stock_index_value_day_003.sql",
-            "days_delete_from": days_delete_from,
         },
     )
 
+    update_watermark = PythonOperator(
+        task_id="update_watermark",
+        python_callable=_update_watermark,
+    )
+
+    remove_artifacts = PythonOperator(
+        task_id="remove_artifacts",
+        python_callable=_remove_artifacts,
+    )
+
     dag_end = DummyOperator(task_id="dag_end")
 
     (
         dag_start
+        >> get_load_range
         >> get_stock_index_value
         >> process_stock_index_value
         >> insert_data_to_cassandra
@@ -263,5 +310,7 @@ with DAG(
         >> delete_past_data_from_hive
         >> hive_deletion_check
         >> load_from_cassandra_to_hive
+        >> update_watermark
+        >> remove_artifacts
         >> dag_end
     )
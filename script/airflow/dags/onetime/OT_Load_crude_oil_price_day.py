@@ -17,8 +17,8 @@ def _task_failure_alert(context):
     send_notification(dag_id, tags, "ERROR")
 
 
-def _get_crude_oil_price_past_data():
-    from airflow_modules import yahoofinancials_operation, utils
+def _get_crude_oil_price_past_data(ti):
+    from airflow_modules import yahoofinancials_operation, utils, artifact_operation
     import time
 
     symbols = ["CL=F"]
@@ -41,7 +41,7 @@ def _get_crude_oil_price_past_data():
 
         logger.info("Load from {} to {}".format(curr_from_date, curr_to_date))
 
-        data = yahoofinancials_operation.get_data_from_yahoofinancials(symbols, interval, curr_from_date, curr_to_date)
+        data = yahoofinancials_operation.get_data_parallel(symbols, interval, curr_from_date, curr_to_date)
 
         if res == None:
             res = data
@@ -57,22 +57,23 @@ def _get_crude_oil_price_past_data():
 
         time.sleep(5)
 
-    return res
+    return artifact_operation.save_json(ti, "crude_oil_price", res)
 
 
 def _process_crude_oil_price(ti):
-    from airflow_modules import utils
+    from airflow_modules import utils, artifact_operation
 
-    crude_oil_price = ti.xcom_pull(task_ids="get_crude_oil_price_past_data")
-    return utils.process_yahoofinancials_data(crude_oil_price)
+    crude_oil_price = artifact_operation.load_json(ti.xcom_pull(task_ids="get_crude_oil_price_past_data"))
+    batch_data = utils.process_yahoofinancials_data(crude_oil_price)
+    return artifact_operation.save_rows(ti, "batch_data", batch_data, utils.YAHOOFINANCIALS_COLUMNS)
 
 
 def _insert_data_to_cassandra(ti):
-    from airflow_modules import cassandra_operation
+    from airflow_modules import cassandra_operation, artifact_operation
 
     keyspace = "oil"
     table_name = "crude_oil_price_day"
-    crude_oil_price = ti.xcom_pull(task_ids="process_crude_oil_price_for_ingestion")
+    crude_oil_price = artifact_operation.load_rows(ti.xcom_pull(task_ids="process_crude_oil_price_for_ingestion"))
 
     query = f"""
     INSERT INTO {table_name} (id,low,high,open,close,volume,adjclose,currency,unixtime_create,dt_create_utc,tz_gmtoffset,ts_insert_utc)\
@@ -135,6 +136,12 @@ def _load_from_cassandra_to_hive():
     trino_operation.run(query)
 
 
+def _remove_artifacts(ti):
+    from airflow_modules import artifact_operation
+
+    artifact_operation.remove_artifacts(ti)
+
+
 args = {"owner": "airflow", "retries": 0, "retry_delay": timedelta(minutes=10)}
 
 with DAG(
@@ -173,6 +180,11 @@ with DAG(
         python_callable=_load_from_cassandra_to_hive,
     )
 
+    # remove_artifacts = PythonOperator(
+    #     task_id="remove_artifacts",
+    #     python_callable=_remove_artifacts,
+    # )
+
     dag_end = DummyOperator(task_id="dag_end")
 
     # (
@@ -181,6 +193,7 @@ with DAG(
     #     >> process_crude_oil_price
     #     >> insert_data_to_cassandra
     #     >> load_from_cassandra_to_hive
+    #     >> remove_artifacts
     #     >> dag_end
     # )
 
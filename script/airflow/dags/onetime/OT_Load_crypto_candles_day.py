@@ -17,9 +17,9 @@ def _task_failure_alert(context):
     send_notification(dag_id, tags, "ERROR")
 
 
-def _get_crypto_candle_day_past_data():
+def _get_crypto_candle_day_past_data(ti):
     import time
-    from airflow_modules import poloniex_operation
+    from airflow_modules import poloniex_operation, artifact_operation
 
     assets = [
         "ADA_USDT",
@@ -68,24 +68,23 @@ def _get_crypto_candle_day_past_data():
         if curr_from_time > to_time:
             break
 
-    return res
+    return artifact_operation.save_candle_data(ti, "candle_data", res)
 
 
 def _process_candle_data(ti):
-    from airflow_modules import utils
+    from airflow_modules import utils, artifact_operation
 
-    candle_data = ti.xcom_pull(task_ids="get_crypto_candle_day_past_data")
-    res = utils.process_candle_data_from_poloniex(candle_data)
-
-    return res
+    candle_data = artifact_operation.load_candle_data(ti.xcom_pull(task_ids="get_crypto_candle_day_past_data"))
+    batch_data = utils.process_candle_data_from_poloniex(candle_data)
+    return artifact_operation.save_rows(ti, "batch_data", batch_data, utils.CANDLE_COLUMNS)
 
 
 def _insert_data_to_cassandra(ti):
-    from airflow_modules import cassandra_operation
+    from airflow_modules import cassandra_operation, artifact_operation
 
     keyspace = "crypto"
     table_name = "candles_day"
-    candle_data = ti.xcom_pull(task_ids="process_candle_data_for_ingestion")
+    candle_data = artifact_operation.load_rows(ti.xcom_pull(task_ids="process_candle_data_for_ingestion"))
 
     query = f"""
     INSERT INTO {table_name} (id,low,high,open,close,amount,quantity,buyTakerAmount,\
@@ -159,6 +158,12 @@ def _load_from_cassandra_to_hive():
     trino_operation.run(query)
 
 
+def _remove_artifacts(ti):
+    from airflow_modules import artifact_operation
+
+    artifact_operation.remove_artifacts(ti)
+
+
 args = {"owner": "airflow", "retries": 1, "retry_delay": timedelta(minutes=5)}
 
 with DAG(
@@ -175,20 +180,20 @@ with DAG(
 ) as dag:
     dag_start = DummyOperator(task_id="dag_start")
 
-    # get_crude_oil_price_past_data = PythonOperator(
-    #     task_id="get_crude_oil_price_past_data",
-    #     python_callable=_get_crude_oil_price_past_data,
+    # get_crypto_candle_day_past_data = PythonOperator(
+    #     task_id="get_crypto_candle_day_past_data",
+    #     python_callable=_get_crypto_candle_day_past_data,
     #     do_xcom_push=True,
     # )
 
-    # process_crude_oil_price = PythonOperator(
-    #     task_id="process_crude_oil_price_for_ingestion",
-    #     python_callable=_process_crude_oil_price,
+    # process_candle_data = PythonOperator(
+    #     task_id="process_candle_data_for_ingestion",
+    #     python_callable=_process_candle_data,
     #     do_xcom_push=True,
     # )
 
     # insert_data_to_cassandra = PythonOperator(
-    #     task_id="insert_crude_oil_price_data_to_cassandra",
+    #     task_id="insert_candle_data_to_cassandra",
     #     python_callable=_insert_data_to_cassandra,
     # )
 
@@ -197,14 +202,20 @@ with DAG(
         python_callable=_load_from_cassandra_to_hive,
     )
 
+    # remove_artifacts = PythonOperator(
+    #     task_id="remove_artifacts",
+    #     python_callable=_remove_artifacts,
+    # )
+
     dag_end = DummyOperator(task_id="dag_end")
 
     # (
     #     dag_start
-    #     >> get_crude_oil_price_past_data
-    #     >> process_crude_oil_price
+    #     >> get_crypto_candle_day_past_data
+    #     >> process_candle_data
     #     >> insert_data_to_cassandra
     #     >> load_from_cassandra_to_hive
+    #     >> remove_artifacts
     #     >> dag_end
     # )
 
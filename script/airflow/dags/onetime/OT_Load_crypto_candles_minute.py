@@ -11,6 +11,20 @@ logger = logging.getLogger(__name__)
 dag_id = "OT_Load_crypto_candles_minute"
 tags = ["onetime", "load", "crypto"]
 
+ASSETS = [
+    "ADA_USDT",
+    "BCH_USDT",
+    "BNB_USDT",
+    "BTC_USDT",
+    "DOGE_USDT",
+    "ETH_USDT",
+    "LTC_USDT",
+    "MKR_USDT",
+    "SHIB_USDT",
+    "TRX_USDT",
+    "XRP_USDT",
+]
+
 
 def _task_failure_alert(context):
     from airflow_modules.utils import send_notification
@@ -18,97 +32,55 @@ def _task_failure_alert(context):
     send_notification(dag_id, tags, "ERROR")
 
 
-def _get_crypto_candle_minute_past_data():
+def _get_crypto_candle_minute_past_data(target_days, dag_run=None):
+    """
+    Resumable backfill: the windows completed by the previous runs are skipped.
+    Trigger with {"assets": [...], "target_days": N} to backfill other assets or a longer period.
+    """
     import time
-    from airflow_modules import poloniex_operation, utils, cassandra_operation
-
-    assets = [
-        "ADA_USDT",
-        "BCH_USDT",
-        "BNB_USDT",
-        "BTC_USDT",
-        "DOGE_USDT",
-        "ETH_USDT",
-        "LTC_USDT",
-        "MKR_USDT",
-        "SHIB_USDT",
-        "TRX_USDT",
-        "XRP_USDT",
-    ]
+    from airflow_modules import backfill_operation, utils, cassandra_operation
 
-    interval = "MINUTE_1"
+    conf = dag_run.conf if dag_run is not None and dag_run.conf else {}
+    assets = conf.get("assets", ASSETS)
+    target_days = int(conf.get("target_days", target_days))  # how many days ago you want to get.
 
-    target_days = 300  # how many days ago you want to get.
+    interval = "MINUTE_1"
     seconds_of_one_day = 60 * 60 * 24  # seconds of one day
     period = seconds_of_one_day * target_days
-    to_time = time.time()  # from this time to get the past data
+    to_time = int(time.time())  # from this time to get the past data
     from_time = to_time - period  # to this time to get the past data
 
-    # Each GET request, only 500 records we can get.
-    # This means data for 500 minutes per one request.
-    # 1 day = 1440 minutes
-    res = {}
-    window_size = 60 * 500  # Get data of <window_size> minutes for each time.
-    curr_from_time = from_time
-    curr_to_time = curr_from_time + window_size
-    batch_size = 1000
-    curr_size = 0
-    while True:
-        for asset in assets:
-            curr_size += 1
-            try:
-                logger.info(
-                    "{}: Load from {} to {} ({}/{})".format(asset, curr_from_time, curr_to_time, curr_size, batch_size)
-                )
-                data = poloniex_operation.get_candle_data(asset, interval, curr_from_time, curr_to_time)
-                if data != None:
-                    if asset in res:
-                        res[asset].extend(data)
-                    else:
-                        res[asset] = data
-            except Exception as error:
-                logger.error("Error: {}".format(error))
-                logger.error(traceback.format_exc())
-                raise AirflowFailException("API error !!! {}".format(error))
-
-            if curr_size == batch_size:
-                # preprocess
-                candle_data = utils.process_candle_data_from_poloniex(res)
-
-                # insert into cassandra table
-                keyspace = "crypto"
-                table_name = "candles_minute"
-                query = f"""
-                INSERT INTO {table_name} (id,low,high,open,close,amount,quantity,buyTakerAmount,\
-                    buyTakerQuantity,tradeCount,ts,weightedAverage,interval,startTime,closeTime,dt,ts_insert_utc)\
-                    VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                """
-                cassandra_operation.insert_data(keyspace, candle_data, query)
-
-                # reset
-                curr_size = 0
-                res = {}
-
-            time.sleep(2)
-
-        curr_from_time = curr_to_time
-        curr_to_time = curr_from_time + window_size
-
-        if curr_from_time > to_time:
-            break
-
-    # Operation for the remaining data.
-    # preprocess
-    candle_data = utils.process_candle_data_from_poloniex(res)
-    # insert into cassandra table
     keyspace = "crypto"
     table_name = "candles_minute"
     query = f"""
     INSERT INTO {table_name} (id,low,high,open,close,amount,quantity,buyTakerAmount,\
-        buyTakerQuantity,tradeCount,ts,weightedAverage,interval,startTime,closeTime,dt_create_utc,ts_insert_utc)\
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+        buyTakerQuantity,tradeCount,ts,weightedAverage,interval,startTime,closeTime,dt_create_utc,ts_create_utc,ts_insert_utc)\
+        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
     """
-    cassandra_operation.insert_data(keyspace, candle_data, query)
+
+    def _insert_candle_data(candle_data):
+        # preprocess and insert into cassandra table while the rows are created
+        rows = (
+            row
+            for asset, candles in candle_data.items()
+            for row in utils.iter_candle_rows_from_poloniex(asset, candles)
+        )
+        # Partition key: (id, dt_create_utc)
+        cassandra_operation.insert_stream(keyspace, rows, query, partition_key_indexes=[0, 15])
+
+    # Each GET request, only 500 records we can get.
+    # This means data for 500 minutes per one request.
+    # 1 day = 1440 minutes
+    backfill = backfill_operation.CandleBackfill(
+        job_id=table_name,
+        keyspace=keyspace,
+        interval=interval,
+        insert_func=_insert_candle_data,
+        window_size=60 * 500,  # Get data of <window_size> minutes for each time.
+    )
+    failed = backfill.run(assets, from_time, to_time)
+    if len(failed) > 0:
+        raise AirflowFailException("Backfill failed (resume by running again): {}".format(failed))
 
 
 def _load_from_cassandra_to_hive():
@@ -190,10 +162,12 @@ with DAG(
 ) as dag:
     dag_start = DummyOperator(task_id="dag_start")
 
-    # get_crypto_candle_minute_past_data = PythonOperator(
-    #     task_id="get_crypto_candle_minute_past_data",
-    #     python_callable=_get_crypto_candle_minute_past_data,
-    # )
+    get_crypto_candle_minute_past_data = PythonOperator(
+        task_id="get_crypto_candle_minute_past_data",
+        python_callable=_get_crypto_candle_minute_past_data,
+        pool="poloniex_pool",
+        op_kwargs={"target_days": 300},
+    )
 
     load_from_cassandra_to_hive = PythonOperator(
         task_id="load_from_cassandra_to_hive",
@@ -202,11 +176,4 @@ with DAG(
 
     dag_end = DummyOperator(task_id="dag_end")
 
-    # (
-    #     dag_start
-    #     >> get_crypto_candle_minute_past_data
-    #     >> load_from_cassandra_to_hive
-    #     >> dag_end
-    # )
-
-    (dag_start >> load_from_cassandra_to_hive >> dag_end)
+    (dag_start >> get_crypto_candle_minute_past_data >> load_from_cassandra_to_hive >> dag_end)
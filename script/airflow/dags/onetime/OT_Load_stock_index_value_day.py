@@ -17,8 +17,8 @@ def _task_failure_alert(context):
     send_notification(dag_id, tags, "ERROR")
 
 
-def _get_stock_index_value_past_data():
-    from airflow_modules import yahoofinancials_operation, utils
+def _get_stock_index_value_past_data(ti):
+    from airflow_modules import yahoofinancials_operation, utils, artifact_operation
     import time
 
     tickers = [
@@ -68,7 +68,7 @@ def _get_stock_index_value_past_data():
 
         logger.info("Load from {} to {}".format(curr_from_date, curr_to_date))
 
-        data = yahoofinancials_operation.get_data_from_yahoofinancials(tickers, interval, curr_from_date, curr_to_date)
+        data = yahoofinancials_operation.get_data_parallel(tickers, interval, curr_from_date, curr_to_date)
 
         if res == None:
             res = data
@@ -84,22 +84,23 @@ def _get_stock_index_value_past_data():
 
         time.sleep(5)
 
-    return res
+    return artifact_operation.save_json(ti, "stock_index_value", res)
 
 
 def _process_stock_index_value(ti):
-    from airflow_modules import utils
+    from airflow_modules import utils, artifact_operation
 
-    stock_index_value = ti.xcom_pull(task_ids="get_stock_index_value_past_data")
-    return utils.process_yahoofinancials_data(stock_index_value)
+    stock_index_value = artifact_operation.load_json(ti.xcom_pull(task_ids="get_stock_index_value_past_data"))
+    batch_data = utils.process_yahoofinancials_data(stock_index_value)
+    return artifact_operation.save_rows(ti, "batch_data", batch_data, utils.YAHOOFINANCIALS_COLUMNS)
 
 
 def _insert_data_to_cassandra(ti):
-    from airflow_modules import cassandra_operation
+    from airflow_modules import cassandra_operation, artifact_operation
 
     keyspace = "stock"
     table_name = "stock_index_day"
-    stock_index_value = ti.xcom_pull(task_ids="process_stock_index_value_for_ingestion")
+    stock_index_value = artifact_operation.load_rows(ti.xcom_pull(task_ids="process_stock_index_value_for_ingestion"))
 
     query = f"""
     INSERT INTO {table_name} (id,low,high,open,close,volume,adjclose,currency,unixtime_create,dt_create_utc,tz_gmtoffset,ts_insert_utc)\
@@ -162,6 +163,12 @@ def _load_from_cassandra_to_hive():
     trino_operation.run(query)
 
 
+def _remove_artifacts(ti):
+    from airflow_modules import artifact_operation
+
+    artifact_operation.remove_artifacts(ti)
+
+
 args = {"owner": "airflow", "retries": 3, "retry_delay": timedelta(minutes=10)}
 
 with DAG(
@@ -178,20 +185,20 @@ with DAG(
 ) as dag:
     dag_start = DummyOperator(task_id="dag_start")
 
-    # get_crude_oil_price_past_data = PythonOperator(
-    #     task_id="get_crude_oil_price_past_data",
-    #     python_callable=_get_crude_oil_price_past_data,
+    # get_stock_index_value_past_data = PythonOperator(
+    #     task_id="get_stock_index_value_past_data",
+    #     python_callable=_get_stock_index_value_past_data,
     #     do_xcom_push=True,
     # )
 
-    # process_crude_oil_price = PythonOperator(
-    #     task_id="process_crude_oil_price_for_ingestion",
-    #     python_callable=_process_crude_oil_price,
+    # process_stock_index_value = PythonOperator(
+    #     task_id="process_stock_index_value_for_ingestion",
+    #     python_callable=_process_stock_index_value,
     #     do_xcom_push=True,
     # )
 
     # insert_data_to_cassandra = PythonOperator(
-    #     task_id="insert_crude_oil_price_data_to_cassandra",
+    #     task_id="insert_stock_index_value_data_to_cassandra",
     #     python_callable=_insert_data_to_cassandra,
     # )
 
@@ -200,14 +207,20 @@ with DAG(
         python_callable=_load_from_cassandra_to_hive,
     )
 
+    # remove_artifacts = PythonOperator(
+    #     task_id="remove_artifacts",
+    #     python_callable=_remove_artifacts,
+    # )
+
     dag_end = DummyOperator(task_id="dag_end")
 
     # (
     #     dag_start
-    #     >> get_crude_oil_price_past_data
-    #     >> process_crude_oil_price
+    #     >> get_stock_index_value_past_data
+    #     >> process_stock_index_value
     #     >> insert_data_to_cassandra
     #     >> load_from_cassandra_to_hive
+    #     >> remove_artifacts
     #     >> dag_end
     # )
 
@@ -0,0 +1,116 @@
+"""
+Benchmark of utils.process_candle_data_from_poloniex (columnar) against the previous row-by-row transform
+on a fixture of minute candles (default: 300 days x 11 assets).
+    python benchmarks/bench_candle_transform.py --days 300 --assets 11
+"""
+
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "airflow", "dags"))
+import time
+import random
+import argparse
+from datetime import datetime, date
+from airflow_modules import utils
+
+
+def process_candle_data_rowwise(data):
+    """
+    Previous implementation: each field is converted one by one and ts_insert_utc is formatted for each row.
+    """
+    batch_data = []
+    for asset_name, asset_data in data.items():
+        for d in asset_data:
+            ts_create_utc = datetime.utcfromtimestamp(int(d[13]) / 1000.0)
+            dt_create_utc = date(ts_create_utc.year, ts_create_utc.month, ts_create_utc.day).strftime("%Y-%m-%d")
+            batch_data.append(
+                [
+                    asset_name,
+                    float(d[0]),
+                    float(d[1]),
+                    float(d[2]),
+                    float(d[3]),
+                    float(d[4]),
+                    float(d[5]),
+                    float(d[6]),
+                    float(d[7]),
+                    int(d[8]),
+                    utils._unix_time_millisecond_to_second(d[9]),
+                    float(d[10]),
+                    d[11],
+                    utils._unix_time_millisecond_to_second(d[12]),
+                    utils._unix_time_millisecond_to_second(d[13]),
+                    dt_create_utc,
+                    str(ts_create_utc),
+                    utils._get_ts_now("UTC"),
+                ]
+            )
+    return batch_data
+
+
+def create_fixture(days, num_assets):
+    """
+    Candles in the format of the REST API: prices and amounts are strings, times are in milliseconds.
+    """
+    random.seed(0)
+    start_ms = 1672531200000  # 2023-01-01 00:00:00 UTC
+    data = {}
+    for i in range(num_assets):
+        candles = []
+        price = 100.0
+        for minute in range(days * 1440):
+            price *= 1 + random.gauss(0, 0.001)
+            start_time = start_ms + minute * 60000
+            quantity = random.random() * 10
+            candles.append(
+                [
+                    f"{price * 0.999:.4f}",
+                    f"{price * 1.001:.4f}",
+                    f"{price:.4f}",
+                    f"{price:.4f}",
+                    f"{price * quantity:.4f}",
+                    f"{quantity:.4f}",
+                    f"{price * quantity / 2:.4f}",
+                    f"{quantity / 2:.4f}",
+                    random.randint(1, 100),
+                    start_time + 60000,
+                    f"{price:.4f}",
+                    "MINUTE_1",
+                    start_time,
+                    start_time + 59999,
+                ]
+            )
+        data[f"ASSET{i}_USDT"] = candles
+    return data
+
+
+def _run(name, func, data, num_rows):
+    ts_start = time.perf_counter()
+    rows = func(data)
+    elapsed = time.perf_counter() - ts_start
+    print(f"{name:10s} {elapsed:8.2f} sec  {num_rows / elapsed:12,.0f} rows/sec")
+    return rows, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=300)
+    parser.add_argument("--assets", type=int, default=11)
+    args = parser.parse_args()
+
+    data = create_fixture(args.days, args.assets)
+    num_rows = sum(len(candles) for candles in data.values())
+    print(f"{num_rows:,} candles ({args.days} days x {args.assets} assets)")
+
+    rowwise, elapsed_rowwise = _run("row-wise", process_candle_data_rowwise, data, num_rows)
+    columnar, elapsed_columnar = _run("columnar", utils.process_candle_data_from_poloniex, data, num_rows)
+    print(f"speedup    {elapsed_rowwise / elapsed_columnar:8.2f} x")
+
+    # Same values except ts_insert_utc (the time of the transform)
+    if [row[:-1] for row in rowwise] != [row[:-1] for row in columnar]:
+        print("ERROR: the results are different")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 import sys
+import time
+import threading
+from collections import deque
+from datetime import datetime
 from cassandra.cluster import Cluster
 from cassandra.auth import PlainTextAuthProvider
-from cassandra.query import SimpleStatement, BatchStatement
+from cassandra.query import SimpleStatement, BatchStatement, BatchType
 from common import env_variables
 
 
@@ -18,6 +22,7 @@ class Operator:
             auth_provider=auth_provider,
         )
         self.session = self.cluster.connect(keyspace)
+        self.prepared_statements = {}
 
     def __del__(self):
         self.session.shutdown()
@@ -42,3 +47,190 @@ class Operator:
         for data in batch_data:
             batch.add(SimpleStatement(query), tuple(d for d in data))
         self.session.execute(batch)
+
+    def prepare(self, query):
+        """
+        Prepare a query written with "%s" placeholders only once per query.
+        """
+        if query not in self.prepared_statements:
+            self.prepared_statements[query] = self.session.prepare(query.replace("%s", "?"))
+        return self.prepared_statements[query]
+
+
+class WriteStats:
+    """
+    Throughput (rows/sec) and latency percentiles of Cassandra writes.
+    Latencies of the last <max_samples> requests are kept.
+    """
+
+    def __init__(self, max_samples=10000):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=max_samples)
+        self.rows = 0
+        self.requests = 0
+        self.errors = 0
+        self.ts_start = time.monotonic()
+
+    def add(self, rows, latency):
+        with self.lock:
+            self.rows += rows
+            self.requests += 1
+            self.latencies.append(latency)
+
+    def add_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def get_stats(self, reset=False):
+        with self.lock:
+            elapsed = max(time.monotonic() - self.ts_start, 1e-9)
+            latencies = sorted(self.latencies)
+            stats = {
+                "rows": self.rows,
+                "requests": self.requests,
+                "errors": self.errors,
+                "rows_per_sec": round(self.rows / elapsed, 1),
+                "p50_latency_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+                "p99_latency_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+            }
+            if reset:
+                self.latencies.clear()
+                self.rows = 0
+                self.requests = 0
+                self.errors = 0
+                self.ts_start = time.monotonic()
+        return stats
+
+
+def _percentile(sorted_values, q):
+    if len(sorted_values) == 0:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class BulkWriter:
+    """
+    Write rows with a statement prepared once.
+        mode="unlogged_batch": rows are grouped by partition key into UNLOGGED batches
+                               (single-partition batches are applied atomically without the batch log).
+        mode="concurrent":     each row is one request.
+        mode="logged_batch":   Operator.insert_batch_data (previous behavior). Synchronous write() only.
+    At most <concurrency> requests are in flight at the same time.
+    Rows are upserted by their primary key, so writing the same rows again (e.g. messages consumed again
+    after a failure) does not create duplicates. The statements are marked idempotent so that the driver
+    can retry them safely on timeouts.
+    """
+
+    def __init__(
+        self,
+        operator: Operator,
+        query: str,
+        partition_key_indexes: list,
+        mode: str = "unlogged_batch",
+        concurrency: int = 32,
+        max_batch_size: int = 100,
+    ):
+        self.operator = operator
+        self.session = operator.session
+        self.query = query
+        self.partition_key_indexes = partition_key_indexes
+        self.mode = mode
+        self.concurrency = concurrency
+        self.max_batch_size = max_batch_size
+        self.stats = WriteStats()
+
+        if mode != "logged_batch":
+            self.prepared = operator.prepare(query)
+            self.prepared.is_idempotent = True
+            self.converters = [_get_converter(column.type) for column in self.prepared.column_metadata]
+        self.in_flight = threading.BoundedSemaphore(concurrency)
+
+    def _bind_values(self, row):
+        return tuple(converter(value) for converter, value in zip(self.converters, row))
+
+    def _group_by_partition(self, rows):
+        partitions = {}
+        for row in rows:
+            key = tuple(row[i] for i in self.partition_key_indexes)
+            partitions.setdefault(key, []).append(row)
+        return partitions
+
+    def _create_batches(self, rows):
+        if self.mode == "concurrent":
+            return [(self.prepared.bind(self._bind_values(row)), 1) for row in rows]
+        if self.mode == "logged_batch":
+            raise ValueError("Asynchronous write is not supported in logged_batch mode")
+
+        batches = []
+        for partition_rows in self._group_by_partition(rows).values():
+            for i in range(0, len(partition_rows), self.max_batch_size):
+                batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+                batch.is_idempotent = True
+                chunk = partition_rows[i : i + self.max_batch_size]
+                for row in chunk:
+                    batch.add(self.prepared, self._bind_values(row))
+                batches.append((batch, len(chunk)))
+        return batches
+
+    def write_async(self, rows):
+        """
+        Submit rows and return the futures of the requests.
+        Blocks while <concurrency> requests are already in flight.
+        """
+        futures = []
+        for statement, num_rows in self._create_batches(rows):
+            self.in_flight.acquire()
+            ts_start = time.monotonic()
+            try:
+                future = self.session.execute_async(statement)
+            except Exception:
+                self.in_flight.release()
+                raise
+            future.add_callbacks(
+                self._on_success,
+                self._on_error,
+                callback_args=(num_rows, ts_start),
+            )
+            futures.append(future)
+        return futures
+
+    def _on_success(self, _, num_rows, ts_start):
+        self.stats.add(num_rows, time.monotonic() - ts_start)
+        self.in_flight.release()
+
+    def _on_error(self, _):
+        self.stats.add_error()
+        self.in_flight.release()
+
+    def write(self, rows):
+        """
+        Write rows and wait until all of them are written. Raise an exception if any request failed.
+        """
+        if len(rows) == 0:
+            return
+
+        if self.mode == "logged_batch":
+            ts_start = time.monotonic()
+            self.operator.insert_batch_data(self.query, rows)
+            self.stats.add(len(rows), time.monotonic() - ts_start)
+        else:
+            # Each request is timed by its own callback, so the percentiles are per request latencies.
+            for future in self.write_async(rows):
+                future.result()
+
+    def get_stats(self, reset=False):
+        return self.stats.get_stats(reset)
+
+
+def _get_converter(cql_type):
+    # Values are formatted as strings for SimpleStatement (e.g. "2023-01-01 00:00:00"),
+    # but prepared statements need native types for timestamp columns.
+    if cql_type.typename == "timestamp":
+        return _to_timestamp
+    return lambda value: value
+
+
+def _to_timestamp(value):
+    if isinstance(value, str):
+        return datetime.strptime(value[:19], "%Y-%m-%d %H:%M:%S")
+    return value
@@ -0,0 +1,120 @@
+"""
+1-minute candles (OHLCV, tradeCount, buy taker amount/quantity) aggregated from the trade stream.
+The watermark is the latest trade time seen minus <allowed_lateness> seconds.
+A minute is closed and emitted once the watermark passes its end, so trades arriving up to
+<allowed_lateness> seconds late are still counted. Trades of a closed minute are dropped and counted
+in <late_trades>.
+Minutes whose emitted candle can be incomplete are kept in <dirty_minutes> as (symbol, startTime):
+    - a trade of the minute was dropped as late
+    - the first minute of each symbol after a (re)start (trades consumed before the restart are lost)
+The consumer records them, and the nightly load reloads them from the REST API.
+"""
+
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+
+
+class _MinuteCandle:
+    def __init__(self, start_time: int):
+        self.start_time = start_time
+        self.open_key = None
+        self.close_key = None
+        self.open = None
+        self.close = None
+        self.low = float("inf")
+        self.high = float("-inf")
+        self.amount = 0.0
+        self.quantity = 0.0
+        self.buy_taker_amount = 0.0
+        self.buy_taker_quantity = 0.0
+        self.trade_ids = set()
+
+    def add(self, trade_id: int, create_time: int, price: float, quantity: float, amount: float, taker_side: str):
+        if trade_id in self.trade_ids:
+            return
+        self.trade_ids.add(trade_id)
+
+        # Trades can arrive out of order: open/close are the first/last trades by (createTime, trade_id).
+        key = (create_time, trade_id)
+        if self.open_key is None or key < self.open_key:
+            self.open_key = key
+            self.open = price
+        if self.close_key is None or key > self.close_key:
+            self.close_key = key
+            self.close = price
+        self.low = min(self.low, price)
+        self.high = max(self.high, price)
+        self.amount += amount
+        self.quantity += quantity
+        if taker_side == "buy":
+            self.buy_taker_amount += amount
+            self.buy_taker_quantity += quantity
+
+    def to_dict(self, symbol: str) -> dict:
+        return {
+            "id": symbol,
+            "low": self.low,
+            "high": self.high,
+            "open": self.open,
+            "close": self.close,
+            "amount": self.amount,
+            "quantity": self.quantity,
+            "buyTakerAmount": self.buy_taker_amount,
+            "buyTakerQuantity": self.buy_taker_quantity,
+            "tradeCount": len(self.trade_ids),
+            "weightedAverage": self.amount / self.quantity if self.quantity > 0.0 else self.close,
+            "startTime": self.start_time,
+            # Same as the REST API: closeTime is the last millisecond of the minute (in seconds here).
+            "closeTime": self.start_time + 59,
+        }
+
+
+class MinuteCandleAggregator:
+    def __init__(self, allowed_lateness: int = 10):
+        self.allowed_lateness = allowed_lateness
+        self.candles = {}
+        self.closed_until = {}
+        self.watermark = None
+        self.late_trades = 0
+        self.dirty_minutes = set()
+
+    def add_trade(
+        self,
+        symbol: str,
+        trade_id: int,
+        create_time: int,
+        price: float,
+        quantity: float,
+        amount: float,
+        taker_side: str,
+    ):
+        start_time = create_time - create_time % 60
+        if start_time < self.closed_until.get(symbol, start_time):
+            self.late_trades += 1
+            self.dirty_minutes.add((symbol, start_time))
+            return
+
+        key = (symbol, start_time)
+        if key not in self.candles:
+            self.candles[key] = _MinuteCandle(start_time)
+        self.candles[key].add(trade_id, create_time, price, quantity, amount, taker_side)
+
+        watermark = create_time - self.allowed_lateness
+        if self.watermark is None or watermark > self.watermark:
+            self.watermark = watermark
+
+    def pop_closed(self) -> list:
+        """
+        Return the candles whose minute has ended before the watermark, ordered by (symbol, startTime).
+        """
+        if self.watermark is None:
+            return []
+        closed = sorted(key for key in self.candles if key[1] + 60 <= self.watermark)
+        res = []
+        for symbol, start_time in closed:
+            res.append(self.candles.pop((symbol, start_time)).to_dict(symbol))
+            if symbol not in self.closed_until:
+                self.dirty_minutes.add((symbol, start_time))
+            self.closed_until[symbol] = max(self.closed_until.get(symbol, 0), start_time + 60)
+        return res
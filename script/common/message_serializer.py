@@ -0,0 +1,128 @@
+"""
+Serializers for the messages ({"data": [record, ...]}) of the crypto Kafka topics.
+    json:    UTF-8 JSON text (compatibility mode)
+    msgpack: <magic byte 0x00><schema version (uint16)><msgpack payload>
+             The payload is column-oriented and each column is typed by the schema
+             registered for the topic in schemas/crypto_topics.json.
+Both serializers can deserialize both formats, so topics with old JSON messages can be drained
+after producers have been switched to msgpack.
+"""
+
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+import json
+import struct
+from abc import ABC, abstractmethod
+import msgpack
+import numpy as np
+
+SCHEMA_REGISTRY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schemas", "crypto_topics.json")
+
+MAGIC_BYTE = 0
+HEADER = struct.Struct(">BH")
+
+_CASTS = {
+    "str": str,
+    "int": int,
+    "float": float,
+    "levels": lambda levels: [[float(price), float(amount)] for price, amount in levels],
+}
+_DTYPES = {"int": np.int64, "float": np.float64}
+
+
+class SchemaRegistry:
+    def __init__(self, registry_file: str = SCHEMA_REGISTRY_FILE):
+        with open(registry_file, "r") as f:
+            self.schemas = json.load(f)
+
+    def get_fields(self, topic: str, version: int = None):
+        schema = self.schemas[topic]
+        if version is None:
+            version = int(schema["latest"])
+        return version, schema["versions"][str(version)]
+
+
+class _Serializer(ABC):
+    """
+    Both formats are deserialized by every serializer. Subclasses only define the format written by serialize().
+    """
+
+    name = None
+
+    def __init__(self, registry: SchemaRegistry = None):
+        self.registry = registry or SchemaRegistry()
+
+    @abstractmethod
+    def serialize(self, topic: str, message: dict) -> bytes:
+        pass
+
+    def _unpack(self, topic: str, value: bytes):
+        """
+        Return (columns, fields) of a message in either format.
+        """
+        if len(value) > 0 and value[0] == MAGIC_BYTE:
+            _, version = HEADER.unpack_from(value)
+            _, fields = self.registry.get_fields(topic, version)
+            columns = msgpack.unpackb(value[HEADER.size :], raw=False)
+            return columns, fields
+
+        # JSON (compatibility mode): cast the values by the latest schema.
+        _, fields = self.registry.get_fields(topic)
+        data = json.loads(value.decode("utf-8"))["data"]
+        columns = [[_CASTS[field_type](d[name]) for d in data] for name, field_type in fields]
+        return columns, fields
+
+    def deserialize(self, topic: str, value: bytes) -> dict:
+        """
+        Return the message as records: {"data": [{field: value, ...}, ...]}
+        """
+        if len(value) > 0 and value[0] != MAGIC_BYTE:
+            return json.loads(value.decode("utf-8"))
+
+        columns, fields = self._unpack(topic, value)
+        names = [name for name, _ in fields]
+        return {"data": [dict(zip(names, row)) for row in zip(*columns)]}
+
+    def deserialize_columns(self, topic: str, value: bytes) -> dict:
+        """
+        Return the message as columns: {field: column}.
+        Numeric columns are NumPy arrays, the others are lists.
+        """
+        columns, fields = self._unpack(topic, value)
+        res = {}
+        for (name, field_type), column in zip(fields, columns):
+            if field_type in _DTYPES:
+                res[name] = np.asarray(column, dtype=_DTYPES[field_type])
+            else:
+                res[name] = column
+        return res
+
+
+class JsonSerializer(_Serializer):
+    name = "json"
+
+    def serialize(self, topic: str, message: dict) -> bytes:
+        return json.dumps(message).encode("utf-8")
+
+
+class MsgpackSerializer(_Serializer):
+    name = "msgpack"
+
+    def serialize(self, topic: str, message: dict) -> bytes:
+        version, fields = self.registry.get_fields(topic)
+        data = message["data"]
+        columns = [[_CASTS[field_type](d[name]) for d in data] for name, field_type in fields]
+        return HEADER.pack(MAGIC_BYTE, version) + msgpack.packb(columns, use_bin_type=True)
+
+
+SERIALIZERS = {
+    JsonSerializer.name: JsonSerializer,
+    MsgpackSerializer.name: MsgpackSerializer,
+}
+
+
+def get_serializer(message_format: str = "json", registry_file: str = SCHEMA_REGISTRY_FILE):
+    if message_format not in SERIALIZERS:
+        raise ValueError(f"Unknown message format: {message_format} (expected one of {list(SERIALIZERS)})")
+    return SERIALIZERS[message_format](SchemaRegistry(registry_file))
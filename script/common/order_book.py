@@ -0,0 +1,132 @@
+"""
+Local order book of one symbol rebuilt from a snapshot and incremental updates (Poloniex "book_lv2"),
+or from the top-N snapshots of the "book" channel.
+Each side is a sorted dict (price -> amount), so a level is inserted, updated or deleted in O(log n)
+and the best levels are iterated first.
+"""
+
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+from itertools import islice
+from sortedcontainers import SortedDict
+import numpy as np
+
+
+class SequenceGapError(Exception):
+    """
+    An update does not follow the last applied message. The book must be rebuilt from a new snapshot.
+    """
+
+
+class OrderBook:
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        # asks: ascending price, bids: descending price
+        self.asks = SortedDict()
+        self.bids = SortedDict(lambda price: -price)
+        self.seqid = None
+
+    def is_synced(self) -> bool:
+        return self.seqid is not None
+
+    def __len__(self):
+        return len(self.asks) + len(self.bids)
+
+    def clear(self):
+        self.asks.clear()
+        self.bids.clear()
+        self.seqid = None
+
+    @staticmethod
+    def _update_side(side: SortedDict, levels: list) -> list:
+        changes = []
+        for price, amount in levels:
+            price = float(price)
+            amount = float(amount)
+            if amount == 0.0:
+                # Amount 0 removes the price level.
+                if side.pop(price, None) is None:
+                    continue
+            else:
+                side[price] = amount
+            changes.append([price, amount])
+        return changes
+
+    def update(self, order_type: str, price: float, amount: float):
+        """
+        Insert, update or delete (amount 0) one price level of a side ("ask" or "bid").
+        """
+        side = self.asks if order_type == "ask" else self.bids
+        self._update_side(side, [[price, amount]])
+
+    def apply_snapshot(self, asks: list, bids: list, seqid: int):
+        self.clear()
+        self._update_side(self.asks, asks)
+        self._update_side(self.bids, bids)
+        self.seqid = int(seqid)
+
+    def apply_update(self, asks: list, bids: list, seqid: int, last_id: int):
+        """
+        Apply the changed levels of an update and return them as (asks, bids).
+        Raise SequenceGapError when <last_id> is not the seqid of the last applied message.
+        """
+        if not self.is_synced() or int(last_id) != self.seqid:
+            expected = self.seqid
+            self.clear()
+            raise SequenceGapError(f"{self.symbol}: expected lastId {expected}, but got {last_id} (id: {seqid})")
+        ask_changes = self._update_side(self.asks, asks)
+        bid_changes = self._update_side(self.bids, bids)
+        self.seqid = int(seqid)
+        return ask_changes, bid_changes
+
+    def get_top(self, depth: int):
+        """
+        Return the best <depth> levels of each side as (asks, bids): [[price, amount], ...]
+        """
+        asks = [[price, self.asks[price]] for price in self.asks.islice(0, depth)]
+        bids = [[price, self.bids[price]] for price in self.bids.islice(0, depth)]
+        return asks, bids
+
+    def get_best_ask(self):
+        return self.asks.peekitem(0) if len(self.asks) > 0 else None
+
+    def get_best_bid(self):
+        return self.bids.peekitem(0) if len(self.bids) > 0 else None
+
+    def get_mid_price(self) -> float:
+        if len(self.asks) == 0 or len(self.bids) == 0:
+            return float("nan")
+        return (self.asks.peekitem(0)[0] + self.bids.peekitem(0)[0]) / 2.0
+
+    def get_spread(self) -> float:
+        if len(self.asks) == 0 or len(self.bids) == 0:
+            return float("nan")
+        return self.asks.peekitem(0)[0] - self.bids.peekitem(0)[0]
+
+    def get_imbalance(self, depth: int = 20) -> float:
+        """
+        (bid amount - ask amount) / (bid amount + ask amount) of the best <depth> levels, from -1 to 1.
+        """
+        ask_amount = sum(self.asks[price] for price in self.asks.islice(0, depth))
+        bid_amount = sum(self.bids[price] for price in self.bids.islice(0, depth))
+        total = ask_amount + bid_amount
+        if total == 0.0:
+            return float("nan")
+        return (bid_amount - ask_amount) / total
+
+    def to_numpy(self, depth: int, out: np.ndarray = None) -> np.ndarray:
+        """
+        Export the best <depth> levels as an array of shape (2, depth, 2):
+            [side (0: ask, 1: bid), rank - 1, (price, amount)]
+        Missing levels are NaN. Pass the array returned before as <out> to fill it in place (no new array is allocated).
+        """
+        if out is None:
+            out = np.empty((2, depth, 2), dtype=np.float64)
+        out.fill(np.nan)
+        for i, side in enumerate([self.asks, self.bids]):
+            levels = out[i]
+            for rank, (price, amount) in enumerate(islice(side.items(), depth)):
+                levels[rank, 0] = price
+                levels[rank, 1] = amount
+        return out
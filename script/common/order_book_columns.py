@@ -0,0 +1,82 @@
+"""
+Columnar decoder of order book messages.
+A whole message (one or many book snapshots) is decoded into one NumPy array per column of
+the order_book_realtime table, instead of building every row level by level in Python.
+The timestamps of a snapshot are computed once per snapshot and repeated for its levels.
+"""
+
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+from datetime import datetime, timezone
+from itertools import chain
+import numpy as np
+
+ORDER_BOOK_COLUMNS = [
+    "id",
+    "seqid",
+    "order_type",
+    "quote_price",
+    "base_amount",
+    "order_rank",
+    "createTime",
+    "ts_send",
+    "dt_create_utc",
+    "ts_create_utc",
+    "ts_insert_utc",
+]
+
+
+def _flatten_levels(books: list):
+    """
+    Return (levels as an (n, 2) float array, number of levels of each book).
+    """
+    counts = np.fromiter((len(levels) for levels in books), dtype=np.int64, count=len(books))
+    levels = np.array(list(chain.from_iterable(books)), dtype=np.float64).reshape(-1, 2)
+    return levels, counts
+
+
+def _get_ranks(counts: np.ndarray) -> np.ndarray:
+    # Rank of the order in each book: 1, 2, ..., counts[i] for every book.
+    starts = np.cumsum(counts) - counts
+    return np.arange(counts.sum(), dtype=np.int64) - np.repeat(starts, counts) + 1
+
+
+def decode_order_book(columns: dict) -> dict:
+    """
+    Decode the columns of an order book message ({field: column}, see KafkaConsumer.deserialize_columns)
+    into {table column: array} with one element per price level.
+    Levels of the asks come first, then the levels of the bids.
+    """
+    ids = np.asarray(columns["id"], dtype=object)
+    seqids = np.asarray(columns["seqid"], dtype=np.int64)
+    create_times = np.asarray(columns["createTime"], dtype=np.int64)
+    ts_sends = np.asarray(columns["ts_send"], dtype=np.int64)
+
+    # Per-snapshot timestamps (createTime is unix time in seconds)
+    ts_create_utc = np.array([datetime.utcfromtimestamp(int(t)) for t in create_times], dtype=object)
+    dt_create_utc = np.array([ts.strftime("%Y-%m-%d") for ts in ts_create_utc], dtype=object)
+    ts_insert_utc = datetime.now(timezone.utc).replace(microsecond=0, tzinfo=None)
+
+    res = {name: [] for name in ORDER_BOOK_COLUMNS}
+    for order_type in ["ask", "bid"]:
+        levels, counts = _flatten_levels(columns[f"{order_type}s"])
+        res["id"].append(np.repeat(ids, counts))
+        res["seqid"].append(np.repeat(seqids, counts))
+        res["order_type"].append(np.full(len(levels), order_type, dtype=object))
+        res["quote_price"].append(levels[:, 0])
+        res["base_amount"].append(levels[:, 1])
+        res["order_rank"].append(_get_ranks(counts))
+        res["createTime"].append(np.repeat(create_times, counts))
+        res["ts_send"].append(np.repeat(ts_sends, counts))
+        res["dt_create_utc"].append(np.repeat(dt_create_utc, counts))
+        res["ts_create_utc"].append(np.repeat(ts_create_utc, counts))
+        res["ts_insert_utc"].append(np.full(len(levels), ts_insert_utc, dtype=object))
+    return {name: np.concatenate(arrays) for name, arrays in res.items()}
+
+
+def to_rows(columns: dict, names: list = ORDER_BOOK_COLUMNS) -> list:
+    """
+    Convert {column: array} to rows (tuples of Python values in the order of <names>) for BulkWriter.
+    """
+    return list(zip(*(columns[name].tolist() for name in names)))
@@ -0,0 +1,34 @@
+"""
+Rate limiter shared by the threads calling an external API.
+"""
+
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+import time
+import threading
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: <rate> tokens per second, up to <capacity> tokens at once.
+    """
+
+    def __init__(self, rate: float, capacity: int = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.ts_last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                ts_now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (ts_now - self.ts_last) * self.rate)
+                self.ts_last = ts_now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
@@ -0,0 +1,126 @@
+"""
+Microstructure features of one symbol over rolling windows of event time (createTime, seconds).
+Each window keeps running sums, so a trade or a book update is added in O(1) and
+expired entries are subtracted in amortized O(1).
+    vwap:                sum(price * quantity) / sum(quantity)
+    trade_imbalance:     (buy quantity - sell quantity) / (buy quantity + sell quantity) by takerSide
+    realized_volatility: sqrt(sum of squared log returns of consecutive trade prices)
+    spread:              mean of (best ask - best bid) of the book updates
+    depth_imbalance:     mean of the bid/ask amount imbalance of the best <depth> levels of the book updates
+"""
+
+import os, sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+import math
+from collections import deque
+from order_book import OrderBook
+
+
+class RollingSum:
+    """
+    Sums of value vectors added in the last <window> seconds.
+    An entry older than the last added one is added at the time of the last one, so the times of the entries
+    never decrease and evict() can stop at the first entry in the window.
+    """
+
+    def __init__(self, window: int, num_values: int):
+        self.window = window
+        self.num_values = num_values
+        self.entries = deque()
+        self.sums = [0.0] * num_values
+
+    def add(self, ts: int, values: tuple):
+        if len(self.entries) > 0 and ts < self.entries[-1][0]:
+            ts = self.entries[-1][0]
+        self.entries.append((ts, values))
+        for i, value in enumerate(values):
+            self.sums[i] += value
+
+    def evict(self, ts_now: int):
+        while len(self.entries) > 0 and self.entries[0][0] <= ts_now - self.window:
+            _, values = self.entries.popleft()
+            for i, value in enumerate(values):
+                self.sums[i] -= value
+        if len(self.entries) == 0:
+            # Reset the rounding errors accumulated by the subtractions.
+            self.sums = [0.0] * self.num_values
+
+
+def _ratio(numerator: float, denominator: float) -> float:
+    return numerator / denominator if denominator > 0.0 else float("nan")
+
+
+class SymbolFeatures:
+    # Values of a trade: price * quantity, quantity, buy quantity, sell quantity, squared log return, count
+    _TRADE_VALUES = 6
+    # Values of a book update: spread, depth imbalance, count
+    _BOOK_VALUES = 3
+
+    def __init__(self, symbol: str, windows: tuple = (1, 60, 300), depth: int = 20):
+        self.symbol = symbol
+        self.windows = windows
+        self.depth = depth
+        self.book = OrderBook(symbol)
+        self.trade_windows = {window: RollingSum(window, self._TRADE_VALUES) for window in windows}
+        self.book_windows = {window: RollingSum(window, self._BOOK_VALUES) for window in windows}
+        self.last_price = None
+        self.ts_last_event = 0
+
+    def _on_event(self, ts: int) -> int:
+        # Late events (e.g. trades of another partition consumed later) are added at the latest event time.
+        self.ts_last_event = max(self.ts_last_event, ts)
+        return self.ts_last_event
+
+    def on_trade(self, ts: int, price: float, quantity: float, taker_side: str):
+        log_return_sq = 0.0
+        if self.last_price is not None and self.last_price > 0.0 and price > 0.0:
+            log_return_sq = math.log(price / self.last_price) ** 2
+        self.last_price = price
+
+        buy_quantity = quantity if taker_side == "buy" else 0.0
+        sell_quantity = quantity if taker_side == "sell" else 0.0
+        values = (price * quantity, quantity, buy_quantity, sell_quantity, log_return_sq, 1.0)
+        ts = self._on_event(ts)
+        for trade_window in self.trade_windows.values():
+            trade_window.add(ts, values)
+
+    def on_book(self, ts: int, asks: list, bids: list, seqid: int):
+        self.book.apply_snapshot(asks, bids, seqid)
+        spread = self.book.get_spread()
+        imbalance = self.book.get_imbalance(self.depth)
+        if math.isnan(spread) or math.isnan(imbalance):
+            return
+        ts = self._on_event(ts)
+        for book_window in self.book_windows.values():
+            book_window.add(ts, (spread, imbalance, 1.0))
+
+    def get_features(self) -> list:
+        """
+        Return the features of each window at the latest event time.
+        """
+        features = []
+        for window in self.windows:
+            trade_window = self.trade_windows[window]
+            book_window = self.book_windows[window]
+            trade_window.evict(self.ts_last_event)
+            book_window.evict(self.ts_last_event)
+            pv, quantity, buy_quantity, sell_quantity, log_return_sq, trade_count = trade_window.sums
+            spread, imbalance, book_count = book_window.sums
+            features.append(
+                {
+                    "id": self.symbol,
+                    "window_sec": window,
+                    "ts_feature": self.ts_last_event,
+                    "vwap": _ratio(pv, quantity),
+                    "trade_count": int(round(trade_count)),
+                    "buy_quantity": buy_quantity,
+                    "sell_quantity": sell_quantity,
+                    "trade_imbalance": _ratio(buy_quantity - sell_quantity, buy_quantity + sell_quantity),
+                    "spread": _ratio(spread, book_count),
+                    "depth_imbalance": _ratio(imbalance, book_count),
+                    "mid_price": self.book.get_mid_price(),
+                    "realized_volatility": math.sqrt(max(log_return_sq, 0.0)),
+                }
+            )
+        return features
@@ -0,0 +1,185 @@
+"""
+Run NUM_WORKERS processes of one consumer (e.g. order_book_consumer) in the same consumer group.
+Kafka assigns the partitions of the topic to the workers, so consumption scales across cores
+up to one worker per partition.
+    - Each worker runs <consumer_id>.run() and writes its own log file (<consumer_id>_<timestamp>_worker<N>.log).
+    - A worker exited with an error is restarted up to MAX_WORKER_RESTARTS times in total.
+    - On SIGTERM/SIGINT, every worker completes its pending writes and commits its offsets before exiting.
+    - The write stats of the workers are aggregated and logged every STATS_LOG_INTERVAL seconds.
+"""
+
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import importlib
+import multiprocessing
+import queue
+import signal
+import time
+import pytz
+import logging
+from datetime import datetime
+from dotenv import load_dotenv
+from common import env_variables, utils
+
+CONF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conf")
+
+# set the timezone to US/Pacific
+os.environ["TZ"] = "Asia/Tokyo"
+time.tzset()
+TZ_JST = pytz.timezone("Asia/Tokyo")
+
+
+def _run_worker(curr_date: str, curr_timestamp: str, consumer_id: str, worker_id: int, stats_queue):
+    module = importlib.import_module(consumer_id)
+
+    def on_stats(stats):
+        stats_queue.put((worker_id, stats))
+
+    module.run(curr_date, curr_timestamp, consumer_id, worker_id=worker_id, on_stats=on_stats)
+
+
+def aggregate_stats(worker_stats: dict) -> dict:
+    """
+    Aggregate the latest write stats of each worker.
+    """
+    stats = list(worker_stats.values())
+    return {
+        "workers": len(stats),
+        "rows": sum(s["rows"] for s in stats),
+        "requests": sum(s["requests"] for s in stats),
+        "errors": sum(s["errors"] for s in stats),
+        "rows_per_sec": round(sum(s["rows_per_sec"] for s in stats), 1),
+        "max_p99_latency_ms": max([s["p99_latency_ms"] for s in stats], default=0.0),
+        "partitions": sum(len(s["partitions"]) for s in stats),
+    }
+
+
+class ConsumerGroupRunner:
+    def __init__(self, curr_date: str, curr_timestamp: str, consumer_id: str, runner_config: dict):
+        self.curr_date = curr_date
+        self.curr_timestamp = curr_timestamp
+        self.consumer_id = consumer_id
+        self.num_workers = int(runner_config.get("num_workers", 1))
+        self.max_restarts = int(runner_config.get("max_worker_restarts", 5))
+        self.shutdown_timeout = float(runner_config.get("shutdown_timeout", 120))
+        self.stats_log_interval = float(runner_config.get("stats_log_interval", 60))
+
+        # Workers are started by "spawn" so that no Kafka/Cassandra client state is inherited.
+        self.context = multiprocessing.get_context("spawn")
+        self.stats_queue = self.context.Queue()
+        self.workers = {}
+        self.worker_stats = {}
+        self.restart_count = 0
+        self._stopped = False
+
+        # set logging
+        logdir = "{}/{}".format(env_variables.KAFKA_LOG_HOME, curr_date)
+        logging.basicConfig(
+            format="%(asctime)s %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+            filename=f"{logdir}/{consumer_id}_{curr_timestamp}.log",
+            filemode="a",
+        )
+        self.logger = logging.getLogger()
+        self.logger.setLevel(20)
+
+    def _start_worker(self, worker_id: int):
+        process = self.context.Process(
+            target=_run_worker,
+            args=(self.curr_date, self.curr_timestamp, self.consumer_id, worker_id, self.stats_queue),
+            name=f"{self.consumer_id}-{worker_id}",
+        )
+        process.start()
+        self.workers[worker_id] = process
+        self.logger.info(f"Started worker {worker_id} (pid: {process.pid})")
+
+    def stop(self, signum=None, frame=None):
+        self.logger.info(f"Received signal {signum}. Stop the workers.")
+        self._stopped = True
+
+    def _check_workers(self):
+        for worker_id, process in list(self.workers.items()):
+            if process.is_alive():
+                continue
+            del self.workers[worker_id]
+            self.worker_stats.pop(worker_id, None)
+            if process.exitcode == 0:
+                # The worker gave up after the max retry count and has already sent an alert.
+                self.logger.warning(f"Worker {worker_id} exited")
+                continue
+
+            self.logger.error(f"Worker {worker_id} exited with code {process.exitcode}")
+            if self.restart_count >= self.max_restarts:
+                ts_now = datetime.now(TZ_JST).strftime("%Y-%m-%d %H:%M:%S")
+                message = f"{ts_now} [Failed] Kafka consumer: {self.consumer_id} worker {worker_id}"
+                utils.send_line_message(message)
+                continue
+            self.restart_count += 1
+            self.logger.info(f"Restart worker {worker_id} ({self.restart_count}/{self.max_restarts})")
+            self._start_worker(worker_id)
+
+    def _collect_stats(self, timeout: float):
+        try:
+            worker_id, stats = self.stats_queue.get(timeout=timeout)
+            self.worker_stats[worker_id] = stats
+        except queue.Empty:
+            pass
+
+    def _shutdown(self):
+        # Workers complete their pending writes and commit their offsets on SIGTERM.
+        for process in self.workers.values():
+            if process.is_alive():
+                process.terminate()
+        ts_end = time.monotonic() + self.shutdown_timeout
+        for worker_id, process in self.workers.items():
+            process.join(max(0.0, ts_end - time.monotonic()))
+            if process.is_alive():
+                self.logger.error(f"Worker {worker_id} did not stop in {self.shutdown_timeout}s. Kill it.")
+                process.kill()
+                process.join()
+        self.logger.info("All workers stopped")
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.logger.info(f"Start {self.num_workers} workers of {self.consumer_id}")
+        for worker_id in range(self.num_workers):
+            self._start_worker(worker_id)
+
+        ts_last_stats = time.monotonic()
+        while not self._stopped and len(self.workers) > 0:
+            self._collect_stats(timeout=1.0)
+            self._check_workers()
+            if time.monotonic() - ts_last_stats > self.stats_log_interval:
+                self.logger.info(f"Consumer group write stats: {aggregate_stats(self.worker_stats)}")
+                ts_last_stats = time.monotonic()
+
+        self._shutdown()
+
+
+def main():
+    # Get arguments
+    args = sys.argv
+    curr_date = args[1]
+    curr_timestamp = args[2]
+    consumer_id = args[3]
+
+    # Load variables from conf file (inherited by the worker processes)
+    load_dotenv(verbose=True)
+    conf_file = os.path.join(CONF_DIR, f"{consumer_id}.cf")
+    load_dotenv(conf_file)
+
+    runner_config = {
+        "num_workers": os.environ.get("NUM_WORKERS", "1"),
+        "max_worker_restarts": os.environ.get("MAX_WORKER_RESTARTS", "5"),
+        "shutdown_timeout": os.environ.get("SHUTDOWN_TIMEOUT", "120"),
+        "stats_log_interval": os.environ.get("STATS_LOG_INTERVAL", "60"),
+    }
+    runner = ConsumerGroupRunner(curr_date, curr_timestamp, consumer_id, runner_config)
+    runner.run()
+
+
+if __name__ == "__main__":
+    main()
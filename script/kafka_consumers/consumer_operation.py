@@ -1,10 +1,20 @@
 import os, sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from confluent_kafka import Consumer
-from common import env_variables
+from confluent_kafka import Consumer, TopicPartition
+from collections import deque
+from datetime import datetime
+from common import env_variables, utils
+from common.message_serializer import get_serializer
+import threading
+import signal
+import traceback
+import time
+import pytz
 import logging
 
+TZ_JST = pytz.timezone("Asia/Tokyo")
+
 
 class KafkaConsumer:
     def __init__(
@@ -14,32 +24,445 @@ class KafkaConsumer:
         consumer_id: str,
         group_id: str,
         offset_type: str,
+        message_format: str = "json",
+        enable_auto_commit: bool = True,
+        worker_id: int = None,
     ):
         self.kafka_conf = {
             "bootstrap.servers": env_variables.KAFKA_BOOTSTRAP_SERVERS,
             "group.id": group_id,
+            "client.id": consumer_id if worker_id is None else f"{consumer_id}-{worker_id}",
             "auto.offset.reset": offset_type,
+            "enable.auto.commit": enable_auto_commit,
             "session.timeout.ms": 600000,
             "max.poll.interval.ms": 6000000,
         }
         self.consumer = Consumer(self.kafka_conf)
+        # Both json and msgpack messages can be deserialized regardless of message_format.
+        self.serializer = get_serializer(message_format)
 
-        # set logging
+        # set logging (one log file per worker process of a consumer group)
         logdir = "{}/{}".format(env_variables.KAFKA_LOG_HOME, curr_date)
+        log_name = f"{consumer_id}_{curr_timestamp}"
+        if worker_id is not None:
+            log_name += f"_worker{worker_id}"
         logging.basicConfig(
             format="%(asctime)s %(message)s",
             datefmt="%Y-%m-%d %H:%M:%S",
-            filename=f"{logdir}/{consumer_id}_{curr_timestamp}.log",
+            filename=f"{logdir}/{log_name}.log",
             filemode="a",
         )
         self.logger = logging.getLogger()
         self.logger.setLevel(20)
 
-    def subscribe(self, topics: list):
-        self.consumer.subscribe(topics)
+    def subscribe(self, topics: list, on_assign=None, on_revoke=None):
+        kwargs = {}
+        if on_assign is not None:
+            kwargs["on_assign"] = on_assign
+        if on_revoke is not None:
+            kwargs["on_revoke"] = on_revoke
+        self.consumer.subscribe(topics, **kwargs)
 
     def poll(self, timeout: float):
         return self.consumer.poll(timeout)
 
+    def consume_batch(self, max_messages: int, max_wait: float) -> list:
+        """
+        Return up to <max_messages> messages, waiting at most <max_wait> seconds.
+        """
+        return self.consumer.consume(num_messages=max_messages, timeout=max_wait)
+
+    def commit(self, offsets: list, asynchronous: bool = True):
+        self.consumer.commit(offsets=offsets, asynchronous=asynchronous)
+
+    def pause(self, partitions: list):
+        self.consumer.pause(partitions)
+
+    def resume(self, partitions: list):
+        self.consumer.resume(partitions)
+
+    def seek(self, partition: TopicPartition):
+        self.consumer.seek(partition)
+
     def close(self):
         self.consumer.close()
+
+    def deserialize(self, msg) -> dict:
+        return self.serializer.deserialize(msg.topic(), msg.value())
+
+    def deserialize_columns(self, msg) -> dict:
+        return self.serializer.deserialize_columns(msg.topic(), msg.value())
+
+
+class _PendingMessage:
+    """
+    Kafka message whose rows are being written to Cassandra.
+    """
+
+    def __init__(self, offset: int):
+        self.offset = offset
+        self.remaining = 0
+        self.error = None
+        self.lock = threading.Lock()
+
+    def set_futures(self, futures: list):
+        with self.lock:
+            self.remaining = len(futures)
+        for future in futures:
+            future.add_callbacks(self._on_success, self._on_error)
+
+    def _on_success(self, _):
+        with self.lock:
+            self.remaining -= 1
+
+    def _on_error(self, error):
+        with self.lock:
+            self.error = error
+            self.remaining -= 1
+
+    def is_done(self) -> bool:
+        with self.lock:
+            return self.remaining <= 0
+
+
+class PipelinedSink:
+    """
+    Keep polling Kafka while Cassandra writes are in flight (at-least-once delivery).
+    - The offset of a partition is committed only after the writes of the message and
+      all the previous messages in the partition have completed.
+    - A partition is paused while <max_in_flight_messages> messages are pending
+      and resumed when half of them have completed.
+    """
+
+    def __init__(self, consumer: KafkaConsumer, writer, max_in_flight_messages: int = 1000):
+        self.consumer = consumer
+        self.writer = writer
+        self.max_in_flight_messages = max_in_flight_messages
+        self.pending = {}
+        self.paused = set()
+
+    def submit(self, msg, rows: list):
+        key = (msg.topic(), msg.partition())
+        pending_message = _PendingMessage(msg.offset())
+        queue = self.pending.setdefault(key, deque())
+        queue.append(pending_message)
+        pending_message.set_futures(self.writer.write_async(rows) if len(rows) > 0 else [])
+
+        if len(queue) >= self.max_in_flight_messages and key not in self.paused:
+            self.consumer.pause([TopicPartition(*key)])
+            self.paused.add(key)
+
+    def process_completed(self):
+        """
+        Commit the offsets of completed writes and resume partitions.
+        Raise the error of a failed write (the failed message is kept pending until rewind()).
+        """
+        offsets = []
+        error = None
+        for key, queue in self.pending.items():
+            last_done = None
+            while len(queue) > 0 and queue[0].is_done():
+                if queue[0].error is not None:
+                    error = queue[0].error
+                    break
+                last_done = queue.popleft()
+            if last_done is not None:
+                offsets.append(TopicPartition(key[0], key[1], last_done.offset + 1))
+            if key in self.paused and len(queue) <= self.max_in_flight_messages // 2:
+                self.consumer.resume([TopicPartition(*key)])
+                self.paused.discard(key)
+
+        if len(offsets) > 0:
+            self.consumer.commit(offsets)
+        if error is not None:
+            raise error
+
+    def get_num_pending(self) -> int:
+        return sum(len(queue) for queue in self.pending.values())
+
+    def drain(self, timeout: float = 60):
+        ts_end = time.monotonic() + timeout
+        while self.get_num_pending() > 0 and time.monotonic() < ts_end:
+            self.process_completed()
+            time.sleep(0.05)
+        self.process_completed()
+
+    def rewind(self, failed_msg=None):
+        """
+        Seek each partition back to its oldest uncommitted message so that it is consumed again.
+        <failed_msg> is a message that failed before it was submitted (e.g. while building its rows).
+        Its partition is sought back to it even if the partition has no pending message.
+        """
+        offsets = {key: queue[0].offset for key, queue in self.pending.items() if len(queue) > 0}
+        if failed_msg is not None:
+            offsets.setdefault((failed_msg.topic(), failed_msg.partition()), failed_msg.offset())
+        for (topic, partition), offset in offsets.items():
+            self.consumer.seek(TopicPartition(topic, partition, offset))
+        self.pending = {}
+        if len(self.paused) > 0:
+            self.consumer.resume([TopicPartition(*key) for key in self.paused])
+            self.paused = set()
+
+    def on_revoke(self, partitions: list):
+        # Commit what has been written before the partitions are handed over to another consumer.
+        try:
+            self.drain()
+        except Exception as error:
+            self.consumer.logger.error(f"Failed to drain pending writes on revoke ({error})")
+        revoked = set((p.topic, p.partition) for p in partitions)
+        self.pending = {key: queue for key, queue in self.pending.items() if key not in revoked}
+        self.paused -= revoked
+
+
+class MicroBatchBuffer:
+    """
+    Rows of many messages flushed at once when <flush_rows> rows are buffered
+    or <flush_interval_ms> has passed since the first buffered message.
+    """
+
+    def __init__(self, flush_rows: int = 5000, flush_interval_ms: int = 1000):
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.clear()
+
+    def clear(self):
+        self.rows = []
+        self.first_offsets = {}
+        self.last_offsets = {}
+        self.ts_first_message = None
+
+    def add(self, msg, rows: list):
+        key = (msg.topic(), msg.partition())
+        self.first_offsets.setdefault(key, msg.offset())
+        self.last_offsets[key] = msg.offset()
+        if self.ts_first_message is None:
+            self.ts_first_message = time.monotonic()
+        self.rows.extend(rows)
+
+    def add_batch(self, messages: list, build_rows):
+        """
+        Add the rows of consumed messages. The first offset of each partition of the batch is recorded
+        before any rows are built, so if build_rows fails partway through, rewind() also seeks back the
+        partitions of the failed message and of the messages after it.
+        """
+        for msg in messages:
+            self.first_offsets.setdefault((msg.topic(), msg.partition()), msg.offset())
+        for msg in messages:
+            self.add(msg, build_rows(msg))
+
+    def get_max_wait(self) -> float:
+        if self.ts_first_message is None:
+            return self.flush_interval
+        return max(0.0, self.ts_first_message + self.flush_interval - time.monotonic())
+
+    def should_flush(self) -> bool:
+        if self.ts_first_message is None:
+            return False
+        return len(self.rows) >= self.flush_rows or time.monotonic() - self.ts_first_message >= self.flush_interval
+
+    def get_commit_offsets(self) -> list:
+        return [
+            TopicPartition(topic, partition, offset + 1) for (topic, partition), offset in self.last_offsets.items()
+        ]
+
+    def flush(self, writer, consumer: KafkaConsumer, asynchronous: bool = True):
+        """
+        Write the buffered rows, commit the offsets of the buffered messages and clear the buffer.
+        """
+        if len(self.last_offsets) > 0:
+            writer.write(self.rows)
+            consumer.commit(self.get_commit_offsets(), asynchronous=asynchronous)
+        self.clear()
+
+    def rewind(self, consumer: KafkaConsumer):
+        """
+        Seek back to the first buffered message of each partition and drop the buffer.
+        """
+        for (topic, partition), offset in self.first_offsets.items():
+            consumer.seek(TopicPartition(topic, partition, offset))
+        self.clear()
+
+
+def _get_retry_backoff(retry_count: int, backoff_min: float, backoff_max: float) -> float:
+    return min(backoff_max, backoff_min * (2 ** (retry_count - 1)))
+
+
+def consume_to_cassandra(
+    consumer: KafkaConsumer, consumer_id: str, topics: list, writer, build_rows, consume_config: dict, on_stats=None
+):
+    """
+    Subscribe to topics, poll messages, convert each of them to rows by <build_rows> and write them by <writer>.
+        mode="sequential": write the rows of each message synchronously
+                           (commit_mode="auto": auto commit, "manual": commit after write).
+        mode="pipelined":  keep polling while the writes are in flight (manual commit after write).
+        mode="micro_batch": coalesce the rows of many messages and write them when <flush_rows> rows are buffered
+                            or <flush_interval_ms> has passed (manual commit after write).
+    With manual commit, a failed message is consumed again after the retry backoff, and the offset of a partition
+    is committed only after the rows of all its previous messages have been written (including a message whose
+    rows failed to build: its partition is sought back to it).
+    Replayed rows are written with the same primary key, so the writes are idempotent upserts.
+    On SIGTERM/SIGINT, pending writes are completed and their offsets are committed before closing.
+    Pending writes are also committed before partitions are revoked by a rebalance of the consumer group.
+    <on_stats> is called with the write stats and the assigned partitions every <stats_log_interval> seconds.
+    Pipelined mode needs asynchronous writes, so it raises ValueError before subscribing with a logged_batch writer.
+    """
+    mode = consume_config.get("mode", "sequential")
+    if mode == "pipelined" and getattr(writer, "mode", None) == "logged_batch":
+        error_msg = 'CONSUMER_MODE="pipelined" cannot be used with WRITE_MODE="logged_batch" (no asynchronous write)'
+        consumer.logger.error(error_msg)
+        raise ValueError(error_msg)
+    manual_commit = mode != "sequential" or consume_config.get("commit_mode", "auto") == "manual"
+    max_retry_cnt = int(consume_config["max_retry_count"])
+    backoff_min = float(consume_config.get("retry_backoff_min", 5))
+    backoff_max = float(consume_config.get("retry_backoff_max", 600))
+    stats_log_interval = int(consume_config.get("stats_log_interval", 60))
+    # columnar: <build_rows> receives {field: column} (KafkaConsumer.deserialize_columns) instead of records.
+    deserialize = consumer.deserialize_columns if consume_config.get("columnar", False) else consumer.deserialize
+    # pass_topic: <build_rows> also receives the topic of the message (for consumers of several topics).
+    pass_topic = consume_config.get("pass_topic", False)
+    # pass_partition: <build_rows> also receives the partition of the message (after the topic if pass_topic).
+    pass_partition = consume_config.get("pass_partition", False)
+
+    def _build_rows(msg):
+        args = [deserialize(msg)]
+        if pass_topic:
+            args.append(msg.topic())
+        if pass_partition:
+            args.append(msg.partition())
+        return build_rows(*args)
+
+    sink = None
+    poll_timeout = 10.0
+    if mode == "pipelined":
+        sink = PipelinedSink(consumer, writer, int(consume_config.get("max_in_flight_messages", 1000)))
+        poll_timeout = 0.1
+
+    buffer = None
+    if mode == "micro_batch":
+        buffer = MicroBatchBuffer(
+            int(consume_config.get("flush_rows", 5000)), int(consume_config.get("flush_interval_ms", 1000))
+        )
+        consume_batch_size = int(consume_config.get("consume_batch_size", 500))
+
+    assigned = set()
+
+    def _on_assign(_, partitions):
+        assigned.update((p.topic, p.partition) for p in partitions)
+        consumer.logger.info(f"Partitions assigned: {_format_partitions(partitions)}")
+
+    def _on_revoke(_, partitions):
+        consumer.logger.info(f"Partitions revoked: {_format_partitions(partitions)}")
+        # Commit what has been written before the partitions are handed over to another consumer.
+        if sink is not None:
+            sink.on_revoke(partitions)
+        if buffer is not None:
+            try:
+                buffer.flush(writer, consumer, asynchronous=False)
+            except Exception as error:
+                # The new owner consumes the messages again from the last committed offsets.
+                consumer.logger.error(f"Failed to flush buffered rows on revoke ({error})")
+                buffer.clear()
+        assigned.difference_update((p.topic, p.partition) for p in partitions)
+
+    consumer.subscribe(topics, on_assign=_on_assign, on_revoke=_on_revoke)
+
+    stop_event = threading.Event()
+
+    def _handle_signal(signum, frame):
+        consumer.logger.info(f"Received signal {signum}. Stop consuming.")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+
+    curr_retry_cnt = 0
+    ts_last_stats = time.monotonic()
+    consumer.logger.info(f"Start to consume (mode: {mode}, manual commit: {manual_commit})")
+    while not stop_event.is_set():
+        msg = None
+        try:
+            if time.monotonic() - ts_last_stats > stats_log_interval:
+                stats = writer.get_stats(reset=True)
+                consumer.logger.info(f"Cassandra write stats: {stats}")
+                if on_stats is not None:
+                    on_stats({**stats, "partitions": sorted(assigned)})
+                ts_last_stats = time.monotonic()
+
+            if sink is not None:
+                sink.process_completed()
+
+            if buffer is not None:
+                batch_msgs = consumer.consume_batch(consume_batch_size, buffer.get_max_wait())
+                for batch_msg in batch_msgs:
+                    if batch_msg.error():
+                        consumer.logger.error("Consumer error: {}".format(batch_msg.error()))
+                        sys.exit(1)
+                buffer.add_batch(batch_msgs, _build_rows)
+
+                if buffer.should_flush():
+                    buffer.flush(writer, consumer)
+                curr_retry_cnt = 0
+                continue
+
+            msg = consumer.poll(poll_timeout)
+            if msg is None:
+                continue
+            if msg.error():
+                consumer.logger.error("Consumer error: {}".format(msg.error()))
+                sys.exit(1)
+
+            rows = _build_rows(msg)
+            if sink is not None:
+                sink.submit(msg, rows)
+            else:
+                writer.write(rows)
+                if manual_commit:
+                    # The rows are durably written, so the message does not need to be consumed again.
+                    consumer.commit([TopicPartition(msg.topic(), msg.partition(), msg.offset() + 1)])
+            curr_retry_cnt = 0
+
+        except Exception as error:
+            curr_retry_cnt += 1
+            if curr_retry_cnt > max_retry_cnt:
+                consumer.logger.error("Kafka consumer failed !!!")
+                consumer.logger.error("Error: {}".format(error))
+                consumer.logger.error(traceback.format_exc())
+                ts_now = datetime.now(TZ_JST).strftime("%Y-%m-%d %H:%M:%S")
+                message = f"{ts_now} [Failed] Kafka consumer: {consumer_id}.py"
+                utils.send_line_message(message)
+                consumer.close()
+                return
+            else:
+                consumer.logger.error("Kafka consumer failed !!! Retry ({}/{})".format(curr_retry_cnt, max_retry_cnt))
+                consumer.logger.error("Error: {}".format(error))
+                consumer.logger.error(traceback.format_exc())
+
+            # Uncommitted messages are consumed again after the retry.
+            if sink is not None:
+                sink.rewind(msg)
+            if buffer is not None:
+                buffer.rewind(consumer)
+            if sink is None and msg is not None and manual_commit:
+                consumer.seek(TopicPartition(msg.topic(), msg.partition(), msg.offset()))
+
+            # Wait only as long as needed instead of a fixed sleep, so that lags do not pile up.
+            stop_event.wait(_get_retry_backoff(curr_retry_cnt, backoff_min, backoff_max))
+
+    _shutdown(consumer, writer, sink, buffer)
+
+
+def _shutdown(consumer: KafkaConsumer, writer, sink: PipelinedSink, buffer: MicroBatchBuffer):
+    try:
+        if sink is not None:
+            sink.drain()
+        if buffer is not None:
+            buffer.flush(writer, consumer, asynchronous=False)
+    except Exception as error:
+        # Not committed messages are consumed again after restart.
+        consumer.logger.error(f"Failed to complete pending writes on shutdown ({error})")
+    consumer.logger.info(f"Cassandra write stats: {writer.get_stats()}")
+    consumer.close()
+
+
+def _format_partitions(partitions: list) -> str:
+    return ", ".join(f"{p.topic}[{p.partition}]" for p in partitions)
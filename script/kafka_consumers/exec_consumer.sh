@@ -61,8 +61,37 @@ fi
 
 LOG_FILE=${LOGDIR}/${CONSUMER_ID}_${TS_NOW}.log
 
-# Start a consumer
-MAIN_SCRIPT=./${CONSUMER_ID}.py
+# Consumer publishing to a topic (e.g. microstructure_feature_consumer): create the topic if not exist.
+if [ -n "${OUTPUT_TOPIC_ID}" ]; then
+    # 1 day = 86400000ms
+    RETENTION_MS=$((RETENTION_DAYS*86400000))
+    SEGMENT_MS=86400000
+
+    kafka-topics.sh --bootstrap-server "${KAFKA_BOOTSTRAP_SERVERS}" \
+        --topic "${OUTPUT_TOPIC_ID}" \
+        --create \
+        --partitions "${OUTPUT_NUM_PARTITIONS}" \
+        --replication-factor "${REPLICATION_FOCTOR}" \
+        --if-not-exists \
+        --config retention.ms="${RETENTION_MS}"\
+        --config segment.ms="${SEGMENT_MS}"\
+        --config cleanup.policy="${CLEANUP_POLICY}"\
+        1>>$LOG_FILE 2>>$LOG_FILE
+
+    if [ $? -ne 0 ]; then
+        echo "##############################################" >>$LOG_FILE
+        echo "### $(TZ=Japan date +'%Y-%m-%d %H:%M:%S') Failded to create a topic: ${OUTPUT_TOPIC_ID} !!!" >>$LOG_FILE
+        echo "##############################################" >>$LOG_FILE
+        exit 1
+    fi
+fi
+
+# Start a consumer (NUM_WORKERS processes in the consumer group when more than 1)
+if [ "${NUM_WORKERS:-1}" -gt 1 ]; then
+    MAIN_SCRIPT=./consumer_group_runner.py
+else
+    MAIN_SCRIPT=./${CONSUMER_ID}.py
+fi
 if [ ! -f "$MAIN_SCRIPT" ]; then
     echo "##############################################"
     echo "### READ Failded !!! ($MAIN_SCRIPT)"
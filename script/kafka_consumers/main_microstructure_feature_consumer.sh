@@ -0,0 +1,2 @@
+#!/bin/bash
+sh exec_consumer.sh microstructure_feature_consumer
@@ -0,0 +1,2 @@
+#!/bin/bash
+sh exec_consumer.sh order_book_delta_consumer
@@ -0,0 +1,2 @@
+#!/bin/bash
+sh exec_consumer.sh trade_candles_minute_consumer
@@ -1,15 +1,12 @@
 import os, sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-import json
 import time
-import traceback
 import pytz
-from consumer_operation import KafkaConsumer
+from consumer_operation import KafkaConsumer, consume_to_cassandra
 from dotenv import load_dotenv
 from datetime import datetime, timezone, date
 from cassandra_operations import cassandra_operator
-from common import utils
 
 CONF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conf")
 
@@ -19,13 +16,42 @@ time.tzset()
 TZ_JST = pytz.timezone("Asia/Tokyo")
 
 
-def main():
-    # Get arguments
-    args = sys.argv
-    curr_date = args[1]
-    curr_timestamp = args[2]
-    consumer_id = args[3]
-
+def build_rows(consumed_data):
+    batch_data = []
+    for d in consumed_data["data"]:
+        id = d["id"]
+        trade_id = int(d["trade_id"])
+        takerSide = d["takerSide"]
+        amount = float(d["amount"])
+        quantity = float(d["quantity"])
+        price = float(d["price"])
+        createTime = d["createTime"]
+        ts_send = int(d["ts_send"])
+        ts_create_utc = datetime.utcfromtimestamp(int(d['createTime']))
+        dt_create_utc = date(ts_create_utc.year, ts_create_utc.month, ts_create_utc.day).strftime("%Y-%m-%d")
+
+        batch_data.append(
+            [
+                id,
+                trade_id,
+                takerSide,
+                amount,
+                quantity,
+                price,
+                createTime,
+                ts_send,
+                dt_create_utc,
+                str(ts_create_utc),
+                datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+            ]
+        )
+    return batch_data
+
+
+def run(curr_date: str, curr_timestamp: str, consumer_id: str, worker_id: int = None, on_stats=None):
+    """
+    Consume the topic until stopped. Called once per worker process by consumer_group_runner.py.
+    """
     # Load variables from conf file
     load_dotenv(verbose=True)
     conf_file = os.path.join(CONF_DIR, f"{consumer_id}.cf")
@@ -35,6 +61,13 @@ def main():
     topic_id = os.environ.get("TOPIC_ID")
     group_id = os.environ.get("GROUP_ID")
     offset_type = os.environ.get("OFFSET_TYPE")
+    message_format = os.environ.get("MESSAGE_FORMAT", "json")
+    # sequential: write each message synchronously (auto commit)
+    # pipelined:  keep polling while writes are in flight and commit offsets after the writes complete
+    # micro_batch: write the rows of many messages at once (FLUSH_ROWS or FLUSH_INTERVAL_MS)
+    consumer_mode = os.environ.get("CONSUMER_MODE", "sequential")
+    # auto: auto commit, manual: commit after the rows are written (sequential mode only)
+    commit_mode = os.environ.get("COMMIT_MODE", "auto")
 
     # Cassandra config
     keyspace = os.environ.get("KEYSPACE")
@@ -45,73 +78,55 @@ def main():
         VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
     """
 
+    # Bulk writer with a prepared statement. Partition key: (id, dt_create_utc)
+    write_mode = os.environ.get("WRITE_MODE", "unlogged_batch")
+    write_concurrency = int(os.environ.get("WRITE_CONCURRENCY", "32"))
+    write_batch_size = int(os.environ.get("WRITE_BATCH_SIZE", "100"))
+    writer = cassandra_operator.BulkWriter(
+        cass_ope,
+        insert_query,
+        partition_key_indexes=[0, 8],
+        mode=write_mode,
+        concurrency=write_concurrency,
+        max_batch_size=write_batch_size,
+    )
+
     # Create consumer
-    consumer = KafkaConsumer(curr_date, curr_timestamp, consumer_id, group_id, offset_type)
-    consumer.subscribe([topic_id])
-
-    max_retry_cnt = int(os.environ.get("RETRY_COUNT"))
-    curr_retry_cnt = 0
-    sleep_time = 600
-
-    consumer.logger.info("Start to consume")
-    while True:
-        try:
-            msg = consumer.poll(10.0)
-            if msg is None:
-                continue
-            if msg.error():
-                consumer.logger.error("Consumer error: {}".format(msg.error()))
-                sys.exit(1)
-
-            consumed_data = json.loads(msg.value().decode("utf-8"))
-
-            for d in consumed_data["data"]:
-                id = d["id"]
-                trade_id = int(d["trade_id"])
-                takerSide = d["takerSide"]
-                amount = float(d["amount"])
-                quantity = float(d["quantity"])
-                price = float(d["price"])
-                createTime = d["createTime"]
-                ts_send = int(d["ts_send"])
-                ts_create_utc = datetime.utcfromtimestamp(int(d['createTime']))
-                dt_create_utc = date(ts_create_utc.year, ts_create_utc.month, ts_create_utc.day).strftime("%Y-%m-%d")
-
-                batch_data = [
-                    [
-                        id,
-                        trade_id,
-                        takerSide,
-                        amount,
-                        quantity,
-                        price,
-                        createTime,
-                        ts_send,
-                        dt_create_utc,
-                        str(ts_create_utc),
-                        datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
-                    ]
-                ]
-
-                cass_ope.insert_batch_data(insert_query, batch_data)
-                curr_retry_cnt = 0
-
-        except Exception as error:
-            curr_retry_cnt += 1
-            if curr_retry_cnt > max_retry_cnt:
-                consumer.logger.error("Kafka consumer failed !!!")
-                consumer.logger.error("Error:".format(error))
-                consumer.logger.error(traceback.format_exc())
-                ts_now = datetime.now(TZ_JST).strftime("%Y-%m-%d %H:%M:%S")
-                message = f"{ts_now} [Failed] Kafka consumer: {consumer_id}.py"
-                utils.send_line_message(message)
-                consumer.close()
-                break
-            else:
-                consumer.logger.error("Kafka consumer failed !!! Retry ({}/{})".format(curr_retry_cnt, max_retry_cnt))
-                consumer.logger.error("Error:".format(error))
-                consumer.logger.error(traceback.format_exc())
-            time.sleep(sleep_time)
+    consumer = KafkaConsumer(
+        curr_date,
+        curr_timestamp,
+        consumer_id,
+        group_id,
+        offset_type,
+        message_format,
+        enable_auto_commit=(consumer_mode == "sequential" and commit_mode == "auto"),
+        worker_id=worker_id,
+    )
+
+    consume_config = {
+        "mode": consumer_mode,
+        "commit_mode": commit_mode,
+        "max_retry_count": os.environ.get("RETRY_COUNT"),
+        "retry_backoff_min": os.environ.get("RETRY_BACKOFF_MIN", "5"),
+        "retry_backoff_max": os.environ.get("RETRY_BACKOFF_MAX", "600"),
+        "stats_log_interval": os.environ.get("STATS_LOG_INTERVAL", "60"),
+        "max_in_flight_messages": os.environ.get("MAX_IN_FLIGHT_MESSAGES", "1000"),
+        "flush_rows": os.environ.get("FLUSH_ROWS", "5000"),
+        "flush_interval_ms": os.environ.get("FLUSH_INTERVAL_MS", "1000"),
+        "consume_batch_size": os.environ.get("CONSUME_BATCH_SIZE", "500"),
+    }
+
+    consume_to_cassandra(consumer, consumer_id, [topic_id], writer, build_rows, consume_config, on_stats)
+
+
+def main():
+    # Get arguments
+    args = sys.argv
+    curr_date = args[1]
+    curr_timestamp = args[2]
+    consumer_id = args[3]
+
+    run(curr_date, curr_timestamp, consumer_id)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,259 @@
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+import pytz
+from collections import deque
+from consumer_operation import KafkaConsumer, consume_to_cassandra
+from dotenv import load_dotenv
+from datetime import datetime, timezone
+from cassandra_operations import cassandra_operator
+from common.rolling_features import SymbolFeatures
+from kafka_producers.producer_operation import KafkaProducer, get_producer_config_from_env
+
+CONF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conf")
+
+# set the timezone to US/Pacific
+os.environ["TZ"] = "Asia/Tokyo"
+time.tzset()
+TZ_JST = pytz.timezone("Asia/Tokyo")
+
+FEATURE_COLUMNS = [
+    "id",
+    "window_sec",
+    "ts_feature",
+    "vwap",
+    "trade_count",
+    "buy_quantity",
+    "sell_quantity",
+    "trade_imbalance",
+    "spread",
+    "depth_imbalance",
+    "mid_price",
+    "realized_volatility",
+]
+
+
+class _RecentIds:
+    """
+    The last <max_size> ids applied and the features emitted after each of them, so that the records
+    consumed again after a retry are not applied twice but their features are written again.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.emitted = {}
+        self.order = deque()
+
+    def get(self, record_id: int) -> list:
+        """
+        Return the features emitted after <record_id> was applied, or None if it has not been applied.
+        """
+        return self.emitted.get(record_id)
+
+    def add(self, record_id: int, emitted: list):
+        self.emitted[record_id] = emitted
+        self.order.append(record_id)
+        if len(self.order) > self.max_size:
+            self.emitted.pop(self.order.popleft(), None)
+
+
+class FeatureEngine:
+    """
+    Update the rolling features of each symbol from the trade and order book topics and emit the features
+    of every window at most once per <emit_interval> seconds of event time per symbol.
+    Emitted features are published to <output_topic> and returned as rows of the Cassandra table.
+    Trades and books already applied (trade_id/seqid among the recent ids of the topic, partition and symbol)
+    are not applied again, so messages consumed again after a retry are not counted twice. Instead, the features
+    emitted when they were applied are returned again, so the rows of a failed write are rewritten.
+    The ids are not required to increase: with the default producer mode, the records of a symbol are spread
+    over random partitions.
+    """
+
+    def __init__(
+        self,
+        trade_topic: str,
+        book_topic: str,
+        windows: tuple,
+        depth: int,
+        emit_interval: int,
+        kafka_producer: KafkaProducer,
+        output_topic: str,
+        num_partitions: int,
+    ):
+        self.trade_topic = trade_topic
+        self.book_topic = book_topic
+        self.windows = windows
+        self.depth = depth
+        self.emit_interval = emit_interval
+        self.kafka_producer = kafka_producer
+        self.output_topic = output_topic
+        self.num_partitions = num_partitions
+        self.symbols = {}
+        self.ts_last_emit = {}
+        self.recent_ids = {}
+
+    def _get_symbol(self, symbol: str) -> SymbolFeatures:
+        if symbol not in self.symbols:
+            self.symbols[symbol] = SymbolFeatures(symbol, self.windows, self.depth)
+        return self.symbols[symbol]
+
+    def build_rows(self, consumed_data: dict, topic: str, partition: int) -> list:
+        # symbol -> features emitted after the records of this message (shared by the records of the symbol)
+        updated = {}
+        # features emitted when the replayed records were applied (already published to <output_topic>)
+        replayed = {}
+        for d in consumed_data["data"]:
+            record_id = int(d["trade_id"]) if topic == self.trade_topic else int(d["seqid"])
+            key = (topic, partition, d["id"])
+            if key not in self.recent_ids:
+                self.recent_ids[key] = _RecentIds()
+            emitted = self.recent_ids[key].get(record_id)
+            if emitted is not None:
+                replayed[id(emitted)] = emitted
+                continue
+
+            features = self._get_symbol(d["id"])
+            if topic == self.trade_topic:
+                features.on_trade(int(d["createTime"]), float(d["price"]), float(d["quantity"]), d["takerSide"])
+            elif topic == self.book_topic:
+                features.on_book(int(d["createTime"]), d["asks"], d["bids"], int(d["seqid"]))
+            self.recent_ids[key].add(record_id, updated.setdefault(d["id"], []))
+
+        records = []
+        for symbol, emitted in updated.items():
+            features = self.symbols[symbol]
+            ts_last_emit = self.ts_last_emit.get(symbol)
+            if ts_last_emit is not None and features.ts_last_event - ts_last_emit < self.emit_interval:
+                continue
+            self.ts_last_emit[symbol] = features.ts_last_event
+            emitted.extend(features.get_features())
+            self.kafka_producer.produce_message(
+                self.output_topic,
+                self.kafka_producer.serialize(self.output_topic, {"data": emitted}),
+                self.num_partitions,
+                key=symbol,
+            )
+            records.extend(emitted)
+        self.kafka_producer.poll_message(timeout=0)
+        for emitted in replayed.values():
+            records.extend(emitted)
+
+        ts_insert_utc = datetime.now(timezone.utc).replace(microsecond=0, tzinfo=None)
+        rows = []
+        for record in records:
+            ts_create_utc = datetime.utcfromtimestamp(record["ts_feature"])
+            rows.append(
+                [record[name] for name in FEATURE_COLUMNS]
+                + [ts_create_utc.strftime("%Y-%m-%d"), ts_create_utc, ts_insert_utc]
+            )
+        return rows
+
+
+def run(curr_date: str, curr_timestamp: str, consumer_id: str, worker_id: int = None, on_stats=None):
+    """
+    Consume the topics until stopped. Called once per worker process by consumer_group_runner.py.
+    """
+    # Load variables from conf file
+    load_dotenv(verbose=True)
+    conf_file = os.path.join(CONF_DIR, f"{consumer_id}.cf")
+    load_dotenv(conf_file)
+
+    # Kafka config
+    trade_topic_id = os.environ.get("TRADE_TOPIC_ID")
+    book_topic_id = os.environ.get("BOOK_TOPIC_ID")
+    group_id = os.environ.get("GROUP_ID")
+    offset_type = os.environ.get("OFFSET_TYPE")
+    message_format = os.environ.get("MESSAGE_FORMAT", "json")
+    # sequential: write each message synchronously (auto commit)
+    # pipelined:  keep polling while writes are in flight and commit offsets after the writes complete
+    # micro_batch: write the rows of many messages at once (FLUSH_ROWS or FLUSH_INTERVAL_MS)
+    consumer_mode = os.environ.get("CONSUMER_MODE", "sequential")
+    # auto: auto commit, manual: commit after the rows are written (sequential mode only)
+    commit_mode = os.environ.get("COMMIT_MODE", "auto")
+
+    # Feature config
+    windows = tuple(int(window) for window in os.environ.get("WINDOWS", "1,60,300").split(","))
+    depth = int(os.environ.get("DEPTH", "20"))
+    emit_interval = int(os.environ.get("EMIT_INTERVAL", "1"))
+
+    # Cassandra config
+    keyspace = os.environ.get("KEYSPACE")
+    table_name = os.environ.get("TABLE_NAME")
+    cass_ope = cassandra_operator.Operator(keyspace)
+    insert_query = f"""
+    INSERT INTO {table_name} (id,window_sec,ts_feature,vwap,trade_count,buy_quantity,sell_quantity,\
+        trade_imbalance,spread,depth_imbalance,mid_price,realized_volatility,dt_create_utc,ts_create_utc,ts_insert_utc)\
+        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+    """
+
+    # Bulk writer with a prepared statement. Partition key: (id, dt_create_utc)
+    write_mode = os.environ.get("WRITE_MODE", "unlogged_batch")
+    write_concurrency = int(os.environ.get("WRITE_CONCURRENCY", "32"))
+    write_batch_size = int(os.environ.get("WRITE_BATCH_SIZE", "100"))
+    writer = cassandra_operator.BulkWriter(
+        cass_ope,
+        insert_query,
+        partition_key_indexes=[0, 12],
+        mode=write_mode,
+        concurrency=write_concurrency,
+        max_batch_size=write_batch_size,
+    )
+
+    # Create consumer and the producer of the feature topic
+    consumer = KafkaConsumer(
+        curr_date,
+        curr_timestamp,
+        consumer_id,
+        group_id,
+        offset_type,
+        message_format,
+        enable_auto_commit=(consumer_mode == "sequential" and commit_mode == "auto"),
+        worker_id=worker_id,
+    )
+    kafka_producer = KafkaProducer(curr_date, curr_timestamp, consumer_id, get_producer_config_from_env())
+    engine = FeatureEngine(
+        trade_topic_id,
+        book_topic_id,
+        windows,
+        depth,
+        emit_interval,
+        kafka_producer,
+        os.environ.get("OUTPUT_TOPIC_ID"),
+        int(os.environ.get("OUTPUT_NUM_PARTITIONS", "3")),
+    )
+
+    consume_config = {
+        "mode": consumer_mode,
+        "commit_mode": commit_mode,
+        "max_retry_count": os.environ.get("RETRY_COUNT"),
+        "retry_backoff_min": os.environ.get("RETRY_BACKOFF_MIN", "5"),
+        "retry_backoff_max": os.environ.get("RETRY_BACKOFF_MAX", "600"),
+        "stats_log_interval": os.environ.get("STATS_LOG_INTERVAL", "60"),
+        "max_in_flight_messages": os.environ.get("MAX_IN_FLIGHT_MESSAGES", "1000"),
+        "flush_rows": os.environ.get("FLUSH_ROWS", "5000"),
+        "flush_interval_ms": os.environ.get("FLUSH_INTERVAL_MS", "1000"),
+        "consume_batch_size": os.environ.get("CONSUME_BATCH_SIZE", "500"),
+        "pass_topic": True,
+        "pass_partition": True,
+    }
+
+    topics = [trade_topic_id, book_topic_id]
+    try:
+        consume_to_cassandra(consumer, consumer_id, topics, writer, engine.build_rows, consume_config, on_stats)
+    finally:
+        kafka_producer.close()
+
+
+def main():
+    # Get arguments
+    args = sys.argv
+    curr_date = args[1]
+    curr_timestamp = args[2]
+    consumer_id = args[3]
+
+    run(curr_date, curr_timestamp, consumer_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+import pytz
+from consumer_operation import KafkaConsumer, consume_to_cassandra
+from dotenv import load_dotenv
+from datetime import datetime, timezone, date
+from cassandra_operations import cassandra_operator
+
+CONF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conf")
+
+# set the timezone to US/Pacific
+os.environ["TZ"] = "Asia/Tokyo"
+time.tzset()
+TZ_JST = pytz.timezone("Asia/Tokyo")
+
+
+def build_rows(consumed_data):
+    ts_insert_utc = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    batch_data = []
+    for d in consumed_data["data"]:
+        id = d["id"]
+        seqid = int(d["seqid"])
+        action = d["action"]
+        createTime = d["createTime"]
+        ts_send = int(d["ts_send"])
+        ts_create_utc = datetime.utcfromtimestamp(int(d["createTime"]))
+        dt_create_utc = date(ts_create_utc.year, ts_create_utc.month, ts_create_utc.day).strftime("%Y-%m-%d")
+
+        # Snapshot and checkpoint: all the levels, update: changed levels (base_amount 0: level removed)
+        for order_type, orders in [["ask", d["asks"]], ["bid", d["bids"]]]:
+            for order in orders:
+                batch_data.append(
+                    [
+                        id,
+                        seqid,
+                        action,
+                        order_type,
+                        float(order[0]),
+                        float(order[1]),
+                        createTime,
+                        ts_send,
+                        dt_create_utc,
+                        str(ts_create_utc),
+                        ts_insert_utc,
+                    ]
+                )
+    return batch_data
+
+
+def run(curr_date: str, curr_timestamp: str, consumer_id: str, worker_id: int = None, on_stats=None):
+    """
+    Consume the topic until stopped. Called once per worker process by consumer_group_runner.py.
+    """
+    # Load variables from conf file
+    load_dotenv(verbose=True)
+    conf_file = os.path.join(CONF_DIR, f"{consumer_id}.cf")
+    load_dotenv(conf_file)
+
+    # Kafka config
+    topic_id = os.environ.get("TOPIC_ID")
+    group_id = os.environ.get("GROUP_ID")
+    offset_type = os.environ.get("OFFSET_TYPE")
+    message_format = os.environ.get("MESSAGE_FORMAT", "json")
+    # sequential: write each message synchronously (auto commit)
+    # pipelined:  keep polling while writes are in flight and commit offsets after the writes complete
+    # micro_batch: write the rows of many messages at once (FLUSH_ROWS or FLUSH_INTERVAL_MS)
+    consumer_mode = os.environ.get("CONSUMER_MODE", "sequential")
+    # auto: auto commit, manual: commit after the rows are written (sequential mode only)
+    commit_mode = os.environ.get("COMMIT_MODE", "auto")
+
+    # Cassandra config
+    keyspace = os.environ.get("KEYSPACE")
+    table_name = os.environ.get("TABLE_NAME")
+    cass_ope = cassandra_operator.Operator(keyspace)
+    insert_query = f"""
+    INSERT INTO {table_name} (id,seqid,action,order_type,quote_price,base_amount,\
+        createTime,ts_send,dt_create_utc,ts_create_utc,ts_insert_utc)\
+        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+    """
+
+    # Bulk writer with a prepared statement. Partition key: (id, dt_create_utc)
+    write_mode = os.environ.get("WRITE_MODE", "unlogged_batch")
+    write_concurrency = int(os.environ.get("WRITE_CONCURRENCY", "32"))
+    write_batch_size = int(os.environ.get("WRITE_BATCH_SIZE", "100"))
+    writer = cassandra_operator.BulkWriter(
+        cass_ope,
+        insert_query,
+        partition_key_indexes=[0, 8],
+        mode=write_mode,
+        concurrency=write_concurrency,
+        max_batch_size=write_batch_size,
+    )
+
+    # Create consumer
+    consumer = KafkaConsumer(
+        curr_date,
+        curr_timestamp,
+        consumer_id,
+        group_id,
+        offset_type,
+        message_format,
+        enable_auto_commit=(consumer_mode == "sequential" and commit_mode == "auto"),
+        worker_id=worker_id,
+    )
+
+    consume_config = {
+        "mode": consumer_mode,
+        "commit_mode": commit_mode,
+        "max_retry_count": os.environ.get("RETRY_COUNT"),
+        "retry_backoff_min": os.environ.get("RETRY_BACKOFF_MIN", "5"),
+        "retry_backoff_max": os.environ.get("RETRY_BACKOFF_MAX", "600"),
+        "stats_log_interval": os.environ.get("STATS_LOG_INTERVAL", "60"),
+        "max_in_flight_messages": os.environ.get("MAX_IN_FLIGHT_MESSAGES", "1000"),
+        "flush_rows": os.environ.get("FLUSH_ROWS", "5000"),
+        "flush_interval_ms": os.environ.get("FLUSH_INTERVAL_MS", "1000"),
+        "consume_batch_size": os.environ.get("CONSUME_BATCH_SIZE", "500"),
+    }
+
+    consume_to_cassandra(consumer, consumer_id, [topic_id], writer, build_rows, consume_config, on_stats)
+
+
+def main():
+    # Get arguments
+    args = sys.argv
+    curr_date = args[1]
+    curr_timestamp = args[2]
+    consumer_id = args[3]
+
+    run(curr_date, curr_timestamp, consumer_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+import pytz
+from consumer_operation import KafkaConsumer, consume_to_cassandra
+from dotenv import load_dotenv
+from datetime import datetime, timezone, date
+from cassandra_operations import cassandra_operator
+from common.candle_aggregator import MinuteCandleAggregator
+
+CONF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conf")
+
+# set the timezone to US/Pacific
+os.environ["TZ"] = "Asia/Tokyo"
+time.tzset()
+TZ_JST = pytz.timezone("Asia/Tokyo")
+
+
+class TradeCandleBuilder:
+    """
+    Aggregate the trades of each message into 1-minute candles and return the rows of the candles
+    closed by the watermark.
+    Trades in the candles not closed yet are held in memory and lost on restart. The minutes that can be
+    incomplete (late trades dropped, first minute after a restart) are written by <reload_writer>, and
+    D_Load_crypto_candles_minute reloads them from the REST API.
+    """
+
+    def __init__(self, allowed_lateness: int, reload_writer, logger):
+        self.aggregator = MinuteCandleAggregator(allowed_lateness)
+        self.reload_writer = reload_writer
+        self.logger = logger
+        self.late_trades = 0
+
+    def _write_dirty_minutes(self, ts_insert_utc: str):
+        dirty_minutes = sorted(self.aggregator.dirty_minutes)
+        if len(dirty_minutes) == 0:
+            return
+        rows = [
+            [symbol, datetime.utcfromtimestamp(start_time).strftime("%Y-%m-%d"), start_time, ts_insert_utc]
+            for symbol, start_time in dirty_minutes
+        ]
+        try:
+            self.reload_writer.write(rows)
+        except Exception as error:
+            # The closed candles are already popped from the aggregator, so do not fail the message:
+            # the minutes are kept and written with the next message.
+            self.logger.warning(f"Failed to write the minutes to reload ({error})")
+            return
+        self.aggregator.dirty_minutes.difference_update(dirty_minutes)
+
+    def build_rows(self, consumed_data):
+        for d in consumed_data["data"]:
+            self.aggregator.add_trade(
+                d["id"],
+                int(d["trade_id"]),
+                int(d["createTime"]),
+                float(d["price"]),
+                float(d["quantity"]),
+                float(d["amount"]),
+                d["takerSide"],
+            )
+        if self.aggregator.late_trades > self.late_trades:
+            self.logger.warning(f"Dropped late trades: {self.aggregator.late_trades - self.late_trades}")
+            self.late_trades = self.aggregator.late_trades
+
+        ts_now = int(time.time())
+        ts_insert_utc = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        closed_candles = self.aggregator.pop_closed()
+        self._write_dirty_minutes(ts_insert_utc)
+        batch_data = []
+        for c in closed_candles:
+            ts_create_utc = datetime.utcfromtimestamp(c["closeTime"])
+            dt_create_utc = date(ts_create_utc.year, ts_create_utc.month, ts_create_utc.day).strftime("%Y-%m-%d")
+            batch_data.append(
+                [
+                    c["id"],
+                    c["low"],
+                    c["high"],
+                    c["open"],
+                    c["close"],
+                    c["amount"],
+                    c["quantity"],
+                    c["buyTakerAmount"],
+                    c["buyTakerQuantity"],
+                    c["tradeCount"],
+                    ts_now,
+                    c["weightedAverage"],
+                    "MINUTE_1",
+                    c["startTime"],
+                    c["closeTime"],
+                    dt_create_utc,
+                    str(ts_create_utc),
+                    ts_insert_utc,
+                ]
+            )
+        return batch_data
+
+
+def run(curr_date: str, curr_timestamp: str, consumer_id: str, worker_id: int = None, on_stats=None):
+    """
+    Consume the topic until stopped. Called once per worker process by consumer_group_runner.py.
+    """
+    # Load variables from conf file
+    load_dotenv(verbose=True)
+    conf_file = os.path.join(CONF_DIR, f"{consumer_id}.cf")
+    load_dotenv(conf_file)
+
+    # Kafka config
+    topic_id = os.environ.get("TOPIC_ID")
+    group_id = os.environ.get("GROUP_ID")
+    offset_type = os.environ.get("OFFSET_TYPE")
+    message_format = os.environ.get("MESSAGE_FORMAT", "json")
+    # sequential: write each message synchronously (auto commit)
+    # pipelined:  keep polling while writes are in flight and commit offsets after the writes complete
+    # micro_batch: write the rows of many messages at once (FLUSH_ROWS or FLUSH_INTERVAL_MS)
+    consumer_mode = os.environ.get("CONSUMER_MODE", "sequential")
+    # auto: auto commit, manual: commit after the rows are written (sequential mode only)
+    commit_mode = os.environ.get("COMMIT_MODE", "auto")
+
+    # Cassandra config
+    keyspace = os.environ.get("KEYSPACE")
+    table_name = os.environ.get("TABLE_NAME")
+    cass_ope = cassandra_operator.Operator(keyspace)
+    insert_query = f"""
+    INSERT INTO {table_name} (id,low,high,open,close,amount,quantity,buyTakerAmount,\
+        buyTakerQuantity,tradeCount,ts,weightedAverage,interval,startTime,closeTime,dt_create_utc,ts_create_utc,ts_insert_utc)\
+        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+    """
+
+    # Bulk writer with a prepared statement. Partition key: (id, dt_create_utc)
+    write_mode = os.environ.get("WRITE_MODE", "unlogged_batch")
+    write_concurrency = int(os.environ.get("WRITE_CONCURRENCY", "32"))
+    write_batch_size = int(os.environ.get("WRITE_BATCH_SIZE", "100"))
+    writer = cassandra_operator.BulkWriter(
+        cass_ope,
+        insert_query,
+        partition_key_indexes=[0, 15],
+        mode=write_mode,
+        concurrency=write_concurrency,
+        max_batch_size=write_batch_size,
+    )
+
+    # Minutes to reload from the REST API by the nightly load. Partition key: (id, dt_create_utc)
+    reload_table_name = os.environ.get("RELOAD_TABLE_NAME", "candles_minute_reload")
+    reload_query = f"""
+    INSERT INTO {reload_table_name} (id,dt_create_utc,startTime,ts_insert_utc) VALUES (%s,%s,%s,%s)
+    """
+    reload_writer = cassandra_operator.BulkWriter(
+        cass_ope,
+        reload_query,
+        partition_key_indexes=[0, 1],
+        mode=write_mode,
+        concurrency=write_concurrency,
+        max_batch_size=write_batch_size,
+    )
+
+    # Create consumer
+    consumer = KafkaConsumer(
+        curr_date,
+        curr_timestamp,
+        consumer_id,
+        group_id,
+        offset_type,
+        message_format,
+        enable_auto_commit=(consumer_mode == "sequential" and commit_mode == "auto"),
+        worker_id=worker_id,
+    )
+
+    consume_config = {
+        "mode": consumer_mode,
+        "commit_mode": commit_mode,
+        "max_retry_count": os.environ.get("RETRY_COUNT"),
+        "retry_backoff_min": os.environ.get("RETRY_BACKOFF_MIN", "5"),
+        "retry_backoff_max": os.environ.get("RETRY_BACKOFF_MAX", "600"),
+        "stats_log_interval": os.environ.get("STATS_LOG_INTERVAL", "60"),
+        "max_in_flight_messages": os.environ.get("MAX_IN_FLIGHT_MESSAGES", "1000"),
+        "flush_rows": os.environ.get("FLUSH_ROWS", "5000"),
+        "flush_interval_ms": os.environ.get("FLUSH_INTERVAL_MS", "1000"),
+        "consume_batch_size": os.environ.get("CONSUME_BATCH_SIZE", "500"),
+    }
+
+    # Trades later than ALLOWED_LATENESS seconds behind the latest trade are dropped (and their minutes reloaded).
+    candle_builder = TradeCandleBuilder(int(os.environ.get("ALLOWED_LATENESS", "10")), reload_writer, consumer.logger)
+    consume_to_cassandra(consumer, consumer_id, [topic_id], writer, candle_builder.build_rows, consume_config, on_stats)
+
+
+def main():
+    # Get arguments
+    args = sys.argv
+    curr_date = args[1]
+    curr_timestamp = args[2]
+    consumer_id = args[3]
+
+    run(curr_date, curr_timestamp, consumer_id)
+
+
+if __name__ == "__main__":
+    main()
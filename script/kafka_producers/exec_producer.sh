@@ -61,27 +61,40 @@ fi
 
 LOG_FILE=${LOGDIR}/${PRODUCER_ID}_${TS_NOW}.log
 
-# 1 day = 86400000ms
-RETENTION_MS=$((RETENTION_DAYS*86400000))
 SEGMENT_MS=86400000
 
-# Create a topic if not exist.
-kafka-topics.sh --bootstrap-server "${KAFKA_BOOTSTRAP_SERVERS}" \
-    --topic "${TOPIC_ID}" \
-    --create \
-    --partitions "${NUM_PARTITIONS}" \
-    --replication-factor "${REPLICATION_FOCTOR}" \
-    --if-not-exists \
-    --config retention.ms="${RETENTION_MS}"\
-    --config segment.ms="${SEGMENT_MS}"\
-    --config cleanup.policy="${CLEANUP_POLICY}"\
-    1>>$LOG_FILE 2>>$LOG_FILE
-
-if [ $? -ne 0 ]; then
-    echo "##############################################" >>$LOG_FILE
-    echo "### $(TZ=Japan date +'%Y-%m-%d %H:%M:%S') Failded to create a Kafka Producer !!!" >>$LOG_FILE
-    echo "##############################################" >>$LOG_FILE
-    exit 1
+create_topic() {
+    # 1 day = 86400000ms
+    RETENTION_MS=$((RETENTION_DAYS*86400000))
+
+    # Create a topic if not exist.
+    kafka-topics.sh --bootstrap-server "${KAFKA_BOOTSTRAP_SERVERS}" \
+        --topic "${TOPIC_ID}" \
+        --create \
+        --partitions "${NUM_PARTITIONS}" \
+        --replication-factor "${REPLICATION_FOCTOR}" \
+        --if-not-exists \
+        --config retention.ms="${RETENTION_MS}"\
+        --config segment.ms="${SEGMENT_MS}"\
+        --config cleanup.policy="${CLEANUP_POLICY}"\
+        1>>$LOG_FILE 2>>$LOG_FILE
+
+    if [ $? -ne 0 ]; then
+        echo "##############################################" >>$LOG_FILE
+        echo "### $(TZ=Japan date +'%Y-%m-%d %H:%M:%S') Failded to create a Kafka Producer !!!" >>$LOG_FILE
+        echo "##############################################" >>$LOG_FILE
+        exit 1
+    fi
+}
+
+if [ -n "${STREAM_PRODUCER_IDS}" ]; then
+    # Producer running several streams: create the topic of each stream.
+    for STREAM_PRODUCER_ID in $(echo "${STREAM_PRODUCER_IDS}" | tr ',' ' '); do
+        . ./conf/${STREAM_PRODUCER_ID}.cf
+        create_topic
+    done
+else
+    create_topic
 fi
 
 # Start a producer
@@ -0,0 +1,2 @@
+#!/bin/bash
+sh exec_producer.sh multi_stream_producer
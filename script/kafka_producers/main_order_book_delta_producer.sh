@@ -0,0 +1,2 @@
+#!/bin/bash
+sh exec_producer.sh order_book_delta_producer
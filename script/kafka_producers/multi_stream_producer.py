@@ -0,0 +1,154 @@
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import json
+import signal
+import time
+from datetime import datetime
+from common import utils
+import traceback
+import pytz
+from dotenv import load_dotenv, dotenv_values
+from poloniex_apis import websocket_api, websocket_async_api
+from kafka_producers.producer_operation import KafkaProducer, get_producer_config_from_env
+from kafka_producers import candles_minute_producer, order_book_producer, market_trade_producer
+from kafka_producers import order_book_delta_producer
+
+CONF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conf")
+
+# set the timezone to US/Pacific
+os.environ["TZ"] = "Asia/Tokyo"
+time.tzset()
+TZ_JST = pytz.timezone("Asia/Tokyo")
+
+# Websocket channel and response processor of each producer.
+# A stateful processor is created from the producer's conf by "func_create_processor".
+STREAMS = {
+    "candles_minute_producer": {
+        "channel": ["candles_minute_1"],
+        "func_process_response": candles_minute_producer.process_websocket_response,
+    },
+    "order_book_producer": {
+        "channel": ["book"],
+        "func_process_response": order_book_producer.process_websocket_response,
+    },
+    "market_trade_producer": {
+        "channel": ["trades"],
+        "func_process_response": market_trade_producer.process_websocket_response,
+    },
+    "order_book_delta_producer": {
+        "channel": ["book_lv2"],
+        "func_create_processor": order_book_delta_producer.create_processor,
+    },
+}
+
+
+def _create_operators(stream_producer_id, kafka_producer, symbols_per_connection, keepalive_config, reconnect_config):
+    # Read the conf of each producer without overwriting the environment variables of the others.
+    stream_conf = dotenv_values(os.path.join(CONF_DIR, f"{stream_producer_id}.cf"))
+    stream = STREAMS[stream_producer_id]
+    symbols = stream_conf["SYMBOLS"].split(",")
+
+    operators = []
+    for i, symbol_group in enumerate(websocket_api.shard_symbols(symbols, symbols_per_connection)):
+        subscribe_payload = {
+            "event": "subscribe",
+            "channel": stream["channel"],
+            "symbols": symbol_group,
+        }
+        if "DEPTH" in stream_conf and "func_create_processor" not in stream:
+            subscribe_payload["depth"] = int(stream_conf["DEPTH"])
+
+        ping_payload = {"event": "ping"}
+
+        request_data = {
+            "subscribe_payload": json.dumps(subscribe_payload),
+            "ping_payload": json.dumps(ping_payload),
+            **keepalive_config,
+        }
+        kafka_config = {
+            "topic_id": stream_conf["TOPIC_ID"],
+            "num_partitions": stream_conf["NUM_PARTITIONS"],
+            "func_process_response": (
+                stream["func_create_processor"](stream_conf)
+                if "func_create_processor" in stream
+                else stream["func_process_response"]
+            ),
+            "kafka_producer": kafka_producer,
+        }
+        operators.append(
+            websocket_async_api.AsyncPoloniexSocketOperator(
+                f"{stream_producer_id}_{i}", "public", request_data, kafka_config, reconnect_config
+            )
+        )
+    return operators
+
+
+async def _run(engine):
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+
+    def _shutdown():
+        engine.stop()
+        main_task.cancel()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, _shutdown)
+
+    try:
+        await engine.run()
+    except asyncio.CancelledError:
+        engine.logger.info("Stopped by signal")
+
+
+def main():
+    # Get arguments
+    args = sys.argv
+    curr_date = args[1]
+    curr_timestamp = args[2]
+    producer_id = args[3]
+
+    # Load variables from conf file
+    load_dotenv(verbose=True)
+    conf_file = os.path.join(CONF_DIR, f"{producer_id}.cf")
+    load_dotenv(conf_file)
+    stream_producer_ids = os.environ.get("STREAM_PRODUCER_IDS").split(",")
+    symbols_per_connection = int(os.environ.get("SYMBOLS_PER_CONNECTION", "20"))
+    health_log_interval = float(os.environ.get("HEALTH_LOG_INTERVAL", "60"))
+    keepalive_config = {
+        "ping_interval": os.environ.get("PING_INTERVAL", "20"),
+        "pong_timeout": os.environ.get("PONG_TIMEOUT", "10"),
+    }
+    reconnect_config = {
+        "backoff_min": os.environ.get("RECONNECT_BACKOFF_MIN", "1"),
+        "backoff_max": os.environ.get("RECONNECT_BACKOFF_MAX", "60"),
+        "max_retry_count": os.environ.get("RETRY_COUNT"),
+    }
+
+    kafka_producer = KafkaProducer(curr_date, curr_timestamp, producer_id, get_producer_config_from_env())
+    engine = websocket_async_api.AsyncPoloniexEngine(kafka_producer, health_log_interval=health_log_interval)
+    for stream_producer_id in stream_producer_ids:
+        for operator in _create_operators(
+            stream_producer_id, kafka_producer, symbols_per_connection, keepalive_config, reconnect_config
+        ):
+            engine.add_operator(operator)
+
+    try:
+        asyncio.run(_run(engine))
+    except Exception as error:
+        ts_now = datetime.now(TZ_JST).strftime("%Y-%m-%d %H:%M:%S")
+        message = f"{ts_now} [Failed] Kafka producer: {producer_id}.py"
+        utils.send_line_message(message)
+        kafka_producer.logger.error(f"An exception occurred: {error}")
+        kafka_producer.logger.error(traceback.format_exc())
+
+    failed = [health["name"] for health in engine.get_health() if health["state"] == "failed"]
+    if len(failed) > 0:
+        ts_now = datetime.now(TZ_JST).strftime("%Y-%m-%d %H:%M:%S")
+        message = f"{ts_now} [Failed] Kafka producer: {producer_id}.py (exceeded max retry count: {','.join(failed)})"
+        utils.send_line_message(message)
+
+
+if __name__ == "__main__":
+    main()
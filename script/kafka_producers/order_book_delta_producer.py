@@ -0,0 +1,220 @@
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json
+import time
+from datetime import datetime
+import threading
+from common import utils
+from common.order_book import OrderBook, SequenceGapError
+import traceback
+import pytz
+from dotenv import load_dotenv
+from poloniex_apis import websocket_api
+from kafka_producers.producer_operation import KafkaProducer, get_producer_config_from_env, install_shutdown_handlers
+
+CONF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conf")
+
+# set the timezone to US/Pacific
+os.environ["TZ"] = "Asia/Tokyo"
+time.tzset()
+TZ_JST = pytz.timezone("Asia/Tokyo")
+
+
+def _unix_time_millisecond_to_second(unix_time):
+    return int((unix_time) / 1000.0)
+
+
+class OrderBookDeltaProcessor:
+    """
+    Rebuild the local order book of each symbol from the incremental "book_lv2" channel and emit
+        emit_mode="delta":      the snapshot, the changed levels of each update (amount 0: level removed) and
+                                the top <depth> levels every <checkpoint_interval> seconds per symbol
+                                (topic: crypto.order_book_delta)
+        emit_mode="checkpoint": only the top <depth> levels every <checkpoint_interval> seconds per symbol,
+                                in the same format as the "book" channel (topic: crypto.order_book)
+    A sequence gap raises websocket_api.ResyncRequired, and the connection subscribes again to get a new snapshot.
+    The checkpoint interval is measured by createTime of the messages, so recorded messages are processed
+    in the same way as live ones.
+    """
+
+    def __init__(self, emit_mode: str = "delta", depth: int = 20, checkpoint_interval: int = 60):
+        if emit_mode not in ["delta", "checkpoint"]:
+            raise ValueError(f"Unknown emit mode: {emit_mode} (expected delta or checkpoint)")
+        self.emit_mode = emit_mode
+        self.depth = depth
+        self.checkpoint_interval = checkpoint_interval
+        self.books = {}
+        self.ts_last_checkpoint = {}
+
+    def __call__(self, response: dict) -> dict:
+        records = []
+        for data in response["data"]:
+            records.extend(self.process(response.get("action"), data))
+        return {"data": records}
+
+    def _delta_record(self, book: OrderBook, action: str, asks: list, bids: list, data: dict) -> dict:
+        return {
+            "id": book.symbol,
+            "createTime": _unix_time_millisecond_to_second(data["createTime"]),
+            "action": action,
+            "asks": asks,
+            "bids": bids,
+            "lastId": int(data["lastId"]),
+            "seqid": book.seqid,
+            "ts_send": _unix_time_millisecond_to_second(data["ts"]),
+        }
+
+    def _checkpoint_record(self, book: OrderBook, data: dict) -> dict:
+        asks, bids = book.get_top(self.depth)
+        if self.emit_mode == "delta":
+            return self._delta_record(book, "checkpoint", asks, bids, data)
+        return {
+            "id": book.symbol,
+            "createTime": _unix_time_millisecond_to_second(data["createTime"]),
+            "asks": asks,
+            "bids": bids,
+            "seqid": book.seqid,
+            "ts_send": _unix_time_millisecond_to_second(data["ts"]),
+        }
+
+    def process(self, action: str, data: dict) -> list:
+        """
+        Apply one book message to the local book of the symbol and return the records to emit.
+        """
+        symbol = data["symbol"]
+        book = self.books.setdefault(symbol, OrderBook(symbol))
+        ts_create = _unix_time_millisecond_to_second(data["createTime"])
+
+        records = []
+        if action == "snapshot":
+            book.apply_snapshot(data["asks"], data["bids"], data["id"])
+            if self.emit_mode == "delta":
+                asks, bids = book.get_top(None)
+                records.append(self._delta_record(book, "snapshot", asks, bids, data))
+                self.ts_last_checkpoint[symbol] = ts_create
+        else:
+            try:
+                asks, bids = book.apply_update(data["asks"], data["bids"], data["id"], data["lastId"])
+            except SequenceGapError as error:
+                self.ts_last_checkpoint.pop(symbol, None)
+                raise websocket_api.ResyncRequired(str(error)) from error
+            if self.emit_mode == "delta" and (len(asks) > 0 or len(bids) > 0):
+                records.append(self._delta_record(book, "update", asks, bids, data))
+
+        ts_last_checkpoint = self.ts_last_checkpoint.get(symbol)
+        if ts_last_checkpoint is None or ts_create - ts_last_checkpoint >= self.checkpoint_interval:
+            records.append(self._checkpoint_record(book, data))
+            self.ts_last_checkpoint[symbol] = ts_create
+        return records
+
+
+def create_processor(conf: dict) -> OrderBookDeltaProcessor:
+    return OrderBookDeltaProcessor(
+        conf.get("EMIT_MODE", "delta"),
+        int(conf.get("DEPTH", "20")),
+        int(conf.get("CHECKPOINT_INTERVAL", "60")),
+    )
+
+
+def _start_procedure(producer_id, connection_type, request_data, send_kafka, kafka_config):
+    polo_ws_operator = websocket_api.PoloniexSocketOperator(connection_type, request_data, send_kafka, kafka_config)
+
+    retry_count = 0
+    max_retry_count = int(os.environ.get("RETRY_COUNT"))
+    try:
+        while True:
+            try:
+                polo_ws_operator.run_forever()
+            except Exception as error:
+                polo_ws_operator.kafka_producer.logger.warning(f"API ERROR: Could not get order book data ({error})")
+                polo_ws_operator.kafka_producer.logger.warning(f"Retry Request: {retry_count}")
+                polo_ws_operator.kafka_producer.logger.warning(traceback.format_exc())
+                if retry_count > max_retry_count:
+                    break
+                retry_count += 1
+                time.sleep(60)
+
+    except Exception as error:
+        ts_now = datetime.now(TZ_JST).strftime("%Y-%m-%d %H:%M:%S")
+        message = f"{ts_now} [Failed] Kafka producer: {producer_id}.py (exceeded max retry count)"
+        utils.send_line_message(message)
+        polo_ws_operator.kafka_producer.logger.error(f"An exception occurred: {error}")
+        polo_ws_operator.kafka_producer.logger.error(traceback.format_exc())
+
+
+def main():
+    # Get arguments
+    args = sys.argv
+    curr_date = args[1]
+    curr_timestamp = args[2]
+    producer_id = args[3]
+
+    # Load variables from conf file
+    load_dotenv(verbose=True)
+    conf_file = os.path.join(CONF_DIR, f"{producer_id}.cf")
+    load_dotenv(conf_file)
+    num_partitions = os.environ.get("NUM_PARTITIONS")
+    topic_id = os.environ.get("TOPIC_ID")
+    symbols = os.environ.get("SYMBOLS").split(",")
+    multiplex_mode = os.environ.get("MULTIPLEX_MODE", "false").lower() == "true"
+    symbols_per_connection = int(os.environ.get("SYMBOLS_PER_CONNECTION", "1"))
+    producer_config = get_producer_config_from_env()
+    # Flush the producers of all connections on SIGTERM/SIGINT, in every producer mode.
+    install_shutdown_handlers()
+
+    # Multiplexed mode: one connection subscribes to a group of symbols and
+    # all connections share one Kafka producer.
+    if multiplex_mode:
+        symbol_groups = websocket_api.shard_symbols(symbols, symbols_per_connection)
+        kafka_producer = KafkaProducer(curr_date, curr_timestamp, producer_id, producer_config)
+    else:
+        symbol_groups = [[symbol] for symbol in symbols]
+        kafka_producer = None
+
+    for symbol_group in symbol_groups:
+        subscribe_payload = {
+            "event": "subscribe",
+            "channel": ["book_lv2"],
+            "symbols": symbol_group,
+        }
+
+        ping_payload = {"event": "ping"}
+
+        # Create Poloniex WebSocket operator
+        connection_type = "public"
+        request_data = {
+            "subscribe_payload": json.dumps(subscribe_payload),
+            "ping_payload": json.dumps(ping_payload),
+            "ping_interval": os.environ.get("PING_INTERVAL", "20"),
+            "pong_timeout": os.environ.get("PONG_TIMEOUT", "10"),
+            "stats_log_interval": os.environ.get("STATS_LOG_INTERVAL", "60"),
+        }
+        send_kafka = True
+        kafka_config = {
+            "curr_date": curr_date,
+            "curr_timestamp": curr_timestamp,
+            "producer_id": producer_id,
+            "topic_id": topic_id,
+            "num_partitions": num_partitions,
+            # The local books of a connection are kept by its own processor.
+            "func_process_response": create_processor(os.environ),
+            "kafka_producer": kafka_producer,
+            "producer_config": producer_config,
+        }
+
+        thread = threading.Thread(
+            target=_start_procedure,
+            args=(
+                producer_id,
+                connection_type,
+                request_data,
+                send_kafka,
+                kafka_config,
+            ),
+        )
+        thread.start()
+
+
+if __name__ == "__main__":
+    main()
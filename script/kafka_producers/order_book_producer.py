@@ -10,6 +10,7 @@ import traceback
 import pytz
 from dotenv import load_dotenv
 from poloniex_apis import websocket_api
+from kafka_producers.producer_operation import KafkaProducer, get_producer_config_from_env, install_shutdown_handlers
 
 CONF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conf")
 
@@ -81,12 +82,26 @@ def main():
     topic_id = os.environ.get("TOPIC_ID")
     symbols = os.environ.get("SYMBOLS").split(",")
     depth = int(os.environ.get("DEPTH"))
-
-    for symbol in symbols:
+    multiplex_mode = os.environ.get("MULTIPLEX_MODE", "false").lower() == "true"
+    symbols_per_connection = int(os.environ.get("SYMBOLS_PER_CONNECTION", "1"))
+    producer_config = get_producer_config_from_env()
+    # Flush the producers of all connections on SIGTERM/SIGINT, in every producer mode.
+    install_shutdown_handlers()
+
+    # Multiplexed mode: one connection subscribes to a group of symbols and
+    # all connections share one Kafka producer.
+    if multiplex_mode:
+        symbol_groups = websocket_api.shard_symbols(symbols, symbols_per_connection)
+        kafka_producer = KafkaProducer(curr_date, curr_timestamp, producer_id, producer_config)
+    else:
+        symbol_groups = [[symbol] for symbol in symbols]
+        kafka_producer = None
+
+    for symbol_group in symbol_groups:
         subscribe_payload = {
             "event": "subscribe",
             "channel": ["book"],
-            "symbols": [symbol],
+            "symbols": symbol_group,
             "depth": depth,
         }
 
@@ -97,6 +112,9 @@ def main():
         request_data = {
             "subscribe_payload": json.dumps(subscribe_payload),
             "ping_payload": json.dumps(ping_payload),
+            "ping_interval": os.environ.get("PING_INTERVAL", "20"),
+            "pong_timeout": os.environ.get("PONG_TIMEOUT", "10"),
+            "stats_log_interval": os.environ.get("STATS_LOG_INTERVAL", "60"),
         }
         send_kafka = True
         kafka_config = {
@@ -106,6 +124,8 @@ def main():
             "topic_id": topic_id,
             "num_partitions": num_partitions,
             "func_process_response": process_websocket_response,
+            "kafka_producer": kafka_producer,
+            "producer_config": producer_config,
         }
 
         thread = threading.Thread(
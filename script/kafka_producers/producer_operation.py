@@ -3,14 +3,65 @@ import os, sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from confluent_kafka import Producer
 import random
+import threading
+import atexit
+import signal
 from common import env_variables
+from common.message_serializer import get_serializer
 import logging
 
+# Every KafkaProducer of the process, closed (flushed) by close_all_producers() on shutdown.
+_producers = []
+_producers_lock = threading.Lock()
+
+
+def get_producer_config_from_env():
+    """
+    Read the producer config from environment variables (loaded from the producer's conf file).
+    """
+    return {
+        "mode": os.environ.get("PRODUCER_MODE", "default"),
+        "message_format": os.environ.get("MESSAGE_FORMAT", "json"),
+        "linger_ms": os.environ.get("LINGER_MS", "50"),
+        "batch_size": os.environ.get("BATCH_SIZE", "262144"),
+        "compression_type": os.environ.get("COMPRESSION_TYPE", "lz4"),
+        "enable_idempotence": os.environ.get("ENABLE_IDEMPOTENCE", "true"),
+        "poll_interval": os.environ.get("POLL_INTERVAL", "0.1"),
+        "flush_timeout": os.environ.get("FLUSH_TIMEOUT", "30"),
+    }
+
 
 class KafkaProducer:
-    def __init__(self, curr_date: str, curr_timestamp: str, producer_id: str):
+    """
+    mode="default":    random partition per message, caller polls delivery reports.
+    mode="throughput": batched/compressed/idempotent produce keyed by symbol,
+                       delivery reports are served by a background poll thread.
+    """
+
+    def __init__(self, curr_date: str, curr_timestamp: str, producer_id: str, producer_config: dict = None):
+        producer_config = producer_config or {"mode": "default"}
+        self.throughput_mode = producer_config.get("mode") == "throughput"
+
         self.kafka_conf = {"bootstrap.servers": env_variables.KAFKA_BOOTSTRAP_SERVERS}
+        if self.throughput_mode:
+            self.kafka_conf.update(
+                {
+                    "linger.ms": int(producer_config.get("linger_ms", 50)),
+                    "batch.size": int(producer_config.get("batch_size", 262144)),
+                    "compression.type": producer_config.get("compression_type", "lz4"),
+                    "enable.idempotence": str(producer_config.get("enable_idempotence", "true")).lower() == "true",
+                }
+            )
         self.Producer = Producer(self.kafka_conf)
+        self.serializer = get_serializer(producer_config.get("message_format", "json"))
+
+        self.delivered_count = 0
+        self.failed_count = 0
+        self.poll_interval = float(producer_config.get("poll_interval", 0.1))
+        self.flush_timeout = float(producer_config.get("flush_timeout", 30))
+        self._poll_thread = None
+        self._poll_stop_event = threading.Event()
+        self._closed = False
 
         # set logging
         logdir = "{}/{}".format(env_variables.KAFKA_LOG_HOME, curr_date)
@@ -23,24 +74,107 @@ class KafkaProducer:
         self.logger = logging.getLogger()
         self.logger.setLevel(20)
 
+        if self.throughput_mode:
+            self.start_poll_thread()
+
+        # Producers can be created in the websocket threads, so the shutdown handlers of main() close them
+        # through the registry instead of each producer installing its own handlers.
+        with _producers_lock:
+            _producers.append(self)
+
     def receipt_(self, err, msg):
         if err is not None:
+            self.failed_count += 1
             self.logger.error("Error: {}".format(err))
         else:
-            message = "Produced message on topic {} with value of {}\n".format(msg.topic(), msg.value().decode("utf-8"))
+            self.delivered_count += 1
+            message = "Produced message on topic {} ({} bytes)\n".format(msg.topic(), len(msg.value()))
+
+    def serialize(self, topic_name: str, message: dict) -> bytes:
+        return self.serializer.serialize(topic_name, message)
+
+    def produce_message(self, topic_name: str, message, num_partitions: int, key: str = None):
+        # message: str (encoded to UTF-8) or bytes already serialized by serialize()
+        value = message if isinstance(message, bytes) else message.encode("utf-8")
+        if self.throughput_mode and key is not None:
+            # The partition is chosen from the key so that messages of one symbol keep their order.
+            self.Producer.produce(
+                topic_name,
+                key=key.encode("utf-8"),
+                value=value,
+                callback=self.receipt_,
+            )
+            return
 
-    def produce_message(self, topic_name: str, message: str, num_partitions: int):
         partition_id = random.randint(0, num_partitions - 1)
         self.Producer.produce(
             topic_name,
-            value=message.encode("utf-8"),
+            value=value,
             partition=partition_id,
             callback=self.receipt_,
         )
 
     def poll_message(self, timeout=0):
+        # Delivery reports are served by the background thread.
+        if self._poll_thread is not None:
+            return
         self.Producer.poll(timeout)
 
+    def start_poll_thread(self):
+        def _poll():
+            while not self._poll_stop_event.is_set():
+                self.Producer.poll(self.poll_interval)
+
+        self._poll_thread = threading.Thread(target=_poll, daemon=True)
+        self._poll_thread.start()
+
+    def flush(self, timeout: float = None):
+        timeout = self.flush_timeout if timeout is None else timeout
+        remaining = self.Producer.flush(timeout)
+        if remaining > 0:
+            self.logger.error(f"{remaining} messages were not delivered before flush timeout ({timeout}s)")
+        return remaining
+
+    def close(self):
+        """
+        Flush in-flight messages and stop the background poll thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        remaining = self.flush()
+        self._poll_stop_event.set()
+        if self._poll_thread is not None:
+            self._poll_thread.join(timeout=self.poll_interval * 10)
+        self.logger.info(
+            f"Kafka producer closed (delivered: {self.delivered_count}, failed: {self.failed_count}, "
+            f"not delivered: {remaining})"
+        )
+
+
+def close_all_producers():
+    with _producers_lock:
+        producers = list(_producers)
+    for producer in producers:
+        producer.close()
+
+
+def install_shutdown_handlers():
+    """
+    Flush the in-flight messages of all producers of the process on normal exit and on SIGTERM/SIGINT.
+    Call this from main() (signal handlers can only be set from the main thread), in every producer mode.
+    """
+    atexit.register(close_all_producers)
+
+    def _handle_signal(signum, frame):
+        logging.getLogger().info(f"Received signal {signum}. Flush in-flight messages.")
+        close_all_producers()
+        # The websocket threads never return, so exit without joining them.
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+
 
 if __name__ == "__main__":
     curr_date = "99999999"
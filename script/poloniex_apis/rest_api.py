@@ -3,9 +3,26 @@ from common import env_variables
 
 sys.path.append(env_variables.POLONIEX_HOME)
 
+import time
+import random
+import logging
+import threading
+import requests
+from collections import deque
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from polosdk import RestClient
+from common.rate_limiter import TokenBucket
 from pprint import pprint
 
+logger = logging.getLogger(__name__)
+
+# Poloniex rate limit of the public market data endpoints (requests per second per IP)
+PUBLIC_RATE_LIMIT = 200
+# Max number of candles returned by one request
+CANDLES_LIMIT = 500
+POLONIEX_REST_URL = "https://api.poloniex.com"
+
 
 class PoloniexOperator:
     def __init__(self):
@@ -29,5 +46,154 @@ class PoloniexOperator:
             interval,
             start_time=int(start) * 1000,
             end_time=int(end) * 1000,
-            limit=500,
+            limit=CANDLES_LIMIT,
         )
+
+
+class PoloniexSessionClient:
+    """
+    REST client on one keep-alive requests.Session, so the TCP/TLS connections are reused across requests.
+    The session keeps up to <pool_maxsize> connections and can be shared by threads.
+    Use get_session_client() to get the client cached for the process.
+    """
+
+    def __init__(self, pool_maxsize: int = 16, timeout: float = 30):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.adapter = adapter
+        self.lock = threading.Lock()
+        self.num_requests = 0
+
+    def _get(self, path: str, params: dict = None):
+        with self.lock:
+            self.num_requests += 1
+        response = self.session.get(POLONIEX_REST_URL + path, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def get_candles(self, asset, interval, start, end):
+        params = {
+            "interval": interval,
+            "startTime": int(start) * 1000,
+            "endTime": int(end) * 1000,
+            "limit": CANDLES_LIMIT,
+        }
+        return self._get(f"/markets/{asset}/candles", params)
+
+    def get_stats(self) -> dict:
+        """
+        Return the number of requests and of connections opened by the session.
+        """
+        pools = self.adapter.poolmanager.pools
+        num_connections = sum(pools[key].num_connections for key in pools.keys())
+        num_requests = self.num_requests
+        return {
+            "requests": num_requests,
+            "connections": num_connections,
+            "reused": max(num_requests - num_connections, 0),
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_session_client = None
+_session_client_pid = None
+_session_client_lock = threading.Lock()
+
+
+def get_session_client(pool_maxsize: int = 16) -> PoloniexSessionClient:
+    """
+    Return the session client of this process. A forked worker process creates its own client,
+    because the connections of the parent cannot be shared.
+    """
+    global _session_client, _session_client_pid
+    with _session_client_lock:
+        if _session_client is None or _session_client_pid != os.getpid():
+            _session_client = PoloniexSessionClient(pool_maxsize)
+            _session_client_pid = os.getpid()
+        return _session_client
+
+
+class CandleFetcher:
+    """
+    Fetch the candles of many (asset, from, to) windows concurrently.
+    All the requests share one token bucket, so the fetch is bounded by <rate_limit> requests per second,
+    and the keep-alive session client of the process.
+    A failed request is retried after an exponential backoff (<backoff_min> * 2^retry seconds with jitter,
+    up to <backoff_max>) and the fetch fails once a request has failed more than <max_retry_count> times.
+    """
+
+    def __init__(
+        self,
+        rate_limit: float = 10,
+        max_workers: int = 8,
+        max_retry_count: int = 5,
+        backoff_min: float = 1,
+        backoff_max: float = 600,
+    ):
+        self.bucket = TokenBucket(min(rate_limit, PUBLIC_RATE_LIMIT))
+        self.max_workers = max_workers
+        self.max_retry_count = max_retry_count
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.client = get_session_client(max(max_workers, 16))
+
+    def _get_backoff(self, retry: int) -> float:
+        backoff = min(self.backoff_min * (2**retry), self.backoff_max)
+        return backoff * random.uniform(0.5, 1.0)
+
+    def fetch_window(self, asset: str, interval: str, start: int, end: int):
+        retry = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                logger.info("{}: Load from {} to {}".format(asset, start, end))
+                return self.client.get_candles(asset, interval, start, end)
+            except Exception as error:
+                if retry >= self.max_retry_count:
+                    raise
+                backoff = self._get_backoff(retry)
+                retry += 1
+                logger.warning(
+                    "{}: Could not load from {} to {} ({}). Retry {} in {:.1f} seconds".format(
+                        asset, start, end, error, retry, backoff
+                    )
+                )
+                time.sleep(backoff)
+
+    def iter_fetch(self, requests: list, interval: str, max_pending: int = None):
+        """
+        Yield (asset, candles) of each window of <requests>: [[asset, from, to], ...] in the order of the requests.
+        At most <max_pending> windows are fetched ahead of the caller, so the memory is bounded and the caller
+        (e.g. Cassandra writes) runs while the next windows are fetched.
+        """
+        if max_pending is None:
+            max_pending = self.max_workers * 2
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                for asset, start, end in requests:
+                    pending.append((asset, executor.submit(self.fetch_window, asset, interval, start, end)))
+                    if len(pending) >= max_pending:
+                        asset, future = pending.popleft()
+                        yield asset, future.result() or []
+                while len(pending) > 0:
+                    asset, future = pending.popleft()
+                    yield asset, future.result() or []
+            finally:
+                for _, future in pending:
+                    future.cancel()
+        logger.info("Session stats: {}".format(self.client.get_stats()))
+
+    def fetch(self, requests: list, interval: str) -> dict:
+        """
+        Fetch the windows of <requests>: [[asset, from, to], ...] (unix time in seconds)
+        and return the candles of each asset in the order of the requests: {asset: [candle, ...]}
+        """
+        candle_data = {}
+        for asset, data in self.iter_fetch(requests, interval, max_pending=max(len(requests), 1)):
+            candle_data.setdefault(asset, []).extend(data)
+        return candle_data
@@ -3,15 +3,107 @@ import os, sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import websocket
 import json
+import time
+import random
+import threading
+import logging
 import traceback
 from kafka_producers.producer_operation import KafkaProducer
 
 
+class ResyncRequired(Exception):
+    """
+    Raised by a response processor when the subscribed stream must be subscribed again
+    (e.g. a sequence gap in incremental order book updates). The connection is closed and reconnected.
+    """
+
+
+def get_resync_backoff(resync_count: int, backoff_min: float = 1, backoff_max: float = 60) -> float:
+    """
+    Wait before subscribing again after <resync_count> consecutive resyncs (exponential backoff with jitter).
+    """
+    backoff = min(backoff_max, backoff_min * (2 ** (resync_count - 1)))
+    return backoff * random.uniform(0.5, 1.0)
+
+
+class PingKeepalive:
+    """
+    Keepalive state of one websocket connection.
+    A ping is sent every <ping_interval> seconds regardless of the number of subscribed symbols,
+    and the connection is regarded as dead when no pong arrives within <pong_timeout> seconds of the oldest
+    unanswered ping. The keepalive loop waits by get_wait_time(), so the pong deadline is checked on time
+    even when it is shorter or longer than <ping_interval>.
+    """
+
+    def __init__(self, ping_interval: float = 20, pong_timeout: float = 10):
+        self.ping_interval = float(ping_interval)
+        self.pong_timeout = float(pong_timeout)
+        self.pings_sent = 0
+        self.pongs_late = 0
+        self.reset()
+
+    def reset(self):
+        # The first ping is sent <ping_interval> seconds after the connection is opened.
+        self.ts_last_ping = time.monotonic()
+        # Oldest ping without a pong (None: all pings have been answered)
+        self.ts_unanswered_ping = None
+
+    def on_ping_sent(self):
+        self.pings_sent += 1
+        self.ts_last_ping = time.monotonic()
+        if self.ts_unanswered_ping is None:
+            self.ts_unanswered_ping = self.ts_last_ping
+
+    def on_pong(self):
+        self.ts_unanswered_ping = None
+
+    def is_ping_due(self) -> bool:
+        return time.monotonic() - self.ts_last_ping >= self.ping_interval
+
+    def is_pong_late(self) -> bool:
+        if self.ts_unanswered_ping is None:
+            return False
+        if time.monotonic() - self.ts_unanswered_ping >= self.pong_timeout:
+            self.pongs_late += 1
+            return True
+        return False
+
+    def get_wait_time(self) -> float:
+        """
+        Return the seconds until the next ping or the pong deadline, whichever comes first.
+        """
+        ts_next = self.ts_last_ping + self.ping_interval
+        if self.ts_unanswered_ping is not None:
+            ts_next = min(ts_next, self.ts_unanswered_ping + self.pong_timeout)
+        return max(0.0, ts_next - time.monotonic())
+
+    def get_counters(self):
+        return {"pings_sent": self.pings_sent, "pongs_late": self.pongs_late}
+
+
 class PoloniexSocketOperator:
     def __init__(self, connection_type: str, request_data: dict, send_kafka: bool, kafka_config: dict):
         # #Display debug log
         # websocket.enableTrace(True)
 
+        self.ping_payload = request_data["ping_payload"]
+        self.keepalive = PingKeepalive(
+            request_data.get("ping_interval", 20),
+            request_data.get("pong_timeout", 10),
+        )
+        self._keepalive_stop_event = None
+        self.logger = logging.getLogger()
+        # Connection counters, logged every <stats_log_interval> seconds by the keepalive thread.
+        self.stats_log_interval = float(request_data.get("stats_log_interval", 60))
+        self.ts_last_stats_log = None
+        self.connected_count = 0
+        self.reconnect_count = 0
+        self.disconnected_count = 0
+        self.resync_count = 0
+        self.consecutive_resyncs = 0
+        self._resync_requested = False
+        self.ts_subscribed = None
+
         public_uri = "wss://ws.poloniex.com/ws/public"
         private_uri = "wss://ws.poloniex.com/ws/private"
 
@@ -20,17 +112,38 @@ class PoloniexSocketOperator:
             Do something when connection is established.
             """
             wsapp.send(request_data["subscribe_payload"])
+            self.ts_subscribed = time.monotonic()
+            self.connected_count += 1
+            if self.connected_count > 1:
+                self.reconnect_count += 1
+            self._start_keepalive(wsapp)
 
         def on_message(wsapp, message):
             """
             Do something when getting a message from a server.
             """
-            if "pong" not in message:
-                # Send ping to keep connection live
-                wsapp.send(request_data["ping_payload"])
-
-                if "data" in message:
+            if "pong" in message:
+                self.keepalive.on_pong()
+            elif "data" in message:
+                try:
                     self._send_message_to_kafka(json.loads(message))
+                    # The stream has been in sequence long enough: the next resync starts from the minimum backoff.
+                    if time.monotonic() - self.ts_subscribed >= 60:
+                        self.consecutive_resyncs = 0
+                except ResyncRequired as error:
+                    self.logger.warning(f"Resubscribe the websocket ({error})")
+                    self.resync_count += 1
+                    self.consecutive_resyncs += 1
+                    self._resync_requested = True
+                    # run_forever() returns after close() and the caller starts a new connection.
+                    wsapp.close()
+
+        def on_close(wsapp, close_status_code, close_msg):
+            """
+            Do something when connection is closed.
+            """
+            self.disconnected_count += 1
+            self._stop_keepalive()
 
         def on_pong(wsapp, message):
             """
@@ -41,10 +154,12 @@ class PoloniexSocketOperator:
 
         try:
             if connection_type == "public":
-                self.wsapp = websocket.WebSocketApp(public_uri, on_message=on_message, on_pong=on_pong, on_open=on_open)
+                self.wsapp = websocket.WebSocketApp(
+                    public_uri, on_message=on_message, on_pong=on_pong, on_open=on_open, on_close=on_close
+                )
             else:
                 self.wsapp = websocket.WebSocketApp(
-                    private_uri, on_message=on_message, on_pong=on_pong, on_open=on_open
+                    private_uri, on_message=on_message, on_pong=on_pong, on_open=on_open, on_close=on_close
                 )
         except:
             traceback.format_exc()
@@ -58,12 +173,98 @@ class PoloniexSocketOperator:
             self.num_partitions = kafka_config["num_partitions"]
             self.func_process_response = kafka_config["func_process_response"]
 
-            self.kafka_producer = KafkaProducer(self.curr_date, self.curr_timestamp, self.producer_id)
+            # In multiplexed mode, all connections of a producer process share one Kafka producer.
+            if kafka_config.get("kafka_producer") is not None:
+                self.kafka_producer = kafka_config["kafka_producer"]
+            else:
+                self.kafka_producer = KafkaProducer(
+                    self.curr_date, self.curr_timestamp, self.producer_id, kafka_config.get("producer_config")
+                )
 
     def run_forever(self):
         self.wsapp.run_forever(reconnect=1)
+        if self._resync_requested:
+            # The caller subscribes again right after this returns, so back off here to avoid a reconnect storm
+            # on a persistent sequence gap.
+            self._resync_requested = False
+            backoff = get_resync_backoff(self.consecutive_resyncs)
+            self.logger.warning(f"Resubscribe in {backoff:.1f}s ({self.consecutive_resyncs} consecutive resyncs)")
+            time.sleep(backoff)
+
+    def get_counters(self):
+        return {
+            "connected_count": self.connected_count,
+            "reconnect_count": self.reconnect_count,
+            "disconnected_count": self.disconnected_count,
+            "resync_count": self.resync_count,
+            **self.keepalive.get_counters(),
+        }
+
+    def _log_counters(self):
+        ts_now = time.monotonic()
+        if self.ts_last_stats_log is None:
+            self.ts_last_stats_log = ts_now
+        elif ts_now - self.ts_last_stats_log >= self.stats_log_interval:
+            self.ts_last_stats_log = ts_now
+            self.logger.info(f"Connection counters: {self.get_counters()}")
+
+    def _start_keepalive(self, wsapp):
+        self._stop_keepalive()
+        self.keepalive.reset()
+        self._keepalive_stop_event = threading.Event()
+        thread = threading.Thread(target=self._keepalive_loop, args=(wsapp, self._keepalive_stop_event), daemon=True)
+        thread.start()
+
+    def _stop_keepalive(self):
+        if self._keepalive_stop_event is not None:
+            self._keepalive_stop_event.set()
+
+    def _keepalive_loop(self, wsapp, stop_event):
+        while not stop_event.wait(self.keepalive.get_wait_time()):
+            self._log_counters()
+            if self.keepalive.is_pong_late():
+                self.logger.warning(f"Pong timeout. Reconnect the websocket ({self.get_counters()})")
+                # run_forever() returns after close() and the caller starts a new connection.
+                wsapp.close()
+                break
+            if not self.keepalive.is_ping_due():
+                continue
+            try:
+                wsapp.send(self.ping_payload)
+                self.keepalive.on_ping_sent()
+            except Exception as error:
+                # The connection is not monitored any more, so reconnect instead of leaving it as it is.
+                self.logger.warning(f"Failed to send ping ({error}). Reconnect the websocket")
+                wsapp.close()
+                break
 
     def _send_message_to_kafka(self, response):
         message = self.func_process_response(response)
-        self.kafka_producer.produce_message(self.topic_id, json.dumps(message), int(self.num_partitions))
+        # One connection can carry several symbols, so fan the message out per symbol.
+        for symbol, symbol_message in split_message_by_symbol(message):
+            self.kafka_producer.produce_message(
+                self.topic_id,
+                self.kafka_producer.serialize(self.topic_id, symbol_message),
+                int(self.num_partitions),
+                key=symbol,
+            )
         self.kafka_producer.poll_message(timeout=10)
+
+
+def shard_symbols(symbols: list, symbols_per_connection: int) -> list:
+    """
+    Split symbols into groups. Each group is subscribed on one websocket connection.
+    """
+    if symbols_per_connection < 1:
+        symbols_per_connection = len(symbols)
+    return [symbols[i : i + symbols_per_connection] for i in range(0, len(symbols), symbols_per_connection)]
+
+
+def split_message_by_symbol(message: dict) -> list:
+    """
+    Split a processed message ({"data": [...]}) into (symbol, message) pairs, one per symbol ("id").
+    """
+    data_by_symbol = {}
+    for data in message["data"]:
+        data_by_symbol.setdefault(data["id"], []).append(data)
+    return [(symbol, {"data": data}) for symbol, data in data_by_symbol.items()]
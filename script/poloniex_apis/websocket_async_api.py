@@ -0,0 +1,246 @@
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import json
+import random
+import time
+import traceback
+import websockets
+from poloniex_apis.websocket_api import PingKeepalive, ResyncRequired, split_message_by_symbol
+
+
+class ConnectionHealth:
+    """
+    Health state of one websocket connection.
+    state: "connecting" -> "subscribed" -> ("reconnecting" -> "connecting" ...) -> "stopped" or "failed"
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "connecting"
+        self.connected_count = 0
+        self.reconnect_count = 0
+        self.consecutive_failures = 0
+        self.resync_count = 0
+        self.consecutive_resyncs = 0
+        self.messages_received = 0
+        self.messages_produced = 0
+        self.ts_last_message = None
+        self.last_error = None
+        self.keepalive = None
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "state": self.state,
+            "connected_count": self.connected_count,
+            "reconnect_count": self.reconnect_count,
+            "consecutive_failures": self.consecutive_failures,
+            "resync_count": self.resync_count,
+            "messages_received": self.messages_received,
+            "messages_produced": self.messages_produced,
+            "ts_last_message": self.ts_last_message,
+            "last_error": self.last_error,
+            **(self.keepalive.get_counters() if self.keepalive else {}),
+        }
+
+
+class AsyncPoloniexSocketOperator:
+    """
+    asyncio version of PoloniexSocketOperator.
+    One instance holds one websocket connection and reconnects with exponential backoff
+    without blocking the other connections running on the same event loop.
+    """
+
+    public_uri = "wss://ws.poloniex.com/ws/public"
+    private_uri = "wss://ws.poloniex.com/ws/private"
+
+    def __init__(
+        self,
+        name: str,
+        connection_type: str,
+        request_data: dict,
+        kafka_config: dict,
+        reconnect_config: dict,
+    ):
+        self.name = name
+        self.uri = self.public_uri if connection_type == "public" else self.private_uri
+        self.subscribe_payload = request_data["subscribe_payload"]
+        self.ping_payload = request_data["ping_payload"]
+        self.keepalive = PingKeepalive(
+            request_data.get("ping_interval", 20),
+            request_data.get("pong_timeout", 10),
+        )
+
+        self.topic_id = kafka_config["topic_id"]
+        self.num_partitions = int(kafka_config["num_partitions"])
+        self.func_process_response = kafka_config["func_process_response"]
+        self.kafka_producer = kafka_config["kafka_producer"]
+        self.logger = self.kafka_producer.logger
+
+        self.backoff_min = float(reconnect_config.get("backoff_min", 1))
+        self.backoff_max = float(reconnect_config.get("backoff_max", 60))
+        self.max_retry_count = int(reconnect_config.get("max_retry_count", 5))
+
+        self.health = ConnectionHealth(name)
+        self.health.keepalive = self.keepalive
+        self._stopped = False
+
+    async def run_forever(self):
+        while not self._stopped:
+            try:
+                self.health.state = "connecting"
+                async with websockets.connect(self.uri, ping_interval=None) as wsapp:
+                    await self._run_connection(wsapp)
+            except asyncio.CancelledError:
+                break
+            except ResyncRequired as error:
+                # Not a connection failure: subscribe again to get a new snapshot. Resyncs are backed off as well,
+                # so that a persistent sequence gap or a bad snapshot does not cause a reconnect storm.
+                self.health.resync_count += 1
+                self.health.consecutive_resyncs += 1
+                self.health.last_error = str(error)
+                self.health.state = "reconnecting"
+                self.health.reconnect_count += 1
+                backoff = self._get_backoff(self.health.consecutive_resyncs)
+                self.logger.warning(f"{self.name}: resubscribe in {backoff:.1f}s ({error})")
+                await asyncio.sleep(backoff)
+                continue
+            except Exception as error:
+                self.health.last_error = str(error)
+                self.logger.warning(f"{self.name}: websocket error ({error})")
+                self.logger.warning(traceback.format_exc())
+
+            if self._stopped:
+                break
+
+            self.health.consecutive_failures += 1
+            if self.health.consecutive_failures > self.max_retry_count:
+                self.logger.error(f"{self.name}: exceeded max retry count ({self.max_retry_count})")
+                self.health.state = "failed"
+                return
+
+            self.health.state = "reconnecting"
+            self.health.reconnect_count += 1
+            backoff = self._get_backoff(self.health.consecutive_failures)
+            self.logger.warning(
+                f"{self.name}: reconnect in {backoff:.1f}s ({self.health.consecutive_failures}/{self.max_retry_count})"
+            )
+            await asyncio.sleep(backoff)
+
+        self.health.state = "stopped"
+
+    def stop(self):
+        self._stopped = True
+
+    def _get_backoff(self, failure_count: int) -> float:
+        backoff = min(self.backoff_max, self.backoff_min * (2 ** (failure_count - 1)))
+        # Add jitter so that connections dropped at the same time do not reconnect at once.
+        return backoff * random.uniform(0.5, 1.0)
+
+    async def _run_connection(self, wsapp):
+        await wsapp.send(self.subscribe_payload)
+        self.health.state = "subscribed"
+        self.health.connected_count += 1
+
+        self.keepalive.reset()
+        ts_subscribed = time.monotonic()
+        ping_task = asyncio.create_task(self._keepalive(wsapp))
+        try:
+            async for message in wsapp:
+                if "pong" in message:
+                    self.keepalive.on_pong()
+                    continue
+                self.health.messages_received += 1
+                self.health.ts_last_message = int(time.time())
+                if "data" in message:
+                    await self._send_message_to_kafka(json.loads(message))
+                    # Reset the failure count only after data actually flows,
+                    # and the resync count once the stream has been in sequence for <backoff_max> seconds.
+                    self.health.consecutive_failures = 0
+                    if time.monotonic() - ts_subscribed >= self.backoff_max:
+                        self.health.consecutive_resyncs = 0
+        finally:
+            ping_task.cancel()
+
+    async def _keepalive(self, wsapp):
+        while True:
+            await asyncio.sleep(self.keepalive.get_wait_time())
+            if self.keepalive.is_pong_late():
+                self.logger.warning(f"{self.name}: pong timeout ({self.keepalive.get_counters()})")
+                # Closing the connection ends the receive loop and triggers a reconnect.
+                await wsapp.close()
+                return
+            if not self.keepalive.is_ping_due():
+                continue
+            try:
+                await wsapp.send(self.ping_payload)
+                self.keepalive.on_ping_sent()
+            except Exception as error:
+                self.logger.warning(f"{self.name}: failed to send ping ({error})")
+                await wsapp.close()
+                return
+
+    async def _send_message_to_kafka(self, response):
+        message = self.func_process_response(response)
+        for symbol, symbol_message in split_message_by_symbol(message):
+            value = self.kafka_producer.serialize(self.topic_id, symbol_message)
+            while True:
+                try:
+                    self.kafka_producer.produce_message(self.topic_id, value, self.num_partitions, key=symbol)
+                    break
+                except BufferError:
+                    # Local producer queue is full: let delivery reports drain without blocking the loop.
+                    self.kafka_producer.poll_message(timeout=0)
+                    await asyncio.sleep(0.1)
+            self.health.messages_produced += 1
+        self.kafka_producer.poll_message(timeout=0)
+
+
+class AsyncPoloniexEngine:
+    """
+    Run many AsyncPoloniexSocketOperator (candles, book, trades, ...) on one event loop
+    with one shared Kafka producer.
+    """
+
+    def __init__(self, kafka_producer, poll_interval: float = 0.1, health_log_interval: float = 60):
+        self.kafka_producer = kafka_producer
+        self.logger = kafka_producer.logger
+        self.poll_interval = poll_interval
+        self.health_log_interval = health_log_interval
+        self.operators = []
+
+    def add_operator(self, operator: AsyncPoloniexSocketOperator):
+        self.operators.append(operator)
+
+    def get_health(self):
+        return [operator.health.to_dict() for operator in self.operators]
+
+    async def _poll_kafka(self):
+        # Serve delivery callbacks periodically instead of blocking on every message.
+        while True:
+            self.kafka_producer.poll_message(timeout=0)
+            await asyncio.sleep(self.poll_interval)
+
+    async def _log_health(self):
+        while True:
+            await asyncio.sleep(self.health_log_interval)
+            for health in self.get_health():
+                self.logger.info(f"Connection health: {health}")
+
+    async def run(self):
+        background_tasks = [
+            asyncio.create_task(self._poll_kafka()),
+            asyncio.create_task(self._log_health()),
+        ]
+        try:
+            await asyncio.gather(*(operator.run_forever() for operator in self.operators))
+        finally:
+            for task in background_tasks:
+                task.cancel()
+            self.kafka_producer.close()
+
+    def stop(self):
+        for operator in self.operators:
+            operator.stop()
@@ -0,0 +1,19 @@
+import os, sys
+import signal
+import pytest
+
+# Modules are imported as in the scripts (e.g. from common import ...), relative to script/.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The consumer scripts import consumer_operation from their own directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "kafka_consumers"))
+
+
+@pytest.fixture
+def restore_signal_handlers():
+    """
+    consume_to_cassandra installs its own SIGTERM/SIGINT handlers.
+    """
+    handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT)}
+    yield
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
@@ -0,0 +1,25 @@
+from common.candle_aggregator import MinuteCandleAggregator
+
+T0 = 1696156800
+
+
+def _add(aggregator, trade_id, create_time, price=100.0):
+    aggregator.add_trade("BTC_USDT", trade_id, create_time, price, 1.0, price, "buy")
+
+
+def test_first_minute_and_late_minutes_are_dirty():
+    aggregator = MinuteCandleAggregator(allowed_lateness=10)
+    _add(aggregator, 1, T0 + 30)
+    _add(aggregator, 2, T0 + 65)
+    _add(aggregator, 3, T0 + 130)
+
+    closed = aggregator.pop_closed()
+    assert [c["startTime"] for c in closed] == [T0, T0 + 60]
+    # The first minute after a start can miss the trades consumed before it.
+    assert aggregator.dirty_minutes == {("BTC_USDT", T0)}
+
+    # A trade of a closed minute is dropped and its minute is reloaded.
+    _add(aggregator, 4, T0 + 70)
+    assert aggregator.late_trades == 1
+    assert aggregator.dirty_minutes == {("BTC_USDT", T0), ("BTC_USDT", T0 + 60)}
+    assert aggregator.pop_closed() == []
@@ -0,0 +1,183 @@
+import json
+import logging
+import signal
+import pytest
+
+pytest.importorskip("confluent_kafka")
+from kafka_consumers import consumer_operation
+
+TOPIC = "crypto.test"
+NUM_PARTITIONS = 3
+OFFSETS = range(10, 15)
+
+
+class FakeMessage:
+    def __init__(self, partition: int, offset: int, value: dict):
+        self._partition = partition
+        self._offset = offset
+        self._value = value
+
+    def topic(self):
+        return TOPIC
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def value(self):
+        return json.dumps(self._value).encode("utf-8")
+
+    def error(self):
+        return None
+
+
+class FakeFuture:
+    def __init__(self, error: Exception = None):
+        self.error = error
+
+    def add_callbacks(self, callback, errback, callback_args=()):
+        if self.error is None:
+            callback(None, *callback_args)
+        else:
+            errback(self.error)
+
+
+class FakeWriter:
+    """
+    Keep get_key(row) of the written rows. A write including a row whose key is in <failures> fails once.
+    """
+
+    def __init__(self, get_key=lambda row: row, failures=()):
+        self.get_key = get_key
+        self.failures = set(failures)
+        self.written = set()
+
+    def _write(self, rows):
+        keys = set(self.get_key(row) for row in rows)
+        if len(keys & self.failures) > 0:
+            self.failures -= keys
+            raise ValueError(f"cannot write {sorted(keys)}")
+        self.written.update(keys)
+
+    def write(self, rows):
+        self._write(rows)
+
+    def write_async(self, rows):
+        try:
+            self._write(rows)
+        except ValueError as error:
+            return [FakeFuture(error)]
+        return [FakeFuture()]
+
+    def get_stats(self, reset=False):
+        return {}
+
+
+class FakeConsumer:
+    """
+    Messages of the partitions interleaved in offset order. Every commit is checked against the written rows:
+    a committed offset must not pass a message whose rows have not been written.
+    Override get_value/is_written to consume other messages.
+    """
+
+    def __init__(self, writer: FakeWriter):
+        self.writer = writer
+        self.logger = logging.getLogger(__name__)
+        self.order = [(partition, offset) for offset in OFFSETS for partition in range(NUM_PARTITIONS)]
+        self.positions = {partition: OFFSETS[0] for partition in range(NUM_PARTITIONS)}
+        self.committed = {}
+        self.idle_count = 0
+
+    def get_value(self, partition: int, offset: int) -> dict:
+        return {"partition": partition, "offset": offset}
+
+    def is_written(self, partition: int, offset: int) -> bool:
+        return (partition, offset) in self.writer.written
+
+    def _fetch(self, max_messages: int) -> list:
+        messages = []
+        for partition, offset in self.order:
+            if len(messages) >= max_messages:
+                break
+            if offset == self.positions[partition]:
+                messages.append(FakeMessage(partition, offset, self.get_value(partition, offset)))
+                self.positions[partition] = offset + 1
+        if len(messages) == 0:
+            self.idle_count += 1
+            if self.idle_count > 3:
+                # Stop consume_to_cassandra as SIGTERM does.
+                signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+        return messages
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None):
+        pass
+
+    def poll(self, timeout):
+        messages = self._fetch(1)
+        return messages[0] if len(messages) > 0 else None
+
+    def consume_batch(self, max_messages, max_wait):
+        return self._fetch(max_messages)
+
+    def commit(self, offsets, asynchronous=True):
+        for tp in offsets:
+            for offset in range(OFFSETS[0], tp.offset):
+                assert self.is_written(tp.partition, offset), f"committed past unwritten {tp}"
+            self.committed[tp.partition] = max(self.committed.get(tp.partition, 0), tp.offset)
+
+    def seek(self, tp):
+        self.positions[tp.partition] = tp.offset
+
+    def pause(self, partitions):
+        pass
+
+    def resume(self, partitions):
+        pass
+
+    def close(self):
+        pass
+
+    def deserialize(self, msg):
+        return json.loads(msg.value())
+
+
+@pytest.mark.parametrize(
+    "consume_config",
+    [
+        {"mode": "sequential", "commit_mode": "manual"},
+        {"mode": "pipelined"},
+        {"mode": "micro_batch", "flush_interval_ms": "0"},
+    ],
+)
+def test_build_rows_failure_does_not_commit_past_the_failed_message(consume_config, restore_signal_handlers):
+    writer = FakeWriter()
+    consumer = FakeConsumer(writer)
+    # The first message of partition 1 fails once. It is in the middle of the first consume batch,
+    # and partition 1 has no message buffered before it.
+    failures = {(1, OFFSETS[0])}
+
+    def build_rows(data):
+        key = (data["partition"], data["offset"])
+        if key in failures:
+            failures.discard(key)
+            raise ValueError(f"cannot build rows of {key}")
+        return [key]
+
+    config = {"max_retry_count": "3", "retry_backoff_min": "0", "retry_backoff_max": "0", **consume_config}
+    consumer_operation.consume_to_cassandra(consumer, "test_consumer", [TOPIC], writer, build_rows, config)
+
+    assert len(failures) == 0
+    assert writer.written == set(consumer.order)
+    assert consumer.committed == {partition: OFFSETS[-1] + 1 for partition in range(NUM_PARTITIONS)}
+
+
+def test_pipelined_mode_rejects_a_logged_batch_writer():
+    writer = FakeWriter()
+    writer.mode = "logged_batch"
+    consumer = FakeConsumer(writer)
+
+    config = {"mode": "pipelined", "max_retry_count": "3"}
+    with pytest.raises(ValueError):
+        consumer_operation.consume_to_cassandra(consumer, "test_consumer", [TOPIC], writer, lambda data: [], config)
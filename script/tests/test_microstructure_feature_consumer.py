@@ -0,0 +1,106 @@
+import pytest
+
+pytest.importorskip("confluent_kafka")
+pytest.importorskip("cassandra")
+from consumer_operation import consume_to_cassandra
+from microstructure_feature_consumer import FeatureEngine
+from test_consumer_operation import TOPIC, NUM_PARTITIONS, OFFSETS, FakeConsumer, FakeWriter
+
+T0 = 1696156800
+WINDOWS = (1, 60, 300)
+SYMBOLS = ["BTC_USDT", "ETH_USDT", "XRP_USDT"]
+
+
+class FakeProducer:
+    def __init__(self):
+        self.produced = []
+
+    def serialize(self, topic, data):
+        return data
+
+    def produce_message(self, topic, value, num_partitions, key=None):
+        self.produced.append(value)
+
+    def poll_message(self, timeout=None):
+        pass
+
+
+class FakeTradeConsumer(FakeConsumer):
+    """
+    One trade of SYMBOLS[partition] per message, with trade_id <offset> at createTime T0 + <offset>.
+    """
+
+    def get_value(self, partition, offset):
+        trade = {
+            "id": SYMBOLS[partition],
+            "trade_id": offset,
+            "createTime": T0 + offset,
+            "price": 100.0 + offset,
+            "quantity": 1.0,
+            "takerSide": "buy",
+        }
+        return {"data": [trade]}
+
+    def is_written(self, partition, offset):
+        return all((SYMBOLS[partition], window, T0 + offset) in self.writer.written for window in WINDOWS)
+
+
+def _create_engine(emit_interval=1):
+    return FeatureEngine(TOPIC, "crypto.order_book", WINDOWS, 20, emit_interval, FakeProducer(), "features", 3)
+
+
+@pytest.mark.parametrize(
+    "consume_config",
+    [
+        {"mode": "sequential", "commit_mode": "manual"},
+        {"mode": "pipelined"},
+        {"mode": "micro_batch", "flush_interval_ms": "0"},
+    ],
+)
+def test_failed_write_is_rewritten_without_applying_trades_twice(consume_config, restore_signal_handlers):
+    # The features of the first trade of partition 1 fail to be written once.
+    writer = FakeWriter(get_key=lambda row: (row[0], row[1], row[2]), failures={(SYMBOLS[1], 60, T0 + OFFSETS[0])})
+    consumer = FakeTradeConsumer(writer)
+    engine = _create_engine()
+
+    config = {
+        "max_retry_count": "3",
+        "retry_backoff_min": "0",
+        "retry_backoff_max": "0",
+        "pass_topic": True,
+        "pass_partition": True,
+        **consume_config,
+    }
+    consume_to_cassandra(consumer, "test_consumer", [TOPIC], writer, engine.build_rows, config)
+
+    assert len(writer.failures) == 0
+    assert writer.written == set(
+        (SYMBOLS[partition], window, T0 + offset) for partition, offset in consumer.order for window in WINDOWS
+    )
+    assert consumer.committed == {partition: OFFSETS[-1] + 1 for partition in range(NUM_PARTITIONS)}
+    # The replayed trades are counted once and their features are not published again.
+    for symbol in SYMBOLS:
+        assert engine.symbols[symbol].trade_windows[300].sums[5] == len(OFFSETS)
+    assert len(engine.kafka_producer.produced) == len(consumer.order)
+
+
+def _trade(trade_id, create_time, price=100.0):
+    trade = {"id": "BTC_USDT", "trade_id": trade_id, "createTime": create_time, "price": price, "quantity": 1.0}
+    return {"data": [{**trade, "takerSide": "buy"}]}
+
+
+def test_features_are_emitted_once_per_emit_interval():
+    engine = _create_engine(emit_interval=60)
+
+    assert len(engine.build_rows(_trade(1, T0), TOPIC, 0)) == len(WINDOWS)
+    assert engine.build_rows(_trade(2, T0 + 30), TOPIC, 0) == []
+    rows = engine.build_rows(_trade(3, T0 + 60), TOPIC, 0)
+
+    assert [(row[0], row[1], row[2]) for row in rows] == [("BTC_USDT", window, T0 + 60) for window in WINDOWS]
+    # trade_count of the 300 seconds window includes the trade of the throttled message.
+    assert rows[2][4] == 3
+    # A trade consumed again is not applied again: the features emitted when it was applied are returned.
+    replayed = engine.build_rows(_trade(3, T0 + 60), TOPIC, 0)
+    assert [row[:12] for row in replayed] == [row[:12] for row in rows]
+    # The ids are tracked per partition.
+    assert engine.build_rows(_trade(3, T0 + 120), TOPIC, 1)[2][4] == 4
@@ -0,0 +1,112 @@
+import os
+import json
+import pytest
+import numpy as np
+from common.order_book import OrderBook, SequenceGapError
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "book_lv2")
+
+# Top 3 levels after snapshot.jsonl and updates.jsonl
+EXPECTED_ASKS = [[30010.8, 0.2], [30011.0, 1.5], [30012.0, 0.8]]
+EXPECTED_BIDS = [[30010.2, 0.3], [30010.0, 0.7], [30008.0, 3.0]]
+
+
+def _load_messages(name: str) -> list:
+    """
+    Websocket messages of the "book_lv2" channel, one per line.
+    """
+    with open(os.path.join(FIXTURE_DIR, name), "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _replay(book: OrderBook, messages: list):
+    for message in messages:
+        for data in message["data"]:
+            if message["action"] == "snapshot":
+                book.apply_snapshot(data["asks"], data["bids"], data["id"])
+            else:
+                book.apply_update(data["asks"], data["bids"], data["id"], data["lastId"])
+
+
+def test_replay_builds_top_of_book():
+    book = OrderBook("BTC_USDT")
+    _replay(book, _load_messages("snapshot.jsonl") + _load_messages("updates.jsonl"))
+
+    assert book.get_top(3) == (EXPECTED_ASKS, EXPECTED_BIDS)
+    assert book.seqid == 1003
+    assert len(book) == 8
+    assert book.get_best_ask() == (30010.8, 0.2)
+    assert book.get_best_bid() == (30010.2, 0.3)
+    assert book.get_spread() == pytest.approx(0.6)
+    assert book.get_mid_price() == pytest.approx(30010.5)
+
+
+def test_sequence_gap_raises_and_clears_book():
+    book = OrderBook("BTC_USDT")
+    _replay(book, _load_messages("snapshot.jsonl") + _load_messages("updates.jsonl"))
+    in_sequence, gap = _load_messages("gap.jsonl")
+    _replay(book, [in_sequence])
+
+    with pytest.raises(SequenceGapError):
+        _replay(book, [gap])
+    assert not book.is_synced()
+    assert len(book) == 0
+
+    # Updates are not applied until a new snapshot arrives.
+    with pytest.raises(SequenceGapError):
+        _replay(book, _load_messages("updates.jsonl")[:1])
+
+
+def test_snapshot_replaces_book():
+    book = OrderBook("BTC_USDT")
+    _replay(book, _load_messages("snapshot.jsonl") + _load_messages("updates.jsonl"))
+    _replay(book, _load_messages("resnapshot.jsonl"))
+
+    # No level of the previous book is left.
+    assert book.get_top(10) == ([[30020.0, 1.0], [30021.0, 2.0]], [[30019.5, 0.1], [30019.0, 1.5], [30018.0, 0.5]])
+    assert book.seqid == 2001
+
+
+def test_to_numpy_fills_out_in_place():
+    book = OrderBook("BTC_USDT")
+    _replay(book, _load_messages("resnapshot.jsonl"))
+    out = np.zeros((2, 4, 2))
+
+    res = book.to_numpy(4, out)
+
+    assert res is out
+    np.testing.assert_array_equal(out[0, :2], [[30020.0, 1.0], [30021.0, 2.0]])
+    np.testing.assert_array_equal(out[1, :3], [[30019.5, 0.1], [30019.0, 1.5], [30018.0, 0.5]])
+    # Missing levels are NaN.
+    assert np.isnan(out[0, 2:]).all() and np.isnan(out[1, 3:]).all()
+
+
+def test_delta_processor_replay_and_resync():
+    pytest.importorskip("confluent_kafka")
+    pytest.importorskip("websocket")
+    from poloniex_apis import websocket_api
+    from kafka_producers.order_book_delta_producer import OrderBookDeltaProcessor
+
+    processor = OrderBookDeltaProcessor(emit_mode="delta", depth=3, checkpoint_interval=60)
+    records = []
+    for message in _load_messages("snapshot.jsonl") + _load_messages("updates.jsonl"):
+        records.extend(processor(message)["data"])
+
+    assert [record["action"] for record in records] == ["snapshot", "update", "update", "update"]
+    assert records[1]["asks"] == [[30010.5, 0.0]]
+    assert records[1]["bids"] == [[30010.2, 0.3]]
+    assert processor.books["BTC_USDT"].get_top(3) == (EXPECTED_ASKS, EXPECTED_BIDS)
+
+    in_sequence, gap = _load_messages("gap.jsonl")
+    processor(in_sequence)
+    with pytest.raises(websocket_api.ResyncRequired):
+        processor(gap)
+    assert not processor.books["BTC_USDT"].is_synced()
+
+    # The snapshot of the new subscription restores the book and is emitted with all its levels.
+    records = []
+    for message in _load_messages("resnapshot.jsonl"):
+        records.extend(processor(message)["data"])
+    assert [record["action"] for record in records] == ["snapshot", "update"]
+    assert records[0]["asks"] == [[30020.0, 1.0], [30021.0, 2.0]]
+    assert processor.books["BTC_USDT"].seqid == 2001
@@ -0,0 +1,93 @@
+import math
+import pytest
+from common.rolling_features import RollingSum, SymbolFeatures
+
+T0 = 1696156800
+
+
+def test_rolling_sum_evicts_entries_out_of_the_window():
+    rolling_sum = RollingSum(60, 2)
+    rolling_sum.add(T0, (1.0, 10.0))
+    rolling_sum.add(T0 + 30, (2.0, 20.0))
+    rolling_sum.add(T0 + 60, (4.0, 40.0))
+
+    rolling_sum.evict(T0 + 60)
+    assert rolling_sum.sums == [6.0, 60.0]
+    rolling_sum.evict(T0 + 119)
+    assert rolling_sum.sums == [4.0, 40.0]
+    rolling_sum.evict(T0 + 120)
+    assert rolling_sum.sums == [0.0, 0.0]
+    assert len(rolling_sum.entries) == 0
+
+
+def test_rolling_sum_adds_late_entries_at_the_last_time():
+    rolling_sum = RollingSum(60, 1)
+    rolling_sum.add(T0 + 100, (1.0,))
+    # Without clamping, this entry would stay at the head and block the eviction of the other one.
+    rolling_sum.add(T0, (2.0,))
+    assert [ts for ts, _ in rolling_sum.entries] == [T0 + 100, T0 + 100]
+
+    rolling_sum.evict(T0 + 159)
+    assert rolling_sum.sums == [3.0]
+    rolling_sum.evict(T0 + 160)
+    assert rolling_sum.sums == [0.0]
+
+
+def _get_features(features: SymbolFeatures) -> dict:
+    return {record["window_sec"]: record for record in features.get_features()}
+
+
+def test_trade_features():
+    features = SymbolFeatures("BTC_USDT", windows=(1, 60))
+    features.on_trade(T0, 100.0, 1.0, "buy")
+    features.on_trade(T0 + 1, 110.0, 3.0, "sell")
+
+    by_window = _get_features(features)
+    assert by_window[60]["ts_feature"] == T0 + 1
+    assert by_window[60]["trade_count"] == 2
+    assert by_window[60]["vwap"] == pytest.approx((100.0 * 1.0 + 110.0 * 3.0) / 4.0)
+    assert by_window[60]["buy_quantity"] == 1.0
+    assert by_window[60]["sell_quantity"] == 3.0
+    assert by_window[60]["trade_imbalance"] == pytest.approx(-0.5)
+    assert by_window[60]["realized_volatility"] == pytest.approx(math.log(1.1))
+    # The first trade is out of the 1 second window.
+    assert by_window[1]["trade_count"] == 1
+    assert by_window[1]["vwap"] == pytest.approx(110.0)
+    assert by_window[1]["trade_imbalance"] == pytest.approx(-1.0)
+    # No book yet
+    assert math.isnan(by_window[60]["spread"]) and math.isnan(by_window[60]["mid_price"])
+
+
+def test_book_features():
+    features = SymbolFeatures("BTC_USDT", windows=(60,), depth=1)
+    features.on_book(T0, [["101", "1"], ["102", "5"]], [["99", "3"], ["98", "5"]], 1)
+    features.on_book(T0 + 1, [["100.5", "2"]], [["99.5", "2"]], 2)
+    # A book without one of its sides has no spread and is not added.
+    features.on_book(T0 + 2, [], [["99.5", "2"]], 3)
+
+    record = _get_features(features)[60]
+    assert record["ts_feature"] == T0 + 1
+    assert record["spread"] == pytest.approx((2.0 + 1.0) / 2)
+    # Imbalance of the best level only: (3 - 1) / 4 and (2 - 2) / 4
+    assert record["depth_imbalance"] == pytest.approx((0.5 + 0.0) / 2)
+    assert record["trade_count"] == 0
+    assert math.isnan(record["vwap"])
+
+
+def test_late_trades_are_added_at_the_latest_event_time():
+    features = SymbolFeatures("BTC_USDT", windows=(60,))
+    features.on_trade(T0 + 100, 100.0, 1.0, "buy")
+    assert _get_features(features)[60]["trade_count"] == 1
+    # A trade of another partition consumed later is counted in the window of the latest event time.
+    features.on_trade(T0, 100.0, 2.0, "sell")
+
+    record = _get_features(features)[60]
+    assert record["ts_feature"] == T0 + 100
+    assert record["trade_count"] == 2
+
+    features.on_trade(T0 + 160, 100.0, 4.0, "buy")
+    record = _get_features(features)[60]
+    # Both trades are evicted together.
+    assert record["trade_count"] == 1
+    assert record["buy_quantity"] == 4.0
+    assert record["sell_quantity"] == 0.0
@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("confluent_kafka")
+pytest.importorskip("websocket")
+from poloniex_apis import websocket_api
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(websocket_api.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_pong_deadline_shorter_than_ping_interval(clock):
+    keepalive = websocket_api.PingKeepalive(ping_interval=20, pong_timeout=10)
+    assert keepalive.get_wait_time() == 20
+    assert not keepalive.is_ping_due()
+
+    clock[0] += 20
+    assert keepalive.is_ping_due()
+    keepalive.on_ping_sent()
+    # The pong deadline comes before the next ping.
+    assert keepalive.get_wait_time() == 10
+
+    clock[0] += 10
+    assert keepalive.is_pong_late()
+    assert keepalive.get_counters() == {"pings_sent": 1, "pongs_late": 1}
+
+
+def test_pong_deadline_longer_than_ping_interval(clock):
+    keepalive = websocket_api.PingKeepalive(ping_interval=5, pong_timeout=12)
+    for _ in range(3):
+        clock[0] += 5
+        assert not keepalive.is_pong_late()
+        keepalive.on_ping_sent()
+
+    # The deadline is counted from the oldest unanswered ping, not from the last one.
+    assert keepalive.get_wait_time() == 2
+    clock[0] += 2
+    assert keepalive.is_pong_late()
+
+
+def test_pong_clears_the_deadline(clock):
+    keepalive = websocket_api.PingKeepalive(ping_interval=20, pong_timeout=10)
+    clock[0] += 20
+    keepalive.on_ping_sent()
+    clock[0] += 5
+    keepalive.on_pong()
+
+    clock[0] += 10
+    assert not keepalive.is_pong_late()
+    assert keepalive.get_wait_time() == 5